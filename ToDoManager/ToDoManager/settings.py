@@ -2,6 +2,7 @@
 Django settings for ToDoManager project.
 
 Generated by 'django-admin startproject' using Django 4.2.20.
+目前需要 Django 5.0 以上 (見 requirements.txt)
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/topics/settings/
@@ -10,6 +11,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,11 +43,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'ToDos.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'ToDos.sharding.ShardMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -54,7 +58,7 @@ ROOT_URLCONF = 'ToDoManager.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'ToDos.timing.TimedDjangoTemplates',    # DjangoTemplates 加上 render 計時
         'DIRS': [BASE_DIR/'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -70,6 +74,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'ToDoManager.wsgi.application'
 
+# 待辦清單 / 新增 / 切換 / 刪除改用 ToDos.async_views asgi.py 預設開啟
+TODO_ASYNC_VIEWS = os.environ.get('TODO_ASYNC_VIEWS', '0') == '1'
+
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
@@ -77,10 +84,106 @@ WSGI_APPLICATION = 'ToDoManager.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('TODO_DB_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
+# TODO_DB_PROFILE=production 時啟用適合併發寫入的 SQLite 設定
+# WAL 讓讀取不被寫入阻擋 交易一律 BEGIN IMMEDIATE 在開始時就取得寫入鎖 避免升級鎖時直接失敗
+# busy_timeout 讓 SQLite 自行等待鎖 連線保留 CONN_MAX_AGE 秒重複使用 每個新連線都會執行 init_command
+SQLITE_PRODUCTION_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA temp_store=MEMORY',
+]
+
+if os.environ.get('TODO_DB_PROFILE') == 'production':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': ';'.join(SQLITE_PRODUCTION_PRAGMAS),
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 5,
+        },
+    })
+
+# ToDos.operations 的寫入遇到 database is locked 時的重試次數 (指數退避)
+TODO_WRITE_RETRIES = int(os.environ.get('TODO_WRITE_RETRIES', '5'))
+
+# 依使用者分片 (ToDos.sharding) TODO_SHARDS=N 時待辦資料分散到 N 個 SQLite 檔案 auth / session 留在 default
+# 各分片沿用 default 的設定 (含 TODO_DB_PROFILE) 檔名為 TODO_SHARD_PATH 代入分片編號
+TODO_SHARDS = int(os.environ.get('TODO_SHARDS', '0'))
+TODO_SHARD_PATH = os.environ.get('TODO_SHARD_PATH', str(BASE_DIR / 'db_shard{}.sqlite3'))
+TODO_SHARD_ALIASES = [f'shard{index}' for index in range(TODO_SHARDS)]
+# 使用者所在分片的快取秒數 rebalance_shards 每個步驟之間會等待這段時間
+TODO_SHARD_PLACEMENT_TIMEOUT = 10
+
+for index, alias in enumerate(TODO_SHARD_ALIASES):
+    DATABASES[alias] = {**DATABASES['default'], 'NAME': TODO_SHARD_PATH.format(index)}
+
+if TODO_SHARD_ALIASES:
+    DATABASE_ROUTERS = ['ToDos.sharding.UserShardRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# 以環境變數 TODO_CACHE 切換快取後端 locmem (預設) 或 file
+
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'todos',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+    },
+}
+
+CACHES = {
+    'default': CACHE_BACKENDS[os.environ.get('TODO_CACHE', 'locmem')],
+}
+
+# 待辦清單片段的快取秒數 失效主要靠版本號 這只是上限
+TODO_LIST_CACHE_TIMEOUT = 300
+
+
+# Request timing
+# ToDos.middleware.RequestTimingMiddleware 的設定 慢請求以 JSON 一行一筆寫入 slow_requests.jsonl
+
+TODO_TIMING = {
+    'SAMPLE_RATE': float(os.environ.get('TODO_TIMING_SAMPLE_RATE', '1.0')),
+    'SLOW_REQUEST_MS': 500,
+    'SLOWEST_QUERIES': 5,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message_only': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'slow_requests': {
+            'class': 'logging.FileHandler',
+            'filename': BASE_DIR / 'slow_requests.jsonl',
+            'formatter': 'message_only',
+            'delay': True,
+        },
+    },
+    'loggers': {
+        'ToDos.slow_requests': {
+            'handlers': ['slow_requests'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -101,6 +204,48 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing
+# https://docs.djangoproject.com/en/4.2/topics/auth/passwords/
+# 測試改用低迭代次數的 PBKDF2 見 ToDoManager.test_settings
+
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+# 登入失敗次數限制 (ToDos.throttle) 時間窗內同一帳號或同一 IP 失敗達上限即拒絕 不計算雜湊
+TODO_LOGIN_THROTTLE = {
+    'USERNAME_LIMIT': 5,
+    'IP_LIMIT': 50,
+    'WINDOW': 300,
+}
+
+# 到期提醒 (ToDos.reminders / manage.py remind_todos)
+# 提醒截止日期在今天起 DAYS_AHEAD 天內的未完成待辦 worker 每 INTERVAL 秒掃描一次
+# 認領後超過 LEASE 秒仍未寄出 (worker 中斷) 的提醒會重新寄送
+TODO_REMINDERS = {
+    'DAYS_AHEAD': 1,
+    'BATCH_SIZE': 500,
+    'INTERVAL': 60,
+    'LEASE': 300,
+    'FROM_EMAIL': None,     #None 時使用 DEFAULT_FROM_EMAIL
+}
+
+# 重複待辦 (ToDos.recurrence) 清單只展開到今天之後 HORIZON_DAYS 天
+TODO_RECURRENCE = {
+    'HORIZON_DAYS': 90,
+}
+
+# /todos/changes 的 tombstone 保留天數 manage.py prune_tombstones 刪除更早的 tombstone
+# 早於這個期限的游標可能漏掉已被清除的刪除紀錄 伺服器回 410 要求客戶端以空游標完整同步
+TODO_TOMBSTONE_RETENTION_DAYS = int(os.environ.get('TODO_TOMBSTONE_RETENTION_DAYS', '30'))
+
+# 預設把郵件輸出到終端機 正式環境以 TODO_EMAIL_BACKEND 指定 (例如 django.core.mail.backends.smtp.EmailBackend)
+EMAIL_BACKEND = os.environ.get('TODO_EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -0,0 +1,13 @@
+"""
+測試用設定 python manage.py test 預設使用這個模組 (見 manage.py)
+pytest-django / python -m django test 等其他執行方式請設定 DJANGO_SETTINGS_MODULE=ToDoManager.test_settings
+"""
+from ToDoManager.settings import *  # noqa: F401,F403
+
+# 低迭代次數的 PBKDF2 雜湊格式不變 只是建立使用者與登入快很多
+PASSWORD_HASHERS = ['ToDos.hashers.FastPBKDF2PasswordHasher', *PASSWORD_HASHERS]
+
+# 分片的測試 (ShardingTests) 以 override_settings 啟用 router 這裡只先準備兩個分片的連線
+if not TODO_SHARD_ALIASES:
+    for index, alias in enumerate(['shard0', 'shard1']):
+        DATABASES[alias] = {**DATABASES['default'], 'NAME': TODO_SHARD_PATH.format(index)}
@@ -14,20 +14,32 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
 from ToDos  import views
+from ToDos import async_views
+
+# 以 ASGI 部署時 (TODO_ASYNC_VIEWS) 主要路徑改用非同步 views
+todo_views = async_views if settings.TODO_ASYNC_VIEWS else views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('login/' , views.login_view , name = 'login_view'),
     path('register/' , views.register , name = 'register'),
-    path('todos/' , views.todos , name = 'todos'),
+    path('todos/' , todo_views.todos , name = 'todos'),
     path('logout/' , views.logout_view , name = 'logout_view'),
-    path('todos/add/' , views.add_todo , name = 'add_todo'),
+    path('todos/add/' , todo_views.add_todo , name = 'add_todo'),
     path('todos/edit/<int:id>' , views.edit_todo , name = 'edit_todo'),
     path('todos/to_confirm_page/<int:id>' , views.to_confirm_page , name = 'to_confirm_page') , 
-    path('todos/delete/<int:id>' , views.confirm_delete , name = 'confirm_delete'),
-    path('todos/toggle/<int:id>' , views.toggle_todo , name = 'toggle_todo'),
+    path('todos/delete/<int:id>' , todo_views.confirm_delete , name = 'confirm_delete'),
+    path('todos/toggle/<int:id>' , todo_views.toggle_todo , name = 'toggle_todo'),
+    path('todos/export' , views.export_todos , name = 'export_todos'),
+    path('todos/bulk' , views.bulk_action , name = 'bulk_action'),
+    path('todos/changes' , views.todo_changes , name = 'todo_changes'),
+    path('todos/calendar' , views.todo_calendar , name = 'todo_calendar'),
+    path('todos/recurring/<int:recurrence_id>/<str:date>/toggle' , views.toggle_occurrence , name = 'toggle_occurrence'),
+    path('todos/recurring/<int:recurrence_id>/<str:date>/edit' , views.edit_occurrence , name = 'edit_occurrence'),
+    path('todos/recurring/<int:recurrence_id>/<str:date>/delete' , views.skip_occurrence , name = 'skip_occurrence'),
     
 ]
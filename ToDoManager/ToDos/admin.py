@@ -1,5 +1,144 @@
 from django.contrib import admin
+from django.contrib.auth.admin import UserAdmin
+from django.contrib.auth.models import User
+from django.http import QueryDict
+from ToDos import operations , purge , sharding , stats
+from .cache import invalidate_calendar_months
 from .models import ToDo
+from .pagination import EstimatedCountPaginator
 # Register your models here.
 
-admin.site.register(ToDo)
+
+class IndexedBooleanFieldListFilter(admin.BooleanFieldListFilter):
+    # Django 在 SQLite 把 completed = True 寫成 WHERE "completed" 無法用索引定位 改寫成 IN (...) 讓索引前綴生效
+    def queryset(self, request, queryset):
+        if self.lookup_val in ('0', '1') and self.lookup_val2 is None:
+            return queryset.filter(**{f'{self.field_path}__in': [self.lookup_val == '1']})
+        return super().queryset(request, queryset)
+
+
+def get_admin_shard(request):
+    # 分片時 admin 一次只查詢一個分片 ?shard= 指定 預設為第一個 編輯頁從 _changelist_filters 取得
+    params = request.GET
+    if '_changelist_filters' in params:
+        params = QueryDict(params['_changelist_filters'])
+    shard = params.get(ShardListFilter.parameter_name)
+    return shard if shard in sharding.aliases() else sharding.aliases()[0]
+
+
+class ShardListFilter(admin.SimpleListFilter):
+    # 沒有「全部」選項 各分片的 id 各自編號 跨分片無法一起排序與分頁
+    title = '分片'
+    parameter_name = 'shard'
+
+    def __init__(self, request, params, model, model_admin):
+        self.shard = get_admin_shard(request)
+        super().__init__(request, params, model, model_admin)
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in sharding.aliases()]
+
+    def queryset(self, request, queryset):
+        return queryset     #ToDoAdmin.get_queryset 已以 using() 指定分片
+
+    def choices(self, changelist):
+        for alias, title in self.lookup_choices:
+            yield {
+                'selected': alias == self.shard,
+                'query_string': changelist.get_query_string({self.parameter_name: alias}),
+                'display': title,
+            }
+
+
+@admin.register(ToDo)
+class ToDoAdmin(admin.ModelAdmin):
+    # 資料量大時 changelist 的成本要與總筆數無關
+    # 不做完整 COUNT(*) / 不載入使用者下拉選單 / 排序與篩選都能直接走索引 (見 ToDo.Meta.indexes)
+    list_display = ('title', 'user', 'due_date', 'priority', 'completed')
+    list_select_related = ('user',)   #分片時 User 在另一個資料庫 見 get_list_select_related
+    list_filter = (('completed', IndexedBooleanFieldListFilter), 'priority', 'due_date')
+    ordering = ('-due_date', '-id')
+    sortable_by = ('due_date',)     #其他欄位排序需要整張表排序
+    show_facets = admin.ShowFacets.NEVER
+    raw_id_fields = ('user',)
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    actions = ['mark_completed', 'mark_incomplete']
+
+    def get_queryset(self, request):
+        # 分片時明確指定分片 (見 ShardListFilter) 不依登入者所在的分片
+        queryset = super().get_queryset(request)
+        return queryset.using(get_admin_shard(request)) if sharding.enabled() else queryset
+
+    def get_list_filter(self, request):
+        return (ShardListFilter, *self.list_filter) if sharding.enabled() else self.list_filter
+
+    def get_list_select_related(self, request):
+        # 分片時使用者在 default 上 無法 JOIN
+        return () if sharding.enabled() else self.list_select_related
+
+    def get_readonly_fields(self, request, obj=None):
+        # 分片時換擁有者等於把待辦搬到另一個分片 admin 不提供 (新增時仍可選擇)
+        if sharding.enabled() and obj is not None:
+            return ('user', *self.readonly_fields)
+        return self.readonly_fields
+
+    @admin.action(description='標記為已完成')
+    def mark_completed(self, request, queryset):
+        count = operations.queryset_set_completed(queryset, True)
+        self.message_user(request, f'已將 {count} 筆標記為已完成')
+
+    @admin.action(description='標記為未完成')
+    def mark_incomplete(self, request, queryset):
+        count = operations.queryset_set_completed(queryset, False)
+        self.message_user(request, f'已將 {count} 筆標記為未完成')
+
+    def save_model(self, request, obj, form, change):
+        # 單筆新增 / 修改也經過 operations 統計才不會偏差
+        if not change:
+            operations.create_todo(obj)
+        elif 'user' in form.changed_data:
+            # 換了擁有者 兩位使用者的統計都重算
+            obj.save()
+            stats.rebuild_stats(User(pk = form.initial['user']))
+            stats.rebuild_stats(obj.user)
+            invalidate_calendar_months(form.initial['user'] , [form.initial['due_date']])
+            invalidate_calendar_months(obj.user_id , [obj.due_date])
+        else:
+            operations.update_todo(obj, form.initial['completed'], form.initial['due_date'])
+
+    def delete_model(self, request, obj):
+        operations.delete_todo(obj)
+
+    def delete_queryset(self, request, queryset):
+        # 內建的「刪除所選」確認後呼叫這裡 以一個 DELETE 取代逐筆刪除
+        operations.queryset_delete(queryset)
+
+
+admin.site.unregister(User)
+
+
+@admin.register(User)
+class PurgingUserAdmin(UserAdmin):
+    # 內建的刪除會讓 collector 把使用者的所有待辦讀進記憶體 (確認頁也要列出每一筆) 並在一個交易中刪除
+    # 改以 purge_users 動作分批刪除 (見 ToDos.purge) 單筆刪除頁停用
+    actions = ['purge_users']
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def has_delete_permission(self, request, obj=None):
+        if obj is not None:
+            return False
+        return super().has_delete_permission(request)
+
+    @admin.action(description='分批刪除所選使用者與其待辦', permissions=['delete'])
+    def purge_users(self, request, queryset):
+        # 只停用並排入佇列 待辦很多的使用者刪除要很久 不在請求中執行 (見 ToDos.purge)
+        user_ids = list(queryset.exclude(pk = request.user.pk).values_list('id', flat=True))
+        if len(user_ids) < queryset.count():
+            self.message_user(request, '無法刪除目前登入的帳號', level = 'warning')
+        count = purge.queue_users(user_ids)
+        self.message_user(request, f'已停用 {len(user_ids)} 位使用者 新排入刪除佇列 {count} 位 由 manage.py purge_users --queued 分批刪除')
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class TodosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ToDos'
+
+    def ready(self):
+        from ToDos import signals  # noqa: F401  註冊 signal receivers
@@ -0,0 +1,96 @@
+"""
+已完成待辦的冷熱分離 截止日期早於指定天數的已完成待辦搬到 ArchivedToDo
+
+每一批在自己的短交易中以 INSERT ... SELECT + DELETE 搬移 寫入鎖只持有一批的時間 可在服務運作中執行
+id 原樣保留 還原時搬回 ToDo 的同一個 id (兩張表的 id 不會重複 ToDo 的自動編號不重複使用)
+對 /todos/changes 而言封存等同刪除 (寫入 ToDoTombstone) 還原時移除 tombstone 並更新 updated_at
+統計只計算 ToDo 中的待辦 搬移時一併增減 封存的都是已完成的待辦 不影響逾期的分布
+"""
+import collections
+
+from django.utils import timezone
+
+from ToDos import search, sharding, stats
+from ToDos.cache import invalidate_calendar_months, invalidate_user_lists
+from ToDos.changes import write_tombstones
+from ToDos.models import ArchivedToDo, ToDo, ToDoTombstone
+from ToDos.operations import retry_on_locked
+from ToDos.sharding import connection
+
+DEFAULT_BATCH_SIZE = 500
+COLUMNS = ['id', 'user_id', 'title', 'description', 'due_date', 'priority', 'completed', 'created_at']
+
+
+def _move(source, target, ids, extra_columns=None):
+    # 把 source 中的 ids 搬到 target extra_columns 為只存在於 target 的欄位與值
+    quote = connection.ops.quote_name
+    extra_columns = extra_columns or {}
+    columns = ', '.join(quote(column) for column in COLUMNS)
+    target_columns = ', '.join([columns, *(quote(column) for column in extra_columns)])
+    selected = ', '.join([columns, *(['%s'] * len(extra_columns))])
+    placeholders = ', '.join(['%s'] * len(ids))
+    source_table, target_table = quote(source._meta.db_table), quote(target._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {target_table} ({target_columns}) SELECT {selected} FROM {source_table} WHERE id IN ({placeholders})',
+            [*extra_columns.values(), *ids],
+        )
+        cursor.execute(f'DELETE FROM {source_table} WHERE id IN ({placeholders})', ids)
+
+
+def _finish(rows, sign):
+    # rows 為搬移的 (id, user_id, due_date) sign 為 ToDo 筆數的增減方向 月曆只計算 ToDo 搬移的月份需失效
+    counts = collections.Counter(user_id for _, user_id, _ in rows)
+    due_dates = collections.defaultdict(set)
+    for _, user_id, due_date in rows:
+        due_dates[user_id].add(due_date)
+    for user_id, count in counts.items():
+        stats.record_bulk(user_id, total=sign * count, completed=sign * count)
+        invalidate_calendar_months(user_id, due_dates[user_id])
+    return counts
+
+
+@retry_on_locked
+def archive_batch(cutoff, batch_size=DEFAULT_BATCH_SIZE, user_id=None):
+    """
+    封存一批 due_date 早於 cutoff 的已完成待辦 回傳搬移的筆數 0 表示已沒有可封存的資料
+    沒有指定 user_id 時處理目前的分片 (見 sharding.each_shard)
+    """
+    with sharding.atomic(user_id):
+        queryset = ToDo.objects.filter(completed=True, due_date__lt=cutoff)
+        if user_id is not None:
+            queryset = queryset.filter(user_id=user_id)
+        rows = list(queryset.select_for_update().order_by('id').values_list('id', 'user_id', 'due_date')[:batch_size])
+        if not rows:
+            return 0
+        ids = [todo_id for todo_id, _, _ in rows]
+        _move(ToDo, ArchivedToDo, ids, {'archived_at': connection.ops.adapt_datetimefield_value(timezone.now())})
+        counts = _finish(rows, -1)
+        write_tombstones([(user_id, todo_id) for todo_id, user_id, _ in rows])
+        search.unindex_todos(ids)
+    for user_id in counts:
+        invalidate_user_lists(user_id)
+    return len(rows)
+
+
+@retry_on_locked
+def restore_batch(batch_size=DEFAULT_BATCH_SIZE, user_id=None, todo_ids=None):
+    # 把封存的待辦搬回 ToDo 回傳搬移的筆數
+    with sharding.atomic(user_id):
+        queryset = ArchivedToDo.objects.all()
+        if user_id is not None:
+            queryset = queryset.filter(user_id=user_id)
+        if todo_ids is not None:
+            queryset = queryset.filter(id__in=todo_ids)
+        rows = list(queryset.select_for_update().order_by('id').values_list('id', 'user_id', 'due_date')[:batch_size])
+        if not rows:
+            return 0
+        ids = [todo_id for todo_id, _, _ in rows]
+        _move(ArchivedToDo, ToDo, ids, {'updated_at': connection.ops.adapt_datetimefield_value(timezone.now())})
+        ToDoTombstone.objects.filter(todo_id__in=ids).delete()
+        counts = _finish(rows, 1)
+        search.index_todos(ToDo.objects.filter(id__in=ids))
+    for user_id in counts:
+        invalidate_user_lists(user_id)
+    return len(rows)
+
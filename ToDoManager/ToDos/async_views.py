@@ -0,0 +1,137 @@
+"""
+待辦清單主要路徑的非同步版本 以 ASGI 部署時由 urls.py 改用這些 views
+
+讀取使用 Django 的 async ORM 寫入需要交易 (async ORM 無法在 transaction.atomic 中使用)
+因此透過 sync_to_async 呼叫與同步 views 共用的 ToDos.operations
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.views import redirect_to_login
+from django.core.cache import cache
+from django.http import Http404
+from django.shortcuts import redirect, render
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+
+from ToDos import fragments, operations, recurrence, search, stats
+from ToDos.cache import alist_cache_key, get_list_cache_timeout
+from ToDos.form import AddTodoForm
+from ToDos.models import ToDo
+from ToDos.pagination import SEARCH_SORT, akeyset_page, get_page_size, get_sort
+from ToDos.views import get_archived_todos, get_filtered_todos, get_virtual_todos
+
+
+def async_login_required(view=None, login_url=None):
+    # 與 login_required 相同 但以 auser() 取得使用者 並放回 request.user 讓範本可直接使用
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            request.user = await request.auser()
+            if not request.user.is_authenticated:
+                return redirect_to_login(request.get_full_path(), login_url or settings.LOGIN_URL)
+            return await view_func(request, *args, **kwargs)
+        return wrapper
+    if view is not None:
+        return decorator(view)
+    return decorator
+
+
+async def aget_todo_or_404(**kwargs):
+    try:
+        return await ToDo.objects.aget(**kwargs)
+    except ToDo.DoesNotExist:
+        raise Http404('No ToDo matches the given query.')
+
+
+@async_login_required(login_url='login_view')
+async def todos(request):
+    filter_option = request.GET.get('filter', 'all')
+    page_size = get_page_size(request.GET.get('page_size'))
+    cursor = request.GET.get('after', '')
+    query = request.GET.get('q', '').strip()
+    include_archived = request.GET.get('include_archived') == '1'
+    sort = get_sort(request.GET.get('sort'))
+    today = timezone.now()
+
+    cache_key = await alist_cache_key(
+        request.user.id, filter_option, page_size, cursor, query, include_archived, sort, timezone.localdate(today)
+    )
+    cached = await cache.aget(cache_key)
+    if cached is None:
+        todos_list = get_filtered_todos(request.user, filter_option).with_overdue(timezone.localdate(today))
+        if query:
+            page, next_cursor = await akeyset_page(
+                search.search(todos_list, request.user.id, query), cursor, page_size, sort=SEARCH_SORT
+            )
+        else:
+            archived = get_archived_todos(request.user, filter_option) if include_archived else None
+            virtual = get_virtual_todos(request.user, filter_option, sort, timezone.localdate(today))
+            page, next_cursor = await akeyset_page(todos_list, cursor, page_size, archived, sort, virtual)
+        rows = render_to_string('todo_rows.html', {'todos': page})
+        cached = (str(rows), next_cursor, await stats.aget_stats(request.user, timezone.localdate(today)))
+        await cache.aset(cache_key, cached, get_list_cache_timeout())
+    rows, next_cursor, todo_stats = cached
+
+    return render(request, 'todo_list.html', {
+        'rows': mark_safe(rows),
+        'stats': todo_stats,
+        'filter': filter_option,
+        'query': query,
+        'today': today,
+        'page_size': page_size,
+        'next_cursor': next_cursor,
+        'is_first_page': not cursor,
+        'include_archived': include_archived,
+        'sort': sort,
+    })
+
+
+@async_login_required
+async def add_todo(request):
+    form = AddTodoForm(request.POST)
+    if form.is_valid() and form.cleaned_data['repeat']:
+        rule = await sync_to_async(recurrence.create_rule)(form.build_rule(request.user))
+        if fragments.wants_fragment(request):
+            return fragments.row_response(recurrence.virtual_todo(rule, rule.start_date, timezone.localdate()), status=201)
+        messages.success(request, '新增成功')
+        return redirect('todos')
+    elif form.is_valid():
+        todo = form.save(commit=False)
+        todo.user_id = request.user.id     # 設定 user 會經由 router 查詢分片 (同步查詢) 分片已由 ShardMiddleware 決定
+        await sync_to_async(operations.create_todo)(todo)
+        if fragments.wants_fragment(request):
+            return fragments.row_response(await fragments.aget_row(request.user.id, todo.id), status=201)
+        messages.success(request, '新增成功')
+        return redirect('todos')
+    elif fragments.wants_fragment(request) and request.method == 'POST':
+        return fragments.errors_response(form)
+    else:
+        form = AddTodoForm()
+
+    return render(request, 'add_todo.html', {'form': form})
+
+
+@async_login_required
+async def confirm_delete(request, id):
+    todo = await aget_todo_or_404(id=id, user=request.user)
+    await sync_to_async(operations.delete_todo)(todo)
+    if fragments.wants_fragment(request):
+        return fragments.deleted_response()
+    messages.success(request, '成功刪除')
+    return redirect('todos')
+
+
+@async_login_required
+async def toggle_todo(request, id):
+    completed = await sync_to_async(operations.set_completed)(
+        request.user.id, id, None if request.method == 'POST' else False
+    )
+    if completed is None:
+        raise Http404('No ToDo matches the given query.')
+    if fragments.wants_fragment(request):
+        return fragments.row_response(await fragments.aget_row(request.user.id, id))
+    return redirect('todos')
@@ -0,0 +1,237 @@
+"""
+效能測試共用工具 benchmark 指令都在獨立的測試資料庫中執行 不會動到開發資料庫
+"""
+import contextlib
+import datetime
+import importlib
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment,
+)
+from django.urls import clear_url_caches, reverse
+
+from ToDos import operations, recurrence, search
+from ToDos.models import ToDo, ToDoRecurrence
+from ToDos.stats import rebuild_stats
+
+
+@contextlib.contextmanager
+def bench_database():
+    # 建立臨時測試資料庫 結束後刪除
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def _reload_urls():
+    from ToDoManager import urls
+    importlib.reload(urls)
+    clear_url_caches()
+
+
+@contextlib.contextmanager
+def use_todo_views(async_views):
+    # 切換 TODO_ASYNC_VIEWS 並重新載入 urls 讓同一個行程可以比較同步與非同步 views
+    try:
+        with override_settings(TODO_ASYNC_VIEWS=async_views):
+            _reload_urls()
+            yield
+    finally:
+        _reload_urls()
+
+
+WORDS = [
+    '會議', '報告', '閱讀', '採購', '整理', '寫信', '運動', '繳費', '預約', '作業',
+    '專案', '客戶', '簡報', '預算', '旅行', '打掃', '回覆', '審核', 'review', 'deploy',
+]
+
+
+def seed_todos(user, count, batch_size=5000, seed=0):
+    # 以 bulk_create 快速產生測試資料 due_date 分散在前後一年內
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    priorities = [choice for choice, _ in ToDo.PRIORITY_CHOICES]
+    batch = []
+    for i in range(count):
+        batch.append(ToDo(
+            user=user,
+            title=f'{rng.choice(WORDS)}{rng.choice(WORDS)}任務{i}',
+            description=' '.join(rng.choice(WORDS) + rng.choice(WORDS) for _ in range(3)),
+            due_date=today + datetime.timedelta(days=rng.randint(-365, 365)),
+            priority=rng.choice(priorities),
+            completed=rng.random() < 0.5,
+        ))
+        if len(batch) >= batch_size:
+            search.index_todos(ToDo.objects.bulk_create(batch))
+            batch = []
+    if batch:
+        search.index_todos(ToDo.objects.bulk_create(batch))
+    # bulk_create 不經過 views 需重建統計
+    rebuild_stats(user)
+
+
+BENCH_PASSWORD = 'benchpass123'
+
+
+def create_bench_user(username, password=BENCH_PASSWORD):
+    return User.objects.create_user(username=username, password=password)
+
+
+def create_bench_users(count, prefix='bench', password=BENCH_PASSWORD):
+    # 大量使用者共用同一個雜湊 避免建立時重複計算 PBKDF2
+    hashed = make_password(password)
+    User.objects.bulk_create(
+        [User(username=f'{prefix}{i}', password=hashed) for i in range(count)], batch_size=1000
+    )
+    return list(User.objects.filter(username__startswith=prefix).order_by('id'))
+
+
+def percentile(samples, pct):
+    # 最近排名法 samples 不需事先排序
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def measure(func, repeat, before=None):
+    # 回傳每次呼叫的耗時 (毫秒) before 在每次計時前呼叫 (例如清除快取) 不計入耗時
+    samples = []
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def summarize(samples):
+    return {
+        'p50_ms': round(percentile(samples, 50), 3),
+        'p95_ms': round(percentile(samples, 95), 3),
+        'p99_ms': round(percentile(samples, 99), 3),
+    }
+
+
+# 各 URL 的量測情境
+# prepare(context) 在量測前執行 回傳 (method, url, data) 例如刪除前先建立一筆待刪的資料
+# logged_in 為 False 的情境以未登入的 client 執行
+# QUERY_BUDGETS 為每個 view 的查詢數上限 由測試與 bench_views 檢查 調整 view 時一併更新
+
+def _new_todo(context):
+    todo = ToDo(user=context['user'], title='量測用', due_date=datetime.date.today(), priority='low')
+    return operations.create_todo(todo)
+
+
+def _any_todo(context):
+    return context['rng'].choice(context['todo_ids'])
+
+
+def _new_occurrence(context):
+    # 新的每日規則 回傳第一次的 (規則 id, 日期) 作為 URL 參數
+    rule = recurrence.create_rule(ToDoRecurrence(
+        user=context['user'], title='量測用', priority='low', start_date=datetime.date.today(), frequency='daily',
+    ))
+    return [rule.id, rule.start_date.isoformat()]
+
+
+def _todo_form():
+    return {'title': '量測用', 'description': '', 'due_date': datetime.date.today().isoformat(), 'priority': 'low'}
+
+
+SCENARIOS = {
+    'login_view': lambda context: ('post', reverse('login_view'), {
+        'username': context['user'].username, 'password': BENCH_PASSWORD,
+    }),
+    'register': lambda context: ('get', reverse('register'), None),
+    'todos': lambda context: ('get', reverse('todos'), None),
+    'todos_search': lambda context: ('get', reverse('todos'), {'q': WORDS[0]}),
+    'logout_view': lambda context: ('get', reverse('logout_view'), None),
+    'add_todo': lambda context: ('post', reverse('add_todo'), _todo_form()),
+    'edit_todo': lambda context: ('post', reverse('edit_todo', args=[_any_todo(context)]), _todo_form()),
+    'to_confirm_page': lambda context: ('get', reverse('to_confirm_page', args=[_any_todo(context)]), None),
+    'confirm_delete': lambda context: ('post', reverse('confirm_delete', args=[_new_todo(context).id]), None),
+    'toggle_todo': lambda context: ('post', reverse('toggle_todo', args=[_any_todo(context)]), None),
+    'export_todos': lambda context: ('get', reverse('export_todos'), {'format': 'csv'}),
+    'bulk_action': lambda context: ('post', reverse('bulk_action'), {
+        'action': 'complete', 'ids': context['rng'].sample(context['todo_ids'], 20),
+    }),
+    'todo_changes': lambda context: ('get', reverse('todo_changes'), {'limit': 200}),
+    'todo_calendar': lambda context: ('get', reverse('todo_calendar'), None),
+    'toggle_occurrence': lambda context: ('post', reverse('toggle_occurrence', args=_new_occurrence(context)), None),
+    'edit_occurrence': lambda context: ('post', reverse('edit_occurrence', args=_new_occurrence(context)), _todo_form()),
+    'skip_occurrence': lambda context: ('post', reverse('skip_occurrence', args=_new_occurrence(context)), None),
+    'admin': lambda context: ('get', reverse('admin:index'), None),
+    'admin_todo_changelist': lambda context: ('get', reverse('admin:ToDos_todo_changelist'), None),
+}
+
+ANONYMOUS_SCENARIOS = {'login_view', 'register'}
+
+QUERY_BUDGETS = {
+    'login_view': 9,
+    'register': 0,
+    'todos': 6,
+    'todos_search': 5,
+    'logout_view': 4,
+    'add_todo': 9,
+    'edit_todo': 10,
+    'to_confirm_page': 3,
+    'confirm_delete': 10,
+    'toggle_todo': 7,
+    'export_todos': 3,
+    'bulk_action': 7,
+    'todo_changes': 4,
+    'todo_calendar': 4,
+    'toggle_occurrence': 12,
+    'edit_occurrence': 14,
+    'skip_occurrence': 9,
+    'admin': 3,
+    'admin_todo_changelist': 4,
+}
+
+
+def admin_changelist_params(today):
+    # admin changelist 的篩選 / 排序組合 每一種都應該走索引 不做整張表的 COUNT 或排序
+    month_start = today.replace(day=1).isoformat()
+    return {
+        '全部': {},
+        '已完成': {'completed__exact': '1'},
+        '高優先': {'priority__exact': 'high'},
+        '截止日範圍': {'due_date__gte': month_start, 'due_date__lt': (today + datetime.timedelta(days=31)).isoformat()},
+        '組合篩選': {'completed__exact': '0', 'priority__exact': 'low', 'due_date__gte': month_start},
+        '截止日遞增': {'o': '3'},
+        '最後一頁': {'p': '100'},
+    }
+
+
+def run_scenario(client, name, context):
+    """
+    執行一次情境 回傳 (耗時毫秒, 查詢數, 狀態碼)
+    已登入的情境每次都重新 force_login 以免先前的登出影響後續量測
+    """
+    if name in ANONYMOUS_SCENARIOS:
+        client.logout()
+    else:
+        client.force_login(context['user'])
+    cache.clear()   # 量測冷快取的情況 也就是每次異動後第一次讀取的成本
+    method, url, data = SCENARIOS[name](context)
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        response = getattr(client, method)(url, data)
+        if getattr(response, 'streaming', False):
+            for _ in response.streaming_content:
+                pass
+        elapsed = (time.perf_counter() - start) * 1000
+    return elapsed, len(queries), response.status_code
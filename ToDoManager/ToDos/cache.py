@@ -0,0 +1,91 @@
+"""
+待辦清單的快取 以使用者的版本號做失效
+
+快取鍵包含 使用者 / 版本號 / 篩選條件 / 分頁參數 / 搜尋字串 / 今天日期
+任何會改變清單的操作只需把版本號加一 舊版本的快取自然不再被讀取 等逾時後由快取後端清除
+
+月曆的數量依 (使用者, 月份) 快取 不使用版本號 寫入時只刪除截止日期所在的月份 其他月份的快取保留
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from ToDos import sharding
+
+
+def _version_key(user_id):
+    return f'todos:version:{user_id}'
+
+
+def get_list_version(user_id):
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # 版本號被清除時以時間作為新起點 避免與殘留的舊快取撞號
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_list_version(user_id):
+    # 非同步 views 使用 file 等快取後端時不在 event loop 上做磁碟 I/O
+    key = _version_key(user_id)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def bump_list_version(user_id):
+    key = _version_key(user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def invalidate_user_lists(user_id):
+    # 在交易中時 commit 後再加一次 避免其他請求在 commit 前把舊資料寫進新版本的快取
+    bump_list_version(user_id)
+    if sharding.connection.in_atomic_block:
+        transaction.on_commit(lambda: bump_list_version(user_id), using=sharding.current())
+
+
+def _list_cache_key(user_id, version, parts):
+    # parts 可能含使用者輸入的搜尋字串 以雜湊縮短並避開快取後端不接受的字元
+    digest = hashlib.md5(repr(parts).encode()).hexdigest()
+    return f'todos:list:{user_id}:{version}:{digest}'
+
+
+def list_cache_key(user_id, *parts):
+    return _list_cache_key(user_id, get_list_version(user_id), parts)
+
+
+async def alist_cache_key(user_id, *parts):
+    return _list_cache_key(user_id, await aget_list_version(user_id), parts)
+
+
+def get_list_cache_timeout():
+    return getattr(settings, 'TODO_LIST_CACHE_TIMEOUT', 300)
+
+
+def calendar_cache_key(user_id, year, month):
+    return f'todos:calendar:{user_id}:{year}-{month:02d}'
+
+
+def _delete_calendar_months(user_id, months):
+    cache.delete_many([calendar_cache_key(user_id, year, month) for year, month in months])
+
+
+def invalidate_calendar_months(user_id, dates):
+    # dates 為異動前後的截止日期 與 invalidate_user_lists 相同 在交易中時 commit 後再刪除一次
+    months = {(date.year, date.month) for date in dates}
+    if not months:
+        return
+    _delete_calendar_months(user_id, months)
+    if sharding.connection.in_atomic_block:
+        transaction.on_commit(lambda: _delete_calendar_months(user_id, months), using=sharding.current())
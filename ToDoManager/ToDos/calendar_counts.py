@@ -0,0 +1,128 @@
+"""
+月曆 每一天到期的待辦數 依優先度與是否完成分開計算
+
+一個月的數量只需一個 GROUP BY due_date, priority, completed 不建立任何 ToDo 實例
+todo_user_calendar_idx (user, due_date, priority, completed) 涵蓋整個查詢 只讀索引中這個月的範圍 依索引順序分組 不需排序
+結果依 (使用者, 月份) 快取 operations 寫入時只讓異動前後 due_date 所在的月份失效 (見 cache.invalidate_calendar_months)
+
+與統計相同只計算 ToDo 封存的待辦不列入
+重複規則展開的那幾次 (未完成) 每次請求依規則計算 不放進快取 新增 / 刪除規則不需讓月曆失效 與清單相同只展開到 recurrence.horizon
+"""
+import calendar
+import collections
+import datetime
+import sys
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from ToDos import recurrence
+from ToDos.cache import calendar_cache_key, get_list_cache_timeout
+from ToDos.models import ToDo, ToDoOccurrence, ToDoRecurrence
+
+WEEKDAYS = ['一', '二', '三', '四', '五', '六', '日']
+
+
+def parse_month(value, today):
+    # ?month=2025-03 格式錯誤時回傳本月 第一年與最後一年沒有上一個月 / 下一個月 也視為錯誤
+    try:
+        year, month = (int(part) for part in value.split('-'))
+        if not datetime.MINYEAR < year < datetime.MAXYEAR:
+            raise ValueError(year)
+        return datetime.date(year, month, 1)
+    except (AttributeError, ValueError):
+        return today.replace(day=1)
+
+
+def shift_month(first, months):
+    index = first.year * 12 + first.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def month_range(first):
+    return first, first.replace(day=calendar.monthrange(first.year, first.month)[1])
+
+
+def _count_stored(user_id, first, last):
+    return list(
+        ToDo.objects.filter(user_id=user_id, due_date__range=(first, last))
+        .values_list('due_date', 'priority', 'completed')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+
+
+def stored_counts(user_id, first):
+    # [(due_date, priority, completed, 筆數)] 依 (使用者, 月份) 快取
+    key = calendar_cache_key(user_id, first.year, first.month)
+    counts = cache.get(key)
+    if counts is None:
+        counts = _count_stored(user_id, *month_range(first))
+        cache.set(key, counts, get_list_cache_timeout())
+    return counts
+
+
+def virtual_counts(user_id, first, today):
+    # 規則在這個月展開的每一次 排除已寫入或已刪除的那幾次 格式與 stored_counts 相同
+    first, last = month_range(first)
+    last = min(last, recurrence.horizon(today))
+    if last < first:
+        return []
+    rules = list(
+        ToDoRecurrence.objects.filter(user_id=user_id, start_date__lte=last)
+        .filter(Q(until__isnull=True) | Q(until__gte=first))
+    )
+    if not rules:
+        return []
+    handled = set(
+        ToDoOccurrence.objects.filter(recurrence_id__in=[rule.id for rule in rules], occurrence_date__range=(first, last))
+        .values_list('recurrence_id', 'occurrence_date')
+    )
+    counts = collections.Counter(
+        (date, rule.priority)
+        for rule in rules
+        for date in recurrence.occurrence_dates(rule, first, last)
+        if (rule.id, date) not in handled
+    )
+    return [(date, priority, False, count) for (date, priority), count in counts.items()]
+
+
+def list_cursor(date):
+    # 清單 (sort=due) 從 date 開始的游標 前一天最大的 id 之後
+    return f'{(date - datetime.timedelta(days=1)).isoformat()}_{sys.maxsize}'
+
+
+def _new_day(date, first, today):
+    return {
+        'date': date,
+        'in_month': date.month == first.month,
+        'is_today': date == today,
+        'total': 0,
+        'completed': 0,
+        'priorities': collections.Counter(),    #各優先度未完成的筆數
+    }
+
+
+def month_weeks(user_id, first, today):
+    """
+    回傳月曆的每一週 (週一開始) 每一天為 dict
+    total / completed / open (各優先度未完成的 (priority, 名稱, 筆數) 依優先度排列)
+    overdue (早於今天且有未完成) / cursor (清單從這一天開始)
+    """
+    weeks = calendar.Calendar().monthdatescalendar(first.year, first.month)
+    days = {date: _new_day(date, first, today) for week in weeks for date in week}
+    for due_date, priority, completed, count in [*stored_counts(user_id, first), *virtual_counts(user_id, first, today)]:
+        day = days[due_date]
+        day['total'] += count
+        if completed:
+            day['completed'] += count
+        else:
+            day['priorities'][priority] += count
+    for day in days.values():
+        priorities = day.pop('priorities')
+        day['open'] = [
+            (priority, label, priorities[priority]) for priority, label in ToDo.PRIORITY_CHOICES if priorities[priority]
+        ]
+        day['overdue'] = day['date'] < today and day['completed'] < day['total']
+        day['cursor'] = list_cursor(day['date'])
+    return [[days[date] for date in week] for week in weeks]
@@ -0,0 +1,110 @@
+"""
+/todos/changes 的差異同步 客戶端帶著上次拿到的游標 只取得之後新增 / 修改 / 刪除的待辦
+
+ToDo 依 (updated_at, id) ToDoTombstone 依 (deleted_at, todo_id) 各自從索引上的游標位置往後讀 再依時間合併
+游標為最後一筆的 (微秒時間戳, id) 例如 1760000000000000_15 每頁成本與資料總量無關
+
+修改時間在交易中設定 IMMEDIATE 交易模式 (TODO_DB_PROFILE=production) 下取得寫入鎖後才設定
+commit 順序與時間順序一致 已發出的游標之前不會再出現新的變更
+預設的 DEFERRED 模式在兩個寫入同時開始時仍有極小的時間差 客戶端可定期以空游標完整同步一次
+
+tombstone 只保留 TODO_TOMBSTONE_RETENTION_DAYS 天 (manage.py prune_tombstones 分批清除)
+游標早於保留期限時其間的刪除紀錄可能已被清除 get_changes 拋出 CursorExpired 客戶端需以空游標完整同步
+"""
+import datetime
+import heapq
+import itertools
+
+from django.conf import settings
+from django.utils import timezone
+
+from ToDos.models import ToDo, ToDoTombstone
+
+DEFAULT_LIMIT = 200
+MAX_LIMIT = 1000
+FIELDS = ['id', 'title', 'description', 'due_date', 'priority', 'completed', 'created_at', 'updated_at']
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+class CursorExpired(Exception):
+    # 游標早於 tombstone 的保留期限 無法保證差異完整
+    pass
+
+
+def retention_cutoff(days=None):
+    # 早於這個時間的 tombstone 可以清除 游標早於它時需完整同步
+    if days is None:
+        days = settings.TODO_TOMBSTONE_RETENTION_DAYS
+    return timezone.now() - datetime.timedelta(days=days)
+
+
+def is_expired(cursor):
+    position = decode_cursor(cursor)
+    return position is not None and position[0] < retention_cutoff()
+
+
+def get_limit(value):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_LIMIT
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def encode_cursor(changed_at, todo_id):
+    return f'{(changed_at - EPOCH) // MICROSECOND}_{todo_id}'
+
+
+def decode_cursor(cursor):
+    # 格式錯誤時回傳 None 視為從頭同步
+    try:
+        micros, todo_id = cursor.split('_')
+        return EPOCH + datetime.timedelta(microseconds=int(micros)), int(todo_id)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+
+def _after(queryset, time_field, id_field, position):
+    queryset = queryset.order_by(time_field, id_field)
+    if position is not None:
+        changed_at, todo_id = position
+        queryset = queryset.filter(**{f'{time_field}__gte': changed_at}).exclude(
+            **{time_field: changed_at, f'{id_field}__lte': todo_id}
+        )
+    return queryset
+
+
+def get_changes(user_id, cursor, limit):
+    """
+    回傳 (變更列表, 下一次的游標, 是否還有更多)
+    變更為待辦的欄位加上 deleted: False 或 {id, deleted: True, deleted_at}
+    沒有新的變更時游標不變 游標早於保留期限時拋出 CursorExpired
+    """
+    if is_expired(cursor):
+        raise CursorExpired(cursor)
+    position = decode_cursor(cursor)
+    rows = _after(ToDo.objects.filter(user_id=user_id), 'updated_at', 'id', position).values(*FIELDS)[:limit + 1]
+    tombstones = _after(
+        ToDoTombstone.objects.filter(user_id=user_id), 'deleted_at', 'todo_id', position
+    ).values_list('todo_id', 'deleted_at')[:limit + 1]
+    merged = heapq.merge(
+        ((row['updated_at'], row['id'], {**row, 'deleted': False}) for row in rows),
+        ((deleted_at, todo_id, {'id': todo_id, 'deleted': True, 'deleted_at': deleted_at}) for todo_id, deleted_at in tombstones),
+        key=lambda change: change[:2],
+    )
+    changes = list(itertools.islice(merged, limit + 1))
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    next_cursor = encode_cursor(*changes[-1][:2]) if changes else cursor
+    return [change[2] for change in changes], next_cursor, has_more
+
+
+def write_tombstones(rows):
+    # rows 為被刪除的 (user_id, todo_id) 與刪除在同一個交易中寫入
+    deleted_at = timezone.now()
+    ToDoTombstone.objects.bulk_create(
+        [ToDoTombstone(user_id=user_id, todo_id=todo_id, deleted_at=deleted_at) for user_id, todo_id in rows],
+        batch_size=1000,
+    )
@@ -1,5 +1,5 @@
 from django import forms
-from ToDos.models import ToDo
+from ToDos.models import ToDo , ToDoRecurrence
 
 class TodoForm(forms.ModelForm):
     class Meta:
@@ -9,4 +9,24 @@ class TodoForm(forms.ModelForm):
         widgets = {
             'due_date': forms.DateInput(attrs={'type': 'date'}),
             'description': forms.Textarea(attrs={'rows': 4}),
-        }
\ No newline at end of file
+        }
+
+class AddTodoForm(TodoForm):
+    # 新增時可設定重複 設定後只建立 ToDoRecurrence 第一次為截止日期當天 (見 ToDos.recurrence)
+    repeat = forms.ChoiceField(choices = [('', '不重複'), *ToDoRecurrence.FREQUENCY_CHOICES], required = False, label = '重複')
+    repeat_until = forms.DateField(required = False, label = '重複至', widget = forms.DateInput(attrs={'type': 'date'}))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        due_date , until = cleaned_data.get('due_date') , cleaned_data.get('repeat_until')
+        if cleaned_data.get('repeat') and due_date and until and until < due_date:
+            self.add_error('repeat_until', '不可早於截止日期')
+        return cleaned_data
+
+    def build_rule(self, user):
+        # 只設定 user_id 指定 user 時 router 會查詢分片 非同步 views 中不能執行同步查詢
+        data = self.cleaned_data
+        return ToDoRecurrence(
+            user_id = user.id, title = data['title'], description = data['description'], priority = data['priority'],
+            start_date = data['due_date'], frequency = data['repeat'], until = data['repeat_until'],
+        )
@@ -0,0 +1,52 @@
+"""
+切換 / 新增 / 刪除的 fragment 回應
+
+請求帶有 HX-Request: true (htmx) 或 Accept: text/html-fragment 時只回傳受影響的那一列 <tr>
+由 todo_row.html 渲染 與清單共用同一個模板 客戶端直接替換該列 不需要再載入整個清單
+刪除時回傳空內容 客戶端把該列移除 沒有這些標頭的請求 (沒有 JavaScript 的瀏覽器) 維持原本的 redirect
+"""
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+
+from ToDos.models import ToDo
+
+FRAGMENT_TYPE = 'text/html-fragment'
+
+
+def wants_fragment(request):
+    return request.headers.get('HX-Request') == 'true' or FRAGMENT_TYPE in request.headers.get('Accept', '')
+
+
+def _response(content, status=200):
+    response = HttpResponse(content, status=status)
+    # 同一個網址依標頭回傳整頁的 redirect 或片段
+    patch_vary_headers(response, ('HX-Request', 'Accept'))
+    return response
+
+
+def _row_queryset(user_id, todo_id):
+    # 與清單相同 逾期 (overdue) 由資料庫判斷
+    return ToDo.objects.with_overdue(timezone.localdate()).filter(id=todo_id, user_id=user_id)
+
+
+def get_row(user_id, todo_id):
+    return _row_queryset(user_id, todo_id).get()
+
+
+async def aget_row(user_id, todo_id):
+    return await _row_queryset(user_id, todo_id).aget()
+
+
+def row_response(todo, status=200):
+    # todo 需帶有 overdue 註記 (見 get_row)
+    return _response(render_to_string('todo_row.html', {'todo': todo}), status)
+
+
+def deleted_response():
+    return _response('')
+
+
+def errors_response(form):
+    return _response(form.errors.as_ul(), status=422)
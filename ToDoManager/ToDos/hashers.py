@@ -0,0 +1,9 @@
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class FastPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    測試用的 PBKDF2 只降低迭代次數 演算法名稱與雜湊格式不變
+    迭代次數記錄在雜湊字串中 正式環境仍可驗證這些雜湊
+    """
+    iterations = 1000
@@ -0,0 +1,55 @@
+import datetime
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from ToDos import archive, sharding
+
+
+class Command(BaseCommand):
+    help = (
+        '把截止日期早於 N 天前的已完成待辦分批搬到封存表 ArchivedToDo 每批一個短交易 可在服務運作中執行 '
+        '加上 --restore 則把封存的待辦搬回 (保留原 id)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, help='封存截止日期早於幾天前的已完成待辦')
+        parser.add_argument('--batch-size', type=int, default=archive.DEFAULT_BATCH_SIZE, help='每個交易搬移的筆數')
+        parser.add_argument('--sleep', type=float, default=0.0, help='每批之間暫停的秒數 讓其他寫入有機會取得鎖')
+        parser.add_argument('--user', help='只處理指定的使用者名稱')
+        parser.add_argument('--restore', action='store_true', help='把封存的待辦搬回 ToDo')
+
+    def handle(self, *args, **options):
+        if options['restore'] == (options['older_than'] is not None):
+            raise CommandError('請指定 --older-than N 或 --restore 其中之一')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size 必須大於 0')
+        user_id = None
+        if options['user']:
+            user_id = User.objects.filter(username=options['user']).values_list('id', flat=True).first()
+            if user_id is None:
+                raise CommandError(f'找不到使用者 {options["user"]}')
+
+        if options['restore']:
+            move = lambda: archive.restore_batch(options['batch_size'], user_id=user_id)
+            action = '還原'
+        else:
+            cutoff = timezone.localdate() - datetime.timedelta(days=options['older_than'])
+            move = lambda: archive.archive_batch(cutoff, options['batch_size'], user_id=user_id)
+            action = '封存'
+
+        moved = batches = 0
+        # 指定使用者時 archive / restore 自行使用他的分片 否則依序處理每個分片
+        for _ in (sharding.each_shard() if user_id is None else [None]):
+            while True:
+                count = move()
+                if not count:
+                    break
+                moved += count
+                batches += 1
+                self.stdout.write(f'已{action} {moved} 筆')
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f'{action}完成 共 {moved} 筆 {batches} 批'))
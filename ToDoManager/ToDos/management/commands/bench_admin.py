@@ -0,0 +1,41 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.urls import reverse
+
+from ToDos.bench import admin_changelist_params, bench_database, create_bench_users, measure, seed_todos, summarize
+from ToDos.models import ToDo
+
+
+class Command(BaseCommand):
+    help = (
+        '量測 admin 待辦 changelist 在不同總資料量下的延遲 (應與總筆數無關) '
+        '例如 --sizes 100000,1000000,10000000'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000,1000000', help='總待辦數量 以逗號分隔')
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        with bench_database():
+            users = create_bench_users(options['users'])
+            admin = users[0]
+            admin.is_staff = admin.is_superuser = True
+            admin.save()
+            client = Client()
+            client.force_login(admin)
+            url = reverse('admin:ToDos_todo_changelist')
+            seeded = 0
+            for size in sizes:
+                per_user = (size - seeded) // len(users)
+                for user in users:
+                    seed_todos(user, per_user, seed=seeded + user.id)
+                seeded = size
+                self.stdout.write(f'{ToDo.objects.count():>10} todos')
+                for label, params in admin_changelist_params(datetime.date.today()).items():
+                    result = summarize(measure(lambda: client.get(url, params), options['repeat']))
+                    self.stdout.write(f'    {label:<8} p50={result["p50_ms"]}ms p99={result["p99_ms"]}ms')
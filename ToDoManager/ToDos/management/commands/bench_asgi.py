@@ -0,0 +1,63 @@
+import asyncio
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient
+from django.urls import reverse
+
+from ToDos.bench import bench_database, create_bench_user, seed_todos, summarize, use_todo_views
+from ToDos.models import ToDo
+
+
+class Command(BaseCommand):
+    help = '以行程內的 ASGI client 在大量併發下比較同步與非同步 views 的 requests/sec 與 p99 延遲'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=100, help='併發 client 數')
+        parser.add_argument('--requests', type=int, default=20, help='每個 client 的請求數')
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--todos', type=int, default=200, help='每位使用者的待辦數量')
+
+    def handle(self, *args, **options):
+        with bench_database():
+            users = [create_bench_user(f'bench{i}') for i in range(options['users'])]
+            for user in users:
+                seed_todos(user, options['todos'], seed=user.id)
+            todo_ids = {
+                user.id: list(ToDo.objects.filter(user=user).values_list('id', flat=True))
+                for user in users
+            }
+            for mode in ('sync', 'async'):
+                with use_todo_views(mode == 'async'):
+                    result = asyncio.run(self.run_load(users, todo_ids, options))
+                self.stdout.write(
+                    f'{mode:>5}: {result["rps"]:.1f} req/s  '
+                    f'p50={result["p50_ms"]}ms p95={result["p95_ms"]}ms p99={result["p99_ms"]}ms  '
+                    f'errors={result["errors"]}'
+                )
+
+    async def run_load(self, users, todo_ids, options):
+        samples = []
+        errors = 0
+
+        async def client_loop(index):
+            nonlocal errors
+            user = users[index % len(users)]
+            rng = random.Random(index)
+            client = AsyncClient()
+            await client.aforce_login(user)
+            for _ in range(options['requests']):
+                # 模擬常見操作 切換一筆後重新讀取清單 (清單快取因此失效)
+                todo_id = rng.choice(todo_ids[user.id])
+                for method, url in (('post', reverse('toggle_todo', args=[todo_id])), ('get', reverse('todos'))):
+                    start = time.perf_counter()
+                    response = await getattr(client, method)(url)
+                    samples.append((time.perf_counter() - start) * 1000)
+                    if response.status_code >= 400:
+                        errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(i) for i in range(options['clients'])))
+        elapsed = time.perf_counter() - start
+        return {'rps': len(samples) / elapsed, 'errors': errors, **summarize(samples)}
@@ -0,0 +1,85 @@
+import collections
+import datetime
+import random
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.test import Client
+from django.urls import reverse
+
+from ToDos import calendar_counts, operations
+from ToDos.bench import bench_database, create_bench_user, measure, summarize
+from ToDos.cache import calendar_cache_key
+from ToDos.models import ToDo
+
+
+class Command(BaseCommand):
+    help = (
+        '一個月有大量待辦時的月曆成本 比較 GROUP BY (涵蓋索引) 與逐筆讀出 ToDo 計算 '
+        '並量測 /todos/calendar 冷快取 / 快取命中 以及異動後只有該月份失效'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='同一個月的待辦數')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with bench_database():
+            user = create_bench_user('bench_calendar')
+            first = datetime.date.today().replace(day=1)
+            self.seed_month(user, first, options['rows'])
+            self.stdout.write(f'{first:%Y-%m} 有 {ToDo.objects.filter(user=user).count()} 筆待辦')
+
+            last = calendar_counts.month_range(first)[1]
+            queryset = ToDo.objects.filter(user_id=user.id, due_date__range=(first, last))
+            plan = (
+                queryset.values_list('due_date', 'priority', 'completed').annotate(count=Count('id'))
+                .order_by().explain()
+            )
+            self.stdout.write(f'查詢計畫: {plan}')
+
+            repeat = options['repeat']
+            self.report('GROUP BY', measure(lambda: calendar_counts._count_stored(user.id, first, last), repeat))
+            self.report('逐筆讀出 ToDo', measure(lambda: self.count_in_python(queryset), max(1, repeat // 10)))
+
+            client = Client()
+            client.force_login(user)
+            url = reverse('todo_calendar')
+
+            def cold():
+                cache.delete(calendar_cache_key(user.id, first.year, first.month))
+                client.get(url)
+
+            self.report('/todos/calendar 冷快取', measure(cold, repeat))
+            client.get(url)
+            self.report('/todos/calendar 快取命中', measure(lambda: client.get(url), repeat))
+
+            # 兩個月份都已快取 切換這個月的一筆待辦 只有這個月需要重新查詢
+            next_month = calendar_counts.shift_month(first, 1)
+            client.get(url, {'month': f'{next_month:%Y-%m}'})
+            operations.set_completed(user.id, queryset.values_list('id', flat=True).first())
+            for month in (first, next_month):
+                cached = cache.get(calendar_cache_key(user.id, month.year, month.month)) is not None
+                self.stdout.write(f'切換 {first:%Y-%m} 的待辦後 {month:%Y-%m} 的快取: {"保留" if cached else "已失效"}')
+
+    def seed_month(self, user, first, count, batch_size=5000):
+        # 只需要日期 / 優先度 / 狀態 不建立搜尋索引
+        rng = random.Random(0)
+        days = calendar_counts.month_range(first)[1].day
+        priorities = [choice for choice, _ in ToDo.PRIORITY_CHOICES]
+        for start in range(0, count, batch_size):
+            ToDo.objects.bulk_create([
+                ToDo(
+                    user=user, title=f'月曆任務{i}', due_date=first.replace(day=rng.randint(1, days)),
+                    priority=rng.choice(priorities), completed=rng.random() < 0.5,
+                )
+                for i in range(start, min(count, start + batch_size))
+            ])
+
+    def count_in_python(self, queryset):
+        return collections.Counter((todo.due_date, todo.priority, todo.completed) for todo in queryset.iterator())
+
+    def report(self, label, samples):
+        result = summarize(samples)
+        self.stdout.write(f'{label:<24} p50={result["p50_ms"]}ms p99={result["p99_ms"]}ms')
@@ -0,0 +1,56 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, get_hashers, make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.urls import reverse
+
+from ToDos.bench import BENCH_PASSWORD, bench_database, measure, summarize
+
+
+class Command(BaseCommand):
+    help = (
+        '在 PASSWORD_HASHERS 中每個可用的雜湊演算法下量測單一行程 (單核) 每秒可處理的登入數 '
+        '並比較單次雜湊驗證的耗時 登入應只計算一次雜湊'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=50)
+
+    def handle(self, *args, **options):
+        with bench_database():
+            self.stdout.write(f'PASSWORD_HASHERS[0] = {settings.PASSWORD_HASHERS[0]}')
+            for hasher in get_hashers():
+                try:
+                    if hasher.library:
+                        hasher._load_library()
+                except ValueError:
+                    # argon2 / bcrypt 需另外安裝套件
+                    self.stdout.write(f'{hasher.algorithm:>16}  略過 (未安裝 {hasher.library})')
+                    continue
+                self.bench_hasher(hasher, options['logins'])
+
+    def bench_hasher(self, hasher, logins):
+        encoded = make_password(BENCH_PASSWORD, hasher=hasher.algorithm)
+        user = User.objects.create(username=f'login_{hasher.algorithm}', password=encoded)
+        hash_ms = summarize(measure(lambda: check_password(BENCH_PASSWORD, encoded), logins))['p50_ms']
+
+        client = Client()
+        url = reverse('login_view')
+        data = {'username': user.username, 'password': BENCH_PASSWORD}
+        samples = []
+        for _ in range(logins):
+            client.logout()
+            cache.clear()
+            start = time.perf_counter()
+            client.post(url, data)
+            samples.append((time.perf_counter() - start) * 1000)
+        summary = summarize(samples)
+        per_second = logins / (sum(samples) / 1000)
+        self.stdout.write(
+            f'{hasher.algorithm:>16}  雜湊 p50={hash_ms}ms  登入 p50={summary["p50_ms"]}ms '
+            f'p99={summary["p99_ms"]}ms  {per_second:.1f} 次/秒/核'
+        )
@@ -0,0 +1,62 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ToDos import reminders
+from ToDos.bench import bench_database, create_bench_users, seed_todos
+from ToDos.models import ToDo, ToDoReminder
+
+
+class Command(BaseCommand):
+    help = (
+        '量測到期提醒在不同總資料量下的掃描與寄送速度 (掃描成本應只和窗口內的筆數有關) '
+        '郵件使用 locmem 後端 不實際寄出 例如 --sizes 1000000,10000000'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100000,1000000', help='總待辦數量 以逗號分隔')
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        batch_size = options['batch_size']
+        # bench_database 與測試相同 把 EMAIL_BACKEND 換成 locmem 寄出的郵件只放在 mail.outbox
+        with bench_database():
+            users = create_bench_users(options['users'])
+            for user in users:
+                user.email = f'{user.username}@example.com'
+            User.objects.bulk_update(users, ['email'])
+            today = timezone.localdate()
+            seeded = 0
+            for size in sizes:
+                per_user = (size - seeded) // len(users)
+                for user in users:
+                    seed_todos(user, per_user, seed=seeded + user.id)
+                seeded = size
+                ToDoReminder.objects.all().delete()
+                mail.outbox = []
+
+                start = time.perf_counter()
+                enqueued = reminders.scan(today, batch_size=batch_size)
+                scan_seconds = time.perf_counter() - start
+                start = time.perf_counter()
+                sent = reminders.send_pending(batch_size)
+                send_seconds = time.perf_counter() - start
+                start = time.perf_counter()
+                rescanned = reminders.scan(today, batch_size=batch_size)
+                rescan_seconds = time.perf_counter() - start
+
+                self.stdout.write(f'{ToDo.objects.count():>10} todos')
+                self.stdout.write(
+                    f'    scan    {enqueued} 筆 {scan_seconds * 1000:.1f} ms '
+                    f'({enqueued / max(scan_seconds, 1e-9):.0f} 筆/秒)'
+                )
+                self.stdout.write(
+                    f'    send    {sent} 封 {send_seconds * 1000:.1f} ms '
+                    f'({sent / max(send_seconds, 1e-9):.0f} 封/秒) outbox={len(mail.outbox)}'
+                )
+                self.stdout.write(f'    rescan  {rescanned} 筆 {rescan_seconds * 1000:.1f} ms (沒有新的待辦時每一輪的成本)')
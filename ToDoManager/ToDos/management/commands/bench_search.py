@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from ToDos import search
+from ToDos.bench import WORDS, bench_database, create_bench_user, measure, seed_todos, summarize
+from ToDos.models import ToDo
+
+
+class Command(BaseCommand):
+    help = '比較 FTS5 全文搜尋與 icontains (LIKE %..%) 在大量資料下的搜尋延遲'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='總資料量 例如 1000000')
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--limit', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with bench_database():
+            users = [create_bench_user(f'bench{i}') for i in range(options['users'])]
+            # 第一位使用者放一半的資料 模擬重度使用者
+            heavy = options['rows'] // 2
+            seed_todos(users[0], heavy, seed=0)
+            rest = (options['rows'] - heavy) // max(1, len(users) - 1)
+            for user in users[1:]:
+                seed_todos(user, rest, seed=user.id)
+            self.stdout.write(f'已建立 {ToDo.objects.count()} 筆待辦')
+
+            limit = options['limit']
+            for label, user in (('重度使用者', users[0]), ('一般使用者', users[-1])):
+                self.stdout.write(label)
+                self.bench_queries(user, heavy, limit, options['repeat'])
+
+    def bench_queries(self, user, heavy, limit, repeat):
+        # 常見詞 / 雙詞 / 單字 / 英文 / 罕見詞 / 不存在的詞 (LIKE 需掃完整個使用者的資料)
+        for query in [WORDS[0], WORDS[0] + WORDS[1], WORDS[0][0], 'review', f'任務{heavy // 3}', '不存在']:
+            queryset = ToDo.objects.filter(user=user, completed=False)
+            fts = summarize(measure(
+                lambda: list(search.search(queryset, user.id, query)[:limit]), repeat
+            ))
+            like = summarize(measure(
+                lambda: list(queryset.filter(Q(title__icontains=query) | Q(description__icontains=query))[:limit]),
+                repeat,
+            ))
+            self.stdout.write(
+                f'{query:>8}  fts p50={fts["p50_ms"]}ms p99={fts["p99_ms"]}ms  '
+                f'icontains p50={like["p50_ms"]}ms p99={like["p99_ms"]}ms'
+            )
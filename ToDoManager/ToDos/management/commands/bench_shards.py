@@ -0,0 +1,101 @@
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from ToDos import operations, sharding
+from ToDos.bench import create_bench_users
+from ToDos.models import ToDo
+
+
+class Command(BaseCommand):
+    help = (
+        '多個行程同時新增待辦 比較 1 / 2 / 4 個分片 (各自獨立的 SQLite 檔案) 的寫入吞吐量 '
+        '每種分片數使用新的暫存目錄 設定為 TODO_DB_PROFILE=production 每個 worker 是獨立的子行程'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', default='1,2,4', help='分片數 以逗號分隔')
+        parser.add_argument('--workers', type=int, default=8, help='同時寫入的行程數')
+        parser.add_argument('--users', type=int, default=4, help='每個 worker 輪流寫入的使用者數')
+        parser.add_argument('--seconds', type=float, default=5.0)
+        parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+        parser.add_argument('--start-at', type=float, help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['worker'] is not None:
+            self.stdout.write(json.dumps(self.run_worker(options)))
+            return
+        # 每個寫入主要是 CPU (ORM / SQLite) 分片只在有多個 CPU 時才能平行寫入
+        self.stdout.write(f'CPU: {os.cpu_count()}  workers: {options["workers"]}')
+        for shards in [int(count) for count in options['shards'].split(',')]:
+            with tempfile.TemporaryDirectory() as directory:
+                env = {
+                    **os.environ,
+                    'TODO_DB_PROFILE': 'production',
+                    'TODO_DB_PATH': os.path.join(directory, 'default.sqlite3'),
+                    'TODO_SHARDS': str(shards),
+                    'TODO_SHARD_PATH': os.path.join(directory, 'shard{}.sqlite3'),
+                }
+                for alias in ['default', *(f'shard{index}' for index in range(shards))]:
+                    self.manage(env, 'migrate', '--database', alias, '--verbosity', '0')
+                results = self.run_workers(env, options)
+            writes = sum(result['writes'] for result in results)
+            errors = sum(result['errors'] for result in results)
+            per_shard = {}
+            for result in results:
+                for alias, count in result['per_shard'].items():
+                    per_shard[alias] = per_shard.get(alias, 0) + count
+            self.stdout.write(
+                f'{shards} shard(s): {writes / options["seconds"]:.0f} writes/s  errors={errors}  '
+                + ' '.join(f'{alias}={count}' for alias, count in sorted(per_shard.items()))
+            )
+
+    def manage(self, env, *args):
+        return subprocess.run([sys.executable, sys.argv[0], *args], env=env, capture_output=True, text=True, check=True)
+
+    def run_workers(self, env, options):
+        # 所有 worker 先建立使用者與分片配置 在同一個時間點開始寫入
+        start_at = time.time() + 3 + options['workers'] * 0.5
+        processes = [
+            subprocess.Popen(
+                [sys.executable, sys.argv[0], 'bench_shards', '--worker', str(index), '--start-at', str(start_at),
+                 '--users', str(options['users']), '--seconds', str(options['seconds'])],
+                env=env, stdout=subprocess.PIPE, text=True,
+            )
+            for index in range(options['workers'])
+        ]
+        results = []
+        for process in processes:
+            stdout, _ = process.communicate()
+            if process.returncode:
+                raise RuntimeError(f'worker 失敗 (exit {process.returncode})')
+            results.append(json.loads(stdout.strip().splitlines()[-1]))
+        return results
+
+    def run_worker(self, options):
+        users = create_bench_users(options['users'], prefix=f'w{options["worker"]}_')
+        shards = {user.id: sharding.shard_for(user.id) for user in users}
+        delay = options['start_at'] - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        deadline = time.perf_counter() + options['seconds']
+        writes = errors = 0
+        per_shard = {}
+        today = datetime.date.today()
+        while time.perf_counter() < deadline:
+            user = users[writes % len(users)]
+            try:
+                operations.create_todo(ToDo(user=user, title=f'分片壓力測試{writes}', due_date=today, priority='low'))
+            except Exception:  # database is locked 等 重試後仍失敗的寫入
+                errors += 1
+                continue
+            writes += 1
+            per_shard[shards[user.id]] = per_shard.get(shards[user.id], 0) + 1
+        return {'writes': writes, 'errors': errors, 'per_shard': per_shard}
@@ -0,0 +1,99 @@
+import argparse
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from ToDos import operations
+from ToDos.bench import create_bench_users
+from ToDos.models import ToDo
+
+PROFILES = {
+    # 原本的設定 rollback journal / DEFERRED 交易 / 不重試
+    'before': {'TODO_DB_PROFILE': 'default', 'TODO_WRITE_RETRIES': '0'},
+    # WAL + PRAGMA + BEGIN IMMEDIATE + 重試
+    'after': {'TODO_DB_PROFILE': 'production', 'TODO_WRITE_RETRIES': '5'},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        '多執行緒併發新增與切換待辦 比較原本的 SQLite 設定與 production 設定 (WAL / BEGIN IMMEDIATE / 重試) '
+        '的錯誤率與寫入吞吐量 每個設定在獨立的子行程與暫存資料庫檔案中執行'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--writes', type=int, default=200, help='每個執行緒的寫入次數')
+        parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['child']:
+            self.stdout.write(json.dumps(self.run_stress(options['threads'], options['writes'])))
+            return
+        for name, env in PROFILES.items():
+            with tempfile.TemporaryDirectory() as directory:
+                result = subprocess.run(
+                    [sys.executable, sys.argv[0], 'bench_sqlite_writes', '--child',
+                     '--threads', str(options['threads']), '--writes', str(options['writes'])],
+                    env={**os.environ, **env, 'TODO_DB_PATH': os.path.join(directory, 'bench.sqlite3')},
+                    capture_output=True, text=True, check=True,
+                )
+            stats = json.loads(result.stdout.strip().splitlines()[-1])
+            self.stdout.write(
+                f'{name:>6}: {stats["writes_per_sec"]:.0f} writes/s  '
+                f'errors={stats["errors"]}/{stats["attempts"]} ({stats["error_rate"]:.1%})'
+            )
+            for error in stats['sample_errors']:
+                self.stdout.write(f'        {error}')
+
+    def run_stress(self, threads, writes):
+        call_command('migrate', verbosity=0)
+        users = create_bench_users(threads)
+        connection.close()
+        errors = []
+        lock = threading.Lock()
+
+        def worker(user):
+            rng = random.Random(user.id)
+            todo_ids = []
+            try:
+                for i in range(writes):
+                    try:
+                        # 新增與切換交錯 模擬尖峰時段的操作
+                        if todo_ids and rng.random() < 0.5:
+                            operations.set_completed(user.id, rng.choice(todo_ids))
+                        else:
+                            todo = ToDo(user=user, title=f'壓力測試{i}', due_date=datetime.date.today(), priority='low')
+                            todo_ids.append(operations.create_todo(todo).id)
+                    except Exception as exc:  # 記錄所有失敗 包含 database is locked
+                        with lock:
+                            errors.append(str(exc))
+            finally:
+                connection.close()
+
+        start = time.perf_counter()
+        workers = [threading.Thread(target=worker, args=(user,)) for user in users]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        attempts = threads * writes
+        return {
+            'attempts': attempts,
+            'errors': len(errors),
+            'error_rate': len(errors) / attempts,
+            'writes_per_sec': (attempts - len(errors)) / elapsed,
+            'sample_errors': sorted(set(errors))[:3],
+            'todos': ToDo.objects.count(),
+        }
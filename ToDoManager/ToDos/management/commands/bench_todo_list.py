@@ -0,0 +1,47 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.urls import reverse
+
+from ToDos.bench import bench_database, create_bench_user, measure, seed_todos, summarize
+from ToDos.models import ToDo
+
+
+class Command(BaseCommand):
+    help = (
+        '量測待辦清單第一頁與深層分頁在不同資料量下的延遲 (keyset 分頁應與總筆數無關) '
+        'cold 每次請求前清除快取 量測查詢的成本 warm 為清單快取命中'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,50000', help='每位使用者的待辦數量 以逗號分隔')
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--page-size', type=int, default=20)
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        with bench_database():
+            client = Client()
+            user = create_bench_user('bench')
+            client.force_login(user)
+            url = reverse('todos')
+            seeded = 0
+            for size in sizes:
+                seed_todos(user, size - seeded, seed=size)
+                seeded = size
+                # 深層分頁取資料中段的游標 模擬使用者往後翻很多頁
+                middle = ToDo.objects.filter(user=user).order_by('due_date', 'id')[size // 2]
+                deep_cursor = f'{middle.due_date.isoformat()}_{middle.id}'
+                params = {'page_size': options['page_size']}
+                pages = {'first page': params, 'deep page': {**params, 'after': deep_cursor}}
+                results = []
+                for label, page_params in pages.items():
+                    get = lambda: client.get(url, page_params)
+                    cold = summarize(measure(get, options['repeat'], before=cache.clear))
+                    get()
+                    warm = summarize(measure(get, options['repeat']))
+                    results.append(
+                        f'{label} cold p50={cold["p50_ms"]}ms p99={cold["p99_ms"]}ms '
+                        f'warm p50={warm["p50_ms"]}ms p99={warm["p99_ms"]}ms'
+                    )
+                self.stdout.write(f'{size:>8} todos  ' + '  '.join(results))
@@ -0,0 +1,88 @@
+import json
+import random
+import subprocess
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from ToDos.bench import (
+    QUERY_BUDGETS, SCENARIOS, bench_database, create_bench_users, run_scenario, seed_todos, summarize,
+)
+from ToDos.models import ToDo
+
+
+class Command(BaseCommand):
+    help = (
+        '對 urls.py 中每個 view 量測 p50/p95/p99 延遲與每次請求的查詢數 並檢查查詢數上限 '
+        '結果輸出為 JSON 方便比較不同 commit 例如 --users 1000 --todos 10000'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--todos', type=int, default=1000, help='每位使用者的待辦數量')
+        parser.add_argument('--repeat', type=int, default=30)
+        parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help='只量測指定的情境 可重複')
+        parser.add_argument('--output', help='結果 JSON 的路徑 預設輸出到 stdout')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        names = options['scenario'] or list(SCENARIOS)
+        with bench_database():
+            users = create_bench_users(options['users'])
+            for user in users:
+                seed_todos(user, options['todos'], seed=options['seed'] + user.id)
+            # 量測對象為第一位使用者 需要 admin 權限才能量測 admin 頁面
+            user = users[0]
+            user.is_staff = user.is_superuser = True
+            user.save()
+            context = {
+                'user': user,
+                'rng': random.Random(options['seed']),
+                'todo_ids': list(ToDo.objects.filter(user=user).values_list('id', flat=True)),
+            }
+            client = Client()
+            results = {}
+            over_budget = []
+            for name in names:
+                samples, query_counts, statuses = [], [], set()
+                for _ in range(options['repeat']):
+                    elapsed, num_queries, status = run_scenario(client, name, context)
+                    samples.append(elapsed)
+                    query_counts.append(num_queries)
+                    statuses.add(status)
+                results[name] = {
+                    **summarize(samples),
+                    'queries': max(query_counts),
+                    'query_budget': QUERY_BUDGETS[name],
+                    'statuses': sorted(statuses),
+                }
+                if max(query_counts) > QUERY_BUDGETS[name]:
+                    over_budget.append(name)
+                self.stderr.write(
+                    f'{name:>22}  p50={results[name]["p50_ms"]}ms p95={results[name]["p95_ms"]}ms '
+                    f'p99={results[name]["p99_ms"]}ms  queries={max(query_counts)}/{QUERY_BUDGETS[name]}'
+                )
+
+        report = {
+            'commit': self.current_commit(),
+            'users': options['users'],
+            'todos_per_user': options['todos'],
+            'repeat': options['repeat'],
+            'results': results,
+        }
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+        if over_budget:
+            raise CommandError(f'超過查詢數上限: {", ".join(over_budget)}')
+
+    def current_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,119 @@
+import csv
+import json
+import os
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from ToDos import search, sharding
+from ToDos.cache import invalidate_calendar_months, invalidate_user_lists
+from ToDos.form import TodoForm
+from ToDos.models import ToDo, ToDoImportProgress
+from ToDos.stats import rebuild_stats
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        yield from csv.DictReader(f)
+
+
+def read_ndjson(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+READERS = {'csv': read_csv, 'ndjson': read_ndjson, 'jsonl': read_ndjson}
+
+
+class Command(BaseCommand):
+    help = (
+        '從 CSV 或 NDJSON (與 /todos/export 相同格式) 串流匯入待辦事項 '
+        '每筆以 TodoForm 驗證 分批 bulk_create 每批各自一個交易 失敗後可用 --resume 從最後完成的批次繼續 '
+        '進度與該批待辦寫在同一個交易中 (ToDoImportProgress) 重跑時不會重複也不會遺漏'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--user', required=True, help='匯入資料的擁有者 (使用者名稱)')
+        parser.add_argument('--format', choices=sorted(READERS), help='預設依副檔名判斷')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='只驗證不寫入')
+        parser.add_argument('--resume', action='store_true', help='略過這個檔案先前已寫入的資料列')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError(f'無法判斷檔案格式 {path} 請指定 --format')
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f'找不到使用者 {options["user"]}')
+
+        source = os.path.abspath(path)
+        progress = ToDoImportProgress.objects.filter(user=user, source=source)
+        skip = 0
+        if options['resume']:
+            with sharding.for_user(user.id):
+                skip = progress.values_list('rows', flat=True).first() or 0
+            if skip:
+                self.stdout.write(f'從第 {skip + 1} 列繼續匯入')
+
+        dry_run = options['dry_run']
+        batch_size = options['batch_size']
+        batch = []
+        inserted = rejected = 0
+        row_number = 0
+        start = time.perf_counter()
+
+        def flush():
+            nonlocal inserted, batch
+            if not dry_run:
+                try:
+                    with sharding.atomic(user.id):
+                        ToDo.objects.bulk_create(batch)
+                        search.index_todos(batch)
+                        invalidate_calendar_months(user.id, [todo.due_date for todo in batch])
+                        # 進度與這批待辦一起 commit 或一起 rollback 重跑時不會重複也不會遺漏
+                        ToDoImportProgress.objects.update_or_create(user=user, source=source, defaults={'rows': row_number})
+                except Exception as exc:
+                    raise CommandError(
+                        f'第 {row_number - len(batch) + 1}-{row_number} 列寫入失敗: {exc} 修正後以 --resume 重新執行'
+                    ) from exc
+            inserted += len(batch)
+            batch = []
+
+        try:
+            for row_number, row in enumerate(READERS[file_format](path), start=1):
+                if row_number <= skip:
+                    continue
+                form = TodoForm(data=row)
+                if not form.is_valid():
+                    rejected += 1
+                    errors = '; '.join(f'{field}: {" ".join(messages)}' for field, messages in form.errors.items())
+                    self.stderr.write(f'第 {row_number} 列略過 {errors}')
+                    continue
+                todo = form.save(commit=False)
+                todo.user = user
+                batch.append(todo)
+                if len(batch) >= batch_size:
+                    flush()
+            if batch:
+                flush()
+        finally:
+            if not dry_run and inserted:
+                # bulk_create 不經過 views 與 signals 統一重建統計並讓清單快取失效
+                rebuild_stats(user)
+                invalidate_user_lists(user.id)
+
+        if not dry_run:
+            with sharding.for_user(user.id):
+                progress.delete()
+        elapsed = time.perf_counter() - start
+        action = '可匯入' if dry_run else '匯入'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {inserted} 筆 略過 {rejected} 筆 耗時 {elapsed:.2f}s ({inserted / elapsed if elapsed else 0:.0f} 筆/秒)'
+        ))
@@ -0,0 +1,39 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ToDos import changes, purge, sharding
+
+
+class Command(BaseCommand):
+    help = (
+        '分批刪除早於保留期限的 ToDoTombstone 每批一個短交易 可排程定期執行 '
+        '游標早於期限的客戶端在 /todos/changes 會收到 410 需重新完整同步'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='保留幾天內的 tombstone 預設為 TODO_TOMBSTONE_RETENTION_DAYS')
+        parser.add_argument('--batch-size', type=int, default=purge.DEFAULT_BATCH_SIZE, help='每個交易刪除的筆數')
+        parser.add_argument('--sleep', type=float, default=0.0, help='每批之間暫停的秒數 讓其他寫入有機會取得鎖')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size 必須大於 0')
+        days = settings.TODO_TOMBSTONE_RETENTION_DAYS if options['days'] is None else options['days']
+        if days < 0:
+            raise CommandError('--days 不可為負數')
+        cutoff = changes.retention_cutoff(days)
+
+        deleted = batches = 0
+        for _ in sharding.each_shard():
+            while True:
+                count = purge.prune_tombstones_batch(cutoff, options['batch_size'])
+                if not count:
+                    break
+                deleted += count
+                batches += 1
+                self.stdout.write(f'已刪除 {deleted} 筆')
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f'清除完成 共 {deleted} 筆 {batches} 批'))
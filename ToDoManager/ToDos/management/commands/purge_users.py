@@ -0,0 +1,51 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from ToDos import purge
+
+
+class Command(BaseCommand):
+    help = (
+        '刪除指定的使用者與其所有待辦 先停用帳號 再分批刪除相關資料 每批一個短交易 最後才刪除 User '
+        '中途中斷時重新執行即可繼續 --queued 刪除 admin 排入佇列的使用者 (可排程定期執行)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='要刪除的使用者名稱')
+        parser.add_argument('--queued', action='store_true', help='刪除 admin 排入佇列的使用者 已在 admin 確認過 不再詢問')
+        parser.add_argument('--batch-size', type=int, default=purge.DEFAULT_BATCH_SIZE, help='每個交易刪除的筆數')
+        parser.add_argument('--sleep', type=float, default=0.0, help='每批之間暫停的秒數 讓其他寫入有機會取得鎖')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive', help='不詢問確認')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size 必須大於 0')
+        if options['queued'] == bool(options['usernames']):
+            raise CommandError('請指定使用者名稱或 --queued')
+        if options['queued']:
+            users = dict(
+                User.objects.filter(purge_request__isnull=False).order_by('purge_request__requested_at')
+                .values_list('username', 'id')
+            )
+            if not users:
+                self.stdout.write('刪除佇列中沒有使用者')
+        else:
+            users = self.get_users(options['usernames'], options['interactive'])
+
+        for username, user_id in users.items():
+            progress = lambda model, count: self.stdout.write(f'{username}: 已刪除 {model._meta.object_name} {count} 筆')
+            deleted, longest = purge.purge_user(user_id, options['batch_size'], options['sleep'], progress)
+            self.stdout.write(self.style.SUCCESS(
+                f'已刪除 {username} 共 {sum(deleted.values())} 筆相關資料 最長交易 {longest * 1000:.1f} ms'
+            ))
+
+    def get_users(self, usernames, interactive):
+        users = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+        missing = [username for username in usernames if username not in users]
+        if missing:
+            raise CommandError(f'找不到使用者 {", ".join(missing)}')
+        if interactive:
+            answer = input(f'將永久刪除 {", ".join(users)} 與其所有待辦 輸入 yes 繼續: ')
+            if answer != 'yes':
+                raise CommandError('已取消')
+        return users
@@ -0,0 +1,50 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from ToDos import rebalance, sharding
+
+
+class Command(BaseCommand):
+    help = (
+        '搬移使用者的待辦到其他分片 --user 與 --to 搬移單一使用者 '
+        '--all 搬移所在分片與雜湊結果不同的使用者 (增加 TODO_SHARDS 之後) '
+        '搬移期間該使用者只能讀取 中途中斷時重新執行即可'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='要搬移的使用者名稱')
+        parser.add_argument('--to', help='目標分片 例如 shard1')
+        parser.add_argument('--all', action='store_true', help='依雜湊結果搬移所有需要搬移的使用者')
+        parser.add_argument('--batch-size', type=int, default=rebalance.DEFAULT_BATCH_SIZE, help='每個交易複製的筆數')
+        parser.add_argument('--dry-run', action='store_true', help='只列出要搬移的使用者')
+
+    def handle(self, *args, **options):
+        if not sharding.enabled():
+            raise CommandError('沒有設定分片 (TODO_SHARDS)')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size 必須大於 0')
+        if options['all'] == bool(options['user']):
+            raise CommandError('請指定 --all 或 --user')
+
+        if options['all']:
+            moves = rebalance.misplaced_users()
+            names = dict(User.objects.filter(id__in=[user_id for user_id, _, _ in moves]).values_list('id', 'username'))
+            moves = [(names.get(user_id, user_id), user_id, source, target) for user_id, source, target in moves]
+        else:
+            if options['to'] not in sharding.aliases():
+                raise CommandError(f'--to 必須是 {", ".join(sharding.aliases())} 之一')
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f'找不到使用者 {options["user"]}')
+            moves = [(user.username, user.id, sharding.shard_for(user.id), options['to'])]
+
+        for username, user_id, source, target in moves:
+            if options['dry_run']:
+                self.stdout.write(f'{username}: {source} → {target}')
+                continue
+            progress = lambda message: self.stdout.write(f'{username}: {message}')
+            copied = rebalance.move_user(user_id, target, options['batch_size'], progress)
+            summary = ' '.join(f'{name} {count}' for name, count in copied.items()) or '已在目標分片 已清除殘留'
+            self.stdout.write(self.style.SUCCESS(f'{username}: {source} → {target} {summary}'))
+        if not moves:
+            self.stdout.write('沒有需要搬移的使用者')
@@ -0,0 +1,38 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from ToDos import sharding
+from ToDos.cache import invalidate_user_lists
+from ToDos.stats import compute_stats, rebuild_stats, stored_stats
+
+
+class Command(BaseCommand):
+    help = '檢查並重建每位使用者的待辦統計 (ToDoStats / ToDoDueCount) 修正 admin 等路徑造成的偏差'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='只檢查不修正 有偏差時以非零狀態結束')
+        parser.add_argument('--user', help='只處理指定的使用者名稱')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options['user']:
+            users = users.filter(username=options['user'])
+        drifted = 0
+        for user in users.iterator():
+            with sharding.for_user(user.id):
+                counts, due_counts = compute_stats(user)
+                stored_counts, stored_due_counts = stored_stats(user)
+            if counts == stored_counts and due_counts == stored_due_counts:
+                continue
+            drifted += 1
+            self.stdout.write(
+                f'{user.username}: 統計 {stored_counts} 實際 {counts}'
+                f'{"" if due_counts == stored_due_counts else " 截止日期分布不一致"}'
+            )
+            if not options['check']:
+                rebuild_stats(user)
+                invalidate_user_lists(user.id)
+        if options['check'] and drifted:
+            raise CommandError(f'{drifted} 位使用者的統計有偏差')
+        action = '檢查' if options['check'] else '重建'
+        self.stdout.write(self.style.SUCCESS(f'{action}完成 {drifted} 位使用者有偏差'))
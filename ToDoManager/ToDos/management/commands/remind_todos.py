@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from ToDos import reminders, sharding
+
+
+class Command(BaseCommand):
+    help = (
+        '到期提醒 worker 每一輪掃描截止日期在窗口內的未完成待辦 寫入 outbox 再寄出所有待寄的提醒 '
+        '重複執行或中斷後重新啟動都不會重複建立提醒 加上 --once 只執行一輪 (可交給 cron)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='只執行一輪')
+        parser.add_argument('--interval', type=float, help='每一輪之間的秒數 預設為 TODO_REMINDERS["INTERVAL"]')
+        parser.add_argument('--days-ahead', type=int, help='提醒幾天內到期的待辦 預設為 TODO_REMINDERS["DAYS_AHEAD"]')
+        parser.add_argument('--batch-size', type=int, help='每個交易處理的筆數 預設為 TODO_REMINDERS["BATCH_SIZE"]')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] is not None and options['batch_size'] < 1:
+            raise CommandError('--batch-size 必須大於 0')
+        if options['days_ahead'] is not None and options['days_ahead'] < 0:
+            raise CommandError('--days-ahead 不可小於 0')
+        interval = reminders.get_setting('INTERVAL') if options['interval'] is None else options['interval']
+        try:
+            while True:
+                self.run_once(options['days_ahead'], options['batch_size'])
+                if options['once']:
+                    break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            # 已寫入 outbox 的提醒不會遺失 下次啟動時繼續寄送
+            self.stdout.write('已停止')
+
+    def run_once(self, days_ahead, batch_size):
+        start = time.perf_counter()
+        today = timezone.localdate()
+        enqueued = sent = 0
+        for _ in sharding.each_shard():
+            enqueued += reminders.scan(today, days_ahead, batch_size)
+            sent += reminders.send_pending(batch_size)
+        self.stdout.write(
+            f'{timezone.localtime():%Y-%m-%d %H:%M:%S} 新增提醒 {enqueued} 筆 寄出 {sent} 封 '
+            f'耗時 {(time.perf_counter() - start) * 1000:.1f} ms'
+        )
@@ -0,0 +1,118 @@
+import contextlib
+import json
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.db import connections
+from django.utils import timezone
+
+from ToDos.timing import TimingRecorder, current_recorder
+
+slow_request_logger = logging.getLogger('ToDos.slow_requests')
+
+DEFAULT_TIMING = {
+    'SAMPLE_RATE': 1.0,         # 0 ~ 1 被量測的請求比例 未抽中的請求不做任何紀錄
+    'SLOW_REQUEST_MS': 500,     # 超過此時間的請求寫入 ToDos.slow_requests logger
+    'SLOWEST_QUERIES': 5,       # 慢請求紀錄中附上的最慢查詢筆數
+}
+
+
+class RequestTimingMiddleware:
+    """
+    記錄每個請求的 SQL 次數與耗時 範本 render 時間與總時間
+    以 Server-Timing header 回傳 超過門檻的請求以 JSON 寫入 slow request log
+    不依賴 DEBUG 設定 抽樣率 (TODO_TIMING['SAMPLE_RATE']) 調低時未抽中的請求幾乎沒有額外成本
+    同步與非同步皆可 ASGI 下這個 (第一個) middleware 不經過 sync_to_async 其餘 middleware 也不必切換執行緒
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        options = {**DEFAULT_TIMING, **getattr(settings, 'TODO_TIMING', {})}
+        self.sample_rate = options['SAMPLE_RATE']
+        self.slow_request_ms = options['SLOW_REQUEST_MS']
+        self.slowest_queries = options['SLOWEST_QUERIES']
+
+    def sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def wrap_connections(self, stack, recorder):
+        # 分片時查詢分散在多個資料庫 每個連線都要記錄
+        for db_connection in connections.all():
+            stack.enter_context(db_connection.execute_wrapper(recorder))
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+
+        recorder = TimingRecorder(self.slowest_queries)
+        token = current_recorder.set(recorder)
+        start = time.perf_counter()
+        try:
+            with contextlib.ExitStack() as stack:
+                self.wrap_connections(stack, recorder)
+                response = self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        total_ms = self.add_header(response, recorder, start)
+        if total_ms >= self.slow_request_ms:
+            user_id = request.session.get(SESSION_KEY) if hasattr(request, 'session') else None
+            self.log_slow_request(request, response, recorder, total_ms, user_id)
+        return response
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+
+        recorder = TimingRecorder(self.slowest_queries)
+        token = current_recorder.set(recorder)
+        start = time.perf_counter()
+        stack = contextlib.ExitStack()
+        try:
+            # ORM 的查詢在 sync_to_async 的執行緒 (同一個請求共用一個) 中執行 連線是每個執行緒各自的
+            # execute_wrapper 必須在那個執行緒的連線上安裝 / 移除
+            await sync_to_async(self.wrap_connections)(stack, recorder)
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(stack.close)()
+        finally:
+            current_recorder.reset(token)
+        total_ms = self.add_header(response, recorder, start)
+        if total_ms >= self.slow_request_ms:
+            user_id = await request.session.aget(SESSION_KEY) if hasattr(request, 'session') else None
+            self.log_slow_request(request, response, recorder, total_ms, user_id)
+        return response
+
+    def add_header(self, response, recorder, start):
+        total_ms = (time.perf_counter() - start) * 1000
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={recorder.db_ms:.1f};desc="{recorder.query_count} queries"',
+            f'tpl;dur={recorder.template_ms:.1f}',
+            f'app;dur={max(0.0, total_ms - recorder.db_ms - recorder.template_ms):.1f}',
+            f'total;dur={total_ms:.1f}',
+        ])
+        return total_ms
+
+    def log_slow_request(self, request, response, recorder, total_ms, user_id):
+        slow_request_logger.warning(json.dumps({
+            'time': timezone.now().isoformat(),
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'user_id': user_id,
+            'total_ms': round(total_ms, 3),
+            'db_ms': round(recorder.db_ms, 3),
+            'template_ms': round(recorder.template_ms, 3),
+            'queries': recorder.query_count,
+            'slowest_queries': recorder.slowest_queries(),
+        }, ensure_ascii=False))
@@ -0,0 +1,60 @@
+# Generated by Django 5.1.15 on 2026-10-18 17:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def populate_stats(apps, schema_editor):
+    # 為既有資料建立統計 一次性的 GROUP BY 之後由 views 增量維護
+    ToDo = apps.get_model('ToDos', 'ToDo')
+    ToDoStats = apps.get_model('ToDos', 'ToDoStats')
+    ToDoDueCount = apps.get_model('ToDos', 'ToDoDueCount')
+    alias = schema_editor.connection.alias
+    totals = (
+        ToDo.objects.using(alias).values('user_id')
+        .annotate(total=Count('id'), completed=Count('id', filter=Q(completed=True)))
+        .order_by()
+    )
+    ToDoStats.objects.using(alias).bulk_create(ToDoStats(**row) for row in totals)
+    due_counts = (
+        ToDo.objects.using(alias).filter(completed=False)
+        .values('user_id', 'due_date')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    ToDoDueCount.objects.using(alias).bulk_create((ToDoDueCount(**row) for row in due_counts), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ToDos', '0002_todo_list_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ToDoStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('completed', models.PositiveIntegerField(default=0)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='todo_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ToDoDueCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('due_date', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='todo_due_counts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'due_date'), name='todo_due_count_unique')],
+            },
+        ),
+        migrations.RunPython(populate_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.15 on 2026-10-18 17:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ToDos', '0003_todo_stats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='todostats',
+            name='completed',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='todostats',
+            name='total',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.15 on 2026-10-18 17:45
+
+from django.db import migrations
+
+from ToDos.search import fts5_available, segment
+
+
+def create_fts(apps, schema_editor):
+    # 非 SQLite 或沒有 FTS5 時不建立 搜尋會退回 icontains
+    if not fts5_available(schema_editor.connection):
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE todo_fts USING fts5(owner, title, description, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    ToDo = apps.get_model('ToDos', 'ToDo')
+    rows = ToDo.objects.using(schema_editor.connection.alias).values_list('id', 'user_id', 'title', 'description').iterator(chunk_size=2000)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(
+            'INSERT INTO todo_fts (rowid, owner, title, description) VALUES (%s, %s, %s, %s)',
+            ((todo_id, f'u{user_id}', segment(title), segment(description)) for todo_id, user_id, title, description in rows),
+        )
+
+
+def drop_fts(apps, schema_editor):
+    if fts5_available(schema_editor.connection):
+        schema_editor.execute('DROP TABLE IF EXISTS todo_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ToDos', '0004_todo_stats_allow_drift'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
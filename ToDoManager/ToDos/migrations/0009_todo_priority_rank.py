@@ -0,0 +1,60 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def keep_id_sequence(apps, schema_editor):
+    # SQLite 新增 stored generated column 時會重建資料表 AUTOINCREMENT 的序號會退回目前最大的 id
+    # 封存與 tombstone 依賴 id 不重複使用 序號至少要大於所有曾經出現過的 id
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    ToDo = apps.get_model('ToDos', 'ToDo')
+    ArchivedToDo = apps.get_model('ToDos', 'ArchivedToDo')
+    ToDoTombstone = apps.get_model('ToDos', 'ToDoTombstone')
+    alias = schema_editor.connection.alias
+    used = max(
+        ToDo.objects.using(alias).aggregate(value=models.Max('id'))['value'] or 0,
+        ArchivedToDo.objects.using(alias).aggregate(value=models.Max('id'))['value'] or 0,
+        ToDoTombstone.objects.using(alias).aggregate(value=models.Max('todo_id'))['value'] or 0,
+    )
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('UPDATE sqlite_sequence SET seq = MAX(seq, %s) WHERE name = %s', [used, ToDo._meta.db_table])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ToDos', '0008_todo_changes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedtodo',
+            name='priority_rank',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(priority='high', then=models.Value(0)), models.When(priority='medium', then=models.Value(1)), models.When(priority='low', then=models.Value(2)), default=models.Value(3)), output_field=models.PositiveSmallIntegerField()),
+        ),
+        migrations.AddField(
+            model_name='todo',
+            name='priority_rank',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(priority='high', then=models.Value(0)), models.When(priority='medium', then=models.Value(1)), models.When(priority='low', then=models.Value(2)), default=models.Value(3)), output_field=models.PositiveSmallIntegerField()),
+        ),
+        migrations.AddIndex(
+            model_name='archivedtodo',
+            index=models.Index(fields=['user', 'priority_rank', 'due_date', 'id'], name='archived_user_rank_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(fields=['user', 'priority_rank', 'due_date', 'id'], name='todo_user_rank_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(fields=['user', 'completed', 'priority_rank', 'due_date', 'id'], name='todo_user_done_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(fields=['user', 'completed', 'id'], name='todo_user_done_id_idx'),
+        ),
+        migrations.RunPython(keep_id_sequence, migrations.RunPython.noop),
+    ]
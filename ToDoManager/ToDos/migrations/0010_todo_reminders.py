@@ -0,0 +1,44 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ToDos', '0009_todo_priority_rank'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ToDoReminder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('todo_id', models.IntegerField()),
+                ('due_date', models.DateField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(condition=models.Q(('completed', False)), fields=['due_date', 'id'], name='todo_open_due_idx'),
+        ),
+        migrations.AddField(
+            model_name='todoreminder',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='todo_reminders', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='todoreminder',
+            index=models.Index(condition=models.Q(('sent_at__isnull', True)), fields=['id'], name='reminder_pending_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='todoreminder',
+            constraint=models.UniqueConstraint(fields=('todo_id', 'due_date'), name='reminder_todo_due_unique'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def keep_id_sequence(apps, schema_editor):
+    # 與 0009 相同 改欄位會重建 SQLite 資料表 AUTOINCREMENT 的序號需至少大於所有曾經出現過的 id
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    ToDo = apps.get_model('ToDos', 'ToDo')
+    ArchivedToDo = apps.get_model('ToDos', 'ArchivedToDo')
+    ToDoTombstone = apps.get_model('ToDos', 'ToDoTombstone')
+    alias = schema_editor.connection.alias
+    used = max(
+        ToDo.objects.using(alias).aggregate(value=models.Max('id'))['value'] or 0,
+        ArchivedToDo.objects.using(alias).aggregate(value=models.Max('id'))['value'] or 0,
+        ToDoTombstone.objects.using(alias).aggregate(value=models.Max('todo_id'))['value'] or 0,
+    )
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('UPDATE sqlite_sequence SET seq = MAX(seq, %s) WHERE name = %s', [used, ToDo._meta.db_table])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ToDos', '0010_todo_reminders'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserShard',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='todo_shard', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('alias', models.CharField(max_length=50)),
+                ('moving', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='archivedtodo',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_todos', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='todo',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='todos', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='tododuecount',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='todo_due_counts', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='todoreminder',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='todo_reminders', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='todostats',
+            name='user',
+            field=models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='todo_stats', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='todotombstone',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='todo_tombstones', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(keep_id_sequence, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ToDos', '0011_todo_sharding'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ToDoRecurrence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=100)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('priority', models.CharField(choices=[('high', '高'), ('medium', '中'), ('low', '低')], max_length=6)),
+                ('start_date', models.DateField()),
+                ('frequency', models.CharField(choices=[('daily', '每天'), ('weekly', '每週')], max_length=6)),
+                ('interval', models.PositiveSmallIntegerField(default=1)),
+                ('until', models.DateField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='todo_recurrences', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ToDoOccurrence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('occurrence_date', models.DateField()),
+                ('todo_id', models.IntegerField(blank=True, null=True)),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='todo_occurrences', to=settings.AUTH_USER_MODEL)),
+                ('recurrence', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occurrences', to='ToDos.todorecurrence')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='todorecurrence',
+            index=models.Index(fields=['user', 'start_date'], name='recurrence_user_start_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='todooccurrence',
+            constraint=models.UniqueConstraint(fields=('recurrence', 'occurrence_date'), name='occurrence_recurrence_date_unique'),
+        ),
+    ]
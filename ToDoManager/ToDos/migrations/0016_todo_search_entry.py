@@ -0,0 +1,29 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ToDos', '0015_todo_import_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ToDoSearchEntry',
+            fields=[
+                ('todo', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='ToDos.todo')),
+                ('owner', models.TextField()),
+                ('title', models.TextField()),
+                ('description', models.TextField()),
+                ('document', models.TextField(db_column='todo_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'todo_fts',
+                'managed': False,
+            },
+        ),
+    ]
@@ -1,6 +1,27 @@
 from django.db import models
 from django.contrib.auth.models import User
 
+PRIORITY_RANKS = {'high': 0, 'medium': 1, 'low': 2}   #數字越小越優先 依 priority_rank 遞增排序即為高到低
+
+
+def priority_rank_expression():
+    # priority_rank 由資料庫依 priority 計算並儲存 bulk_create 與 raw SQL 的寫入也不會不一致
+    return models.Case(
+        *[models.When(priority = priority, then = models.Value(rank)) for priority, rank in PRIORITY_RANKS.items()],
+        default = models.Value(len(PRIORITY_RANKS)),
+    )
+
+
+class ToDoQuerySet(models.QuerySet):
+    def with_overdue(self, today):
+        # 逾期由資料庫判斷 (未完成且 due_date < today) 模板只讀 overdue 不再比較日期字串
+        return self.annotate(overdue = models.Case(
+            models.When(completed = False, due_date__lt = today, then = models.Value(True)),
+            default = models.Value(False),
+            output_field = models.BooleanField(),
+        ))
+
+
 # Create your models here.
 class ToDo(models.Model):
     PRIORITY_CHOICES = [
@@ -8,13 +29,252 @@ class ToDo(models.Model):
         ('medium' , '中'),
         ('low' , '低'),
     ]
-    user = models.ForeignKey(User, on_delete = models.CASCADE, related_name = 'todos')
+    user = models.ForeignKey(User, on_delete = models.CASCADE, related_name = 'todos', db_constraint = False)
     title = models.CharField(max_length = 100)
     description = models.TextField(blank  = True , null = True) #charfield通常用於固定長度字串 使用text更適合長文本
     due_date = models.DateField()
     priority = models.CharField(max_length = 6 , choices = PRIORITY_CHOICES)
     completed = models.BooleanField(default = False)  #沒有設定參數時 boolean預設為none
     created_at = models.DateTimeField(auto_now_add = True)
+    updated_at = models.DateTimeField(auto_now = True)    #raw UPDATE 不會自動更新 ToDos.operations 中自行設定
+    priority_rank = models.GeneratedField(
+        expression = priority_rank_expression(), output_field = models.PositiveSmallIntegerField(), db_persist = True
+    )
+
+    objects = ToDoQuerySet.as_manager()
+
+    class Meta:
+        # 清單以 (due_date, id) 做 keyset 分頁 索引順序需與查詢條件一致
+        indexes = [
+            models.Index(fields = ['user', 'completed', 'due_date', 'id'], name = 'todo_user_done_due_idx'),
+            models.Index(fields = ['user', 'due_date', 'id'], name = 'todo_user_due_idx'),
+            # admin 不限使用者 依 (due_date, id) 排序 篩選欄位放在前面 篩選後仍可直接依索引順序讀前 100 筆
+            models.Index(fields = ['due_date', 'id'], name = 'todo_due_idx'),
+            models.Index(fields = ['priority', 'due_date', 'id'], name = 'todo_priority_due_idx'),
+            models.Index(fields = ['completed', 'due_date', 'id'], name = 'todo_done_due_idx'),
+            # /todos/changes 依 (updated_at, id) 往後讀
+            models.Index(fields = ['user', 'updated_at', 'id'], name = 'todo_user_updated_idx'),
+            # 清單的 sort=priority 與 sort=created (依 id 遞減)
+            models.Index(fields = ['user', 'priority_rank', 'due_date', 'id'], name = 'todo_user_rank_due_idx'),
+            models.Index(fields = ['user', 'completed', 'priority_rank', 'due_date', 'id'], name = 'todo_user_done_rank_idx'),
+            models.Index(fields = ['user', 'completed', 'id'], name = 'todo_user_done_id_idx'),
+            # 到期提醒只掃描未完成的待辦 部分索引只包含這些列 (見 ToDos.reminders)
+            models.Index(fields = ['due_date', 'id'], condition = models.Q(completed = False), name = 'todo_open_due_idx'),
+            # 月曆的 GROUP BY due_date, priority, completed 只讀這個索引 (見 ToDos.calendar_counts)
+            models.Index(fields = ['user', 'due_date', 'priority', 'completed'], name = 'todo_user_calendar_idx'),
+        ]
+
+    is_archived = False
+    is_virtual = False      #依重複規則展開 尚未寫入的待辦 (見 ToDos.recurrence)
+
+    def __str__(self):
+        return(self.title)
+
+
+class ArchivedToDo(models.Model):
+    # 封存的已完成待辦 由 ToDos.archive 整批搬移 保留原本的 id 還原時原樣搬回 ToDo
+    # 欄位與 ToDo 相同 (另加 archived_at) 搬移以 INSERT ... SELECT 完成
+    id = models.IntegerField(primary_key = True)
+    user = models.ForeignKey(User, on_delete = models.CASCADE, related_name = 'archived_todos', db_constraint = False)
+    title = models.CharField(max_length = 100)
+    description = models.TextField(blank = True , null = True)
+    due_date = models.DateField()
+    priority = models.CharField(max_length = 6 , choices = ToDo.PRIORITY_CHOICES)
+    completed = models.BooleanField(default = True)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField()
+    priority_rank = models.GeneratedField(
+        expression = priority_rank_expression(), output_field = models.PositiveSmallIntegerField(), db_persist = True
+    )
+
+    objects = ToDoQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields = ['user', 'due_date', 'id'], name = 'archived_user_due_idx'),
+            models.Index(fields = ['user', 'priority_rank', 'due_date', 'id'], name = 'archived_user_rank_due_idx'),
+        ]
+
+    is_archived = True
+
+    def __str__(self):
+        return(self.title)
+
+
+class ToDoTombstone(models.Model):
+    # 已刪除 (或封存) 的待辦 讓 /todos/changes 可以告訴客戶端刪掉哪些 id
+    user = models.ForeignKey(User, on_delete = models.CASCADE, related_name = 'todo_tombstones', db_constraint = False)
+    todo_id = models.IntegerField()
+    deleted_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields = ['user', 'deleted_at', 'todo_id'], name = 'tombstone_user_deleted_idx'),
+            models.Index(fields = ['deleted_at'], name = 'tombstone_deleted_idx'),    #prune_tombstones 依保留期限清除
+        ]
+
+    def __str__(self):
+        return(f'{self.user} #{self.todo_id}')
+
+
+class ToDoStats(models.Model):
+    # 每位使用者的待辦統計 由 ToDos.stats 在異動的同一個交易中以 F() 增減維護
+    user = models.OneToOneField(User, on_delete = models.CASCADE, related_name = 'todo_stats', db_constraint = False)
+    total = models.IntegerField(default = 0)        #admin 等路徑造成偏差時可能暫時為負 不加 CHECK 以免阻擋使用者操作
+    completed = models.IntegerField(default = 0)
+
+    @property
+    def incomplete(self):
+        return self.total - self.completed
+
+    def __str__(self):
+        return(f'{self.user} {self.completed}/{self.total}')
+
+
+class ToDoDueCount(models.Model):
+    # 未完成待辦依截止日期的分布 逾期數 = due_date < 今天 的 count 總和 只需掃描不同日期的筆數
+    user = models.ForeignKey(User, on_delete = models.CASCADE, related_name = 'todo_due_counts', db_constraint = False)
+    due_date = models.DateField()
+    count = models.IntegerField(default = 0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields = ['user', 'due_date'], name = 'todo_due_count_unique'),
+        ]
+
+
+class ToDoReminder(models.Model):
+    # 到期提醒的 outbox 由 ToDos.reminders 掃描時寫入 寄出後記下 sent_at
+    # 每筆待辦的每個截止日期只有一筆 重複掃描不會重複建立 todo_id 不設外鍵 raw DELETE 待辦時不受影響
+    user = models.ForeignKey(User, on_delete = models.CASCADE, related_name = 'todo_reminders', db_constraint = False)
+    todo_id = models.IntegerField()
+    due_date = models.DateField()
+    created_at = models.DateTimeField(auto_now_add = True)
+    claimed_at = models.DateTimeField(null = True, blank = True)  #寄送中 worker 中斷時租約到期後重新寄送
+    sent_at = models.DateTimeField(null = True, blank = True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields = ['todo_id', 'due_date'], name = 'reminder_todo_due_unique'),
+        ]
+        indexes = [
+            models.Index(fields = ['id'], condition = models.Q(sent_at__isnull = True), name = 'reminder_pending_idx'),
+        ]
+
+    def __str__(self):
+        return(f'{self.user} #{self.todo_id} {self.due_date}')
+
+
+class ToDoRecurrence(models.Model):
+    # 重複待辦的規則 每一次的待辦在清單中依規則即時展開 只有完成或編輯時才寫入 ToDo (見 ToDos.recurrence)
+    FREQUENCY_CHOICES = [
+        ('daily' , '每天'),
+        ('weekly' , '每週'),
+    ]
+    user = models.ForeignKey(User, on_delete = models.CASCADE, related_name = 'todo_recurrences', db_constraint = False)
+    title = models.CharField(max_length = 100)
+    description = models.TextField(blank = True , null = True)
+    priority = models.CharField(max_length = 6 , choices = ToDo.PRIORITY_CHOICES)
+    start_date = models.DateField()     #第一次的截止日期
+    frequency = models.CharField(max_length = 6 , choices = FREQUENCY_CHOICES)
+    interval = models.PositiveSmallIntegerField(default = 1)    #每隔幾天 / 幾週
+    until = models.DateField(null = True , blank = True)    #最後一次的日期上限 空白表示不結束
+    created_at = models.DateTimeField(auto_now_add = True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields = ['user', 'start_date'], name = 'recurrence_user_start_idx'),
+        ]
+
+    def __str__(self):
+        return(f'{self.title} ({self.get_frequency_display()})')
+
+
+class ToDoOccurrence(models.Model):
+    # 已不再依規則展開的那一次 todo_id 為寫入的 ToDo 刪除 (略過) 時為 None
+    user = models.ForeignKey(User, on_delete = models.CASCADE, related_name = 'todo_occurrences', db_constraint = False)
+    recurrence = models.ForeignKey(ToDoRecurrence, on_delete = models.CASCADE, related_name = 'occurrences')
+    occurrence_date = models.DateField()
+    todo_id = models.IntegerField(null = True , blank = True)  #不建立外鍵 ToDo 以 raw DELETE 刪除時不需一併處理
+
+    class Meta:
+        constraints = [
+            # 同一次只會寫入一次 重複點擊 / 同時送出時由資料庫擋下
+            models.UniqueConstraint(fields = ['recurrence', 'occurrence_date'], name = 'occurrence_recurrence_date_unique'),
+        ]
+
+    def __str__(self):
+        return(f'{self.recurrence_id} {self.occurrence_date}')
+
+
+class ToDoImportProgress(models.Model):
+    # import_todos 已寫入的列數 與該批待辦在同一個交易中更新 --resume 從這裡繼續 匯入完成後刪除
+    user = models.ForeignKey(User, on_delete = models.CASCADE, related_name = 'todo_imports', db_constraint = False)
+    source = models.CharField(max_length = 512)  #匯入檔案的絕對路徑
+    rows = models.IntegerField(default = 0)
+    updated_at = models.DateTimeField(auto_now = True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields = ['user', 'source'], name = 'import_progress_user_source_unique'),
+        ]
+
+    def __str__(self):
+        return(f'{self.user} {self.source} {self.rows}')
+
+
+class FullTextMatch(models.Lookup):
+    # SQLite FTS5 的 MATCH 左邊為與虛擬表同名的隱藏欄位 (ToDoSearchEntry.document)
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', [*lhs_params, *rhs_params]
+
+
+class ToDoSearchEntry(models.Model):
+    # FTS5 虛擬表 todo_fts (migration 0005 以 raw SQL 建立 沒有 FTS5 時不存在) 寫入由 ToDos.search 以 raw SQL 維護
+    # 只用於搜尋時從 ToDo join 比對並取得 rank (bm25) 刪除 ToDo 時 ORM 不處理 (DO_NOTHING)
+    todo = models.OneToOneField(
+        ToDo, on_delete = models.DO_NOTHING, primary_key = True, db_column = 'rowid', related_name = 'search_entry',
+        db_constraint = False,
+    )
+    owner = models.TextField()  #u<user_id>
+    title = models.TextField()  #已切成雙字 (見 ToDos.search.segment)
+    description = models.TextField()
+    document = models.TextField(db_column = 'todo_fts')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'todo_fts'
+
+
+ToDoSearchEntry._meta.get_field('document').register_lookup(FullTextMatch)
+
+
+# 依使用者分片存放的 model (見 ToDos.sharding) 指向 User 的外鍵都不建立資料庫層的約束 User 只在 default 上
+SHARDED_MODELS = {
+    ToDo, ArchivedToDo, ToDoTombstone, ToDoStats, ToDoDueCount, ToDoReminder, ToDoRecurrence, ToDoOccurrence,
+    ToDoImportProgress, ToDoSearchEntry,
+}
+
+
+class UserShard(models.Model):
+    # 使用者的待辦所在的分片 (只存在 default) 第一次存取時依雜湊建立 rebalance_shards 搬移時更新
+    user = models.OneToOneField(User, on_delete = models.CASCADE, primary_key = True, related_name = 'todo_shard')
+    alias = models.CharField(max_length = 50)
+    moving = models.BooleanField(default = False)   #搬移中 暫停這位使用者的寫入
+
+    def __str__(self):
+        return(f'{self.user_id} → {self.alias}')
+
+
+class UserPurgeRequest(models.Model):
+    # admin 排入刪除佇列的使用者 (只存在 default) 由 manage.py purge_users --queued 分批刪除 刪除 User 時一併移除
+    user = models.OneToOneField(User, on_delete = models.CASCADE, primary_key = True, related_name = 'purge_request')
+    requested_at = models.DateTimeField(auto_now_add = True)
 
     def __str__(self):
-        return(self.title)
\ No newline at end of file
+        return(f'{self.user_id} @ {self.requested_at}')
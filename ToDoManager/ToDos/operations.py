@@ -0,0 +1,286 @@
+"""
+待辦事項的寫入操作 資料與統計在同一個交易中更新
+
+同步與非同步 views 共用這些函式 非同步 views 透過 sync_to_async 呼叫 讓整段寫入留在同一個交易中
+
+切換與批次操作直接以一個 UPDATE / DELETE ... RETURNING 完成 不先讀出 model
+這些語句不會觸發 post_save / post_delete 因此清單快取 / 搜尋索引 / updated_at 在這裡自行處理
+月曆的快取依月份分開 每個寫入都依異動前後的 due_date 只讓那幾個月份失效 (RETURNING 一併回傳 due_date)
+所有刪除都寫入 ToDoTombstone 讓 /todos/changes 的客戶端知道要刪掉哪些 id
+資料庫不支援 RETURNING 時改為先讀出受影響的列再寫入
+
+所有寫入都包在 retry_on_locked 中 SQLite 併發寫入偶發 database is locked 時自動重試
+"""
+import collections
+import datetime
+import functools
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError
+from django.utils import timezone
+
+from ToDos import search, sharding, stats
+from ToDos.changes import write_tombstones
+from ToDos.cache import invalidate_calendar_months, invalidate_user_lists
+from ToDos.models import ToDo
+from ToDos.sharding import connection
+
+MAX_BULK_IDS = 1000
+RETRY_BASE_DELAY = 0.05
+
+
+def _is_locked(exc):
+    message = str(exc).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def retry_on_locked(func):
+    """
+    SQLite 回報 database is locked 時以指數退避加隨機抖動重試整個寫入
+    已在外層交易中時不重試 (無法只重做交易的一部分) 直接交給外層處理
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        retries = settings.TODO_WRITE_RETRIES
+        for attempt in range(retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as exc:
+                if connection.in_atomic_block or attempt == retries or not _is_locked(exc):
+                    raise
+                time.sleep(RETRY_BASE_DELAY * (2 ** attempt) * (0.5 + random.random()))
+    return wrapper
+
+
+@retry_on_locked
+def create_todo(todo):
+    with sharding.atomic(todo.user_id):
+        todo.save()
+        stats.record_created(todo)
+        invalidate_calendar_months(todo.user_id, [todo.due_date])
+    return todo
+
+
+@retry_on_locked
+def update_todo(todo, was_completed, old_due_date):
+    # was_completed / old_due_date 為修改前的值 用於計算統計差異
+    with sharding.atomic(todo.user_id):
+        todo.save()
+        stats.record_changed(todo, was_completed, old_due_date)
+        invalidate_calendar_months(todo.user_id, [old_due_date, todo.due_date])
+    return todo
+
+
+@retry_on_locked
+def delete_todo(todo):
+    with sharding.atomic(todo.user_id):
+        todo_id = todo.id   # delete() 之後 id 會被設為 None
+        todo.delete()
+        stats.record_deleted(todo)
+        invalidate_calendar_months(todo.user_id, [todo.due_date])
+        write_tombstones([(todo.user_id, todo_id)])
+
+
+def _can_return():
+    return connection.features.can_return_columns_from_insert
+
+
+def _table():
+    return connection.ops.quote_name(ToDo._meta.db_table)
+
+
+def _now():
+    # raw cursor 需要與 ORM 相同格式的時間字串 (SQLite 以 UTC 文字儲存)
+    return connection.ops.adapt_datetimefield_value(timezone.now())
+
+
+def _to_date(value):
+    # raw cursor 不經過 Django 的欄位轉換 SQLite 會回傳字串
+    return datetime.date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _returning(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _toggle(user_id, todo_id):
+    # 回傳 (切換後的狀態, due_date) 找不到時回傳 None
+    if _can_return():
+        rows = _returning(
+            f'UPDATE {_table()} SET completed = NOT completed, updated_at = %s WHERE id = %s AND user_id = %s '
+            f'RETURNING completed, due_date',
+            [_now(), todo_id, user_id],
+        )
+        return (bool(rows[0][0]), _to_date(rows[0][1])) if rows else None
+    row = ToDo.objects.select_for_update().filter(id=todo_id, user_id=user_id).values_list('completed', 'due_date').first()
+    if row is None:
+        return None
+    ToDo.objects.filter(id=todo_id).update(completed=not row[0], updated_at=timezone.now())
+    return not row[0], row[1]
+
+
+@retry_on_locked
+def set_completed(user_id, todo_id, completed=None):
+    """
+    只更新 completed 欄位 completed 為 None 時切換目前狀態
+    回傳更新後的狀態 找不到 (或不屬於該使用者) 時回傳 None
+    """
+    with sharding.atomic(user_id):
+        if completed is None:
+            toggled = _toggle(user_id, todo_id)
+            if toggled is None:
+                return None
+            completed, due_date = toggled
+        else:
+            due_dates = _update_completed(user_id, [todo_id], completed)
+            if not due_dates:
+                # 沒有列被更新 已是目標狀態或不存在
+                return completed if ToDo.objects.filter(id=todo_id, user_id=user_id).exists() else None
+            due_date = due_dates[0]
+        stats.record_bulk(user_id, completed=1 if completed else -1, due_deltas={due_date: -1 if completed else 1})
+        invalidate_calendar_months(user_id, [due_date])
+    invalidate_user_lists(user_id)
+    return completed
+
+
+def _update_completed(user_id, todo_ids, completed):
+    # 只更新狀態確實改變的列 回傳這些列的 due_date
+    if _can_return():
+        placeholders = ', '.join(['%s'] * len(todo_ids))
+        rows = _returning(
+            f'UPDATE {_table()} SET completed = %s, updated_at = %s WHERE user_id = %s AND completed = %s '
+            f'AND id IN ({placeholders}) RETURNING due_date',
+            [completed, _now(), user_id, not completed, *todo_ids],
+        )
+        return [_to_date(row[0]) for row in rows]
+    queryset = ToDo.objects.filter(user_id=user_id, completed=not completed, id__in=todo_ids)
+    due_dates = list(queryset.select_for_update().values_list('due_date', flat=True))
+    queryset.update(completed=completed, updated_at=timezone.now())
+    return due_dates
+
+
+@retry_on_locked
+def bulk_set_completed(user_id, todo_ids, completed):
+    # 一個 UPDATE 完成多筆 回傳實際改變的筆數
+    todo_ids = list(todo_ids)[:MAX_BULK_IDS]
+    if not todo_ids:
+        return 0
+    with sharding.atomic(user_id):
+        due_dates = _update_completed(user_id, todo_ids, completed)
+        delta = -1 if completed else 1
+        stats.record_bulk(
+            user_id,
+            completed=-delta * len(due_dates),
+            due_deltas={due_date: delta * count for due_date, count in collections.Counter(due_dates).items()},
+        )
+        invalidate_calendar_months(user_id, due_dates)
+    if due_dates:
+        invalidate_user_lists(user_id)
+    return len(due_dates)
+
+
+def _record_deleted(user_id, rows):
+    # rows 為被刪除的 (completed, due_date)
+    incomplete = collections.Counter(due_date for completed, due_date in rows if not completed)
+    stats.record_bulk(
+        user_id,
+        total=-len(rows),
+        completed=-sum(1 for completed, _ in rows if completed),
+        due_deltas={due_date: -count for due_date, count in incomplete.items()},
+    )
+
+
+@retry_on_locked
+def bulk_delete(user_id, todo_ids):
+    # 一個 DELETE 完成多筆 回傳刪除的筆數
+    todo_ids = list(todo_ids)[:MAX_BULK_IDS]
+    if not todo_ids:
+        return 0
+    with sharding.atomic(user_id):
+        if _can_return():
+            placeholders = ', '.join(['%s'] * len(todo_ids))
+            rows = _returning(
+                f'DELETE FROM {_table()} WHERE user_id = %s AND id IN ({placeholders}) RETURNING id, completed, due_date',
+                [user_id, *todo_ids],
+            )
+            rows = [(row[0], bool(row[1]), _to_date(row[2])) for row in rows]
+        else:
+            queryset = ToDo.objects.filter(user_id=user_id, id__in=todo_ids)
+            rows = list(queryset.select_for_update().values_list('id', 'completed', 'due_date'))
+            queryset.delete()
+        _record_deleted(user_id, [(completed, due_date) for _, completed, due_date in rows])
+        invalidate_calendar_months(user_id, [due_date for _, _, due_date in rows])
+        write_tombstones([(user_id, row[0]) for row in rows])
+        search.unindex_todos([row[0] for row in rows])
+    if rows:
+        invalidate_user_lists(user_id)
+    return len(rows)
+
+
+def _id_subquery(queryset):
+    # 把 queryset 轉成 id 子查詢 admin「全選」整個篩選結果時也不需先把 id 讀出來
+    sql, params = queryset.order_by().values('id').query.sql_with_params()
+    return f'id IN ({sql})', list(params)
+
+
+@retry_on_locked
+def queryset_set_completed(queryset, completed):
+    """
+    admin 動作用 不限定使用者 以一個 UPDATE 更新 queryset 中狀態確實改變的列
+    統計依 RETURNING 的 user_id 分別更新 回傳改變的筆數
+    """
+    with sharding.atomic(using=queryset.db):
+        if _can_return():
+            where, params = _id_subquery(queryset)
+            rows = _returning(
+                f'UPDATE {_table()} SET completed = %s, updated_at = %s WHERE completed = %s AND {where} '
+                f'RETURNING user_id, due_date',
+                [completed, _now(), not completed, *params],
+            )
+        else:
+            changed = queryset.filter(completed=not completed)
+            rows = list(changed.select_for_update().values_list('user_id', 'due_date'))
+            changed.update(completed=completed, updated_at=timezone.now())
+        by_user = collections.defaultdict(collections.Counter)
+        for user_id, due_date in rows:
+            by_user[user_id][_to_date(due_date)] += 1
+        delta = -1 if completed else 1
+        for user_id, due_dates in by_user.items():
+            stats.record_bulk(
+                user_id,
+                completed=-delta * sum(due_dates.values()),
+                due_deltas={due_date: delta * count for due_date, count in due_dates.items()},
+            )
+            invalidate_calendar_months(user_id, due_dates)
+    for user_id in by_user:
+        invalidate_user_lists(user_id)
+    return len(rows)
+
+
+@retry_on_locked
+def queryset_delete(queryset):
+    # admin 刪除用 以一個 DELETE 刪除 queryset 中的所有列 回傳刪除的筆數
+    with sharding.atomic(using=queryset.db):
+        if _can_return():
+            where, params = _id_subquery(queryset)
+            rows = _returning(
+                f'DELETE FROM {_table()} WHERE {where} RETURNING id, user_id, completed, due_date', params,
+            )
+        else:
+            rows = list(queryset.select_for_update().values_list('id', 'user_id', 'completed', 'due_date'))
+            ToDo.objects.filter(id__in=[row[0] for row in rows]).delete()
+        by_user = collections.defaultdict(list)
+        for _, user_id, completed, due_date in rows:
+            by_user[user_id].append((bool(completed), _to_date(due_date)))
+        for user_id, deleted in by_user.items():
+            _record_deleted(user_id, deleted)
+            invalidate_calendar_months(user_id, [due_date for _, due_date in deleted])
+        write_tombstones([(row[1], row[0]) for row in rows])
+        search.unindex_todos([row[0] for row in rows])
+    for user_id in by_user:
+        invalidate_user_lists(user_id)
+    return len(rows)
@@ -0,0 +1,196 @@
+import datetime
+import heapq
+import itertools
+
+from asgiref.sync import sync_to_async
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from ToDos import sharding
+from ToDos.sharding import connection
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def get_page_size(value):
+    # 解析 page_size 參數 非法值回到預設 並限制上限避免一次撈太多
+    try:
+        page_size = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(page_size, MAX_PAGE_SIZE))
+
+
+# 清單的排序方式 每一種都有對應的索引 (見 ToDo.Meta.indexes) 最後一欄為 id 讓順序唯一
+# sort=created 依 id 遞減 id 由自動編號產生 與建立順序一致
+SORTS = {
+    'due': ('due_date', 'id'),
+    'priority': ('priority_rank', 'due_date', 'id'),
+    'created': ('-id',),
+    'search': ('search_rank', 'id'),
+}
+DEFAULT_SORT = 'due'
+# 搜尋結果依 ToDos.search 標註的相關度排序 只用於有 q= 的清單 不能從 sort= 選擇
+SEARCH_SORT = 'search'
+
+
+def get_sort(value):
+    return value if value in SORTS and value != SEARCH_SORT else DEFAULT_SORT
+
+
+def _fields(sort):
+    # (欄位名稱, 是否遞減)
+    return [(field.lstrip('-'), field.startswith('-')) for field in SORTS[sort]]
+
+
+def encode_cursor(todo, sort=DEFAULT_SORT):
+    # 游標為最後一筆的排序欄位值 例如 sort=due 為 2025-03-20_15 sort=priority 為 0_2025-03-20_15
+    # 搜尋的相關度為浮點數 str() 可以還原成相同的值 例如 -1.25e-06_15
+    values = [getattr(todo, name) for name, _ in _fields(sort)]
+    return '_'.join(value.isoformat() if isinstance(value, datetime.date) else str(value) for value in values)
+
+
+def _decode_value(name, part):
+    if name == 'due_date':
+        return datetime.date.fromisoformat(part)
+    if name == 'search_rank':
+        return float(part)
+    return int(part)
+
+
+def decode_cursor(cursor, sort=DEFAULT_SORT):
+    # 格式錯誤 (或是其他排序方式的游標) 時回傳 None 視為第一頁
+    try:
+        parts = cursor.split('_')
+        fields = _fields(sort)
+        if len(parts) != len(fields):
+            return None
+        return tuple(_decode_value(name, part) for part, (name, _) in zip(parts, fields))
+    except (AttributeError, ValueError):
+        return None
+
+
+def _at_or_before(fields, values):
+    # 排序在游標之前 (含游標本身) 的條件 fields 為空時恆真
+    if not fields:
+        return Q()
+    (name, descending), value = fields[0], values[0]
+    before = Q(**{f'{name}__gt' if descending else f'{name}__lt': value})
+    return before | (Q(**{name: value}) & _at_or_before(fields[1:], values[1:]))
+
+
+def _after_cursor(queryset, cursor, sort=DEFAULT_SORT):
+    queryset = queryset.order_by(*SORTS[sort])
+    position = decode_cursor(cursor, sort)
+    if position is not None:
+        fields = _fields(sort)
+        (name, descending), value = fields[0], position[0]
+        # 第一欄寫成 >= / <= 的範圍條件 讓 SQLite 直接在索引上定位 同值的部分再排除游標之前的列
+        queryset = queryset.filter(**{f'{name}__lte' if descending else f'{name}__gte': value}).exclude(
+            Q(**{name: value}) & _at_or_before(fields[1:], position[1:])
+        )
+    return queryset
+
+
+def _split_page(rows, page_size, sort):
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1], sort)
+    return rows, next_cursor
+
+
+def sort_key(todo, sort=DEFAULT_SORT):
+    # 合併多個來源時的排序鍵 遞減的欄位都是整數 (id) 取負值即可
+    return tuple(-getattr(todo, name) if descending else getattr(todo, name) for name, descending in _fields(sort))
+
+
+def position_key(position, sort=DEFAULT_SORT):
+    # decode_cursor 的結果對應的排序鍵
+    return tuple(-value if descending else value for value, (_, descending) in zip(position, _fields(sort)))
+
+
+def _merge(sources, page_size, sort):
+    # 各來源都已依相同的欄位排序 合併後取前 page_size + 1 筆 id 在各來源之間不重複
+    return list(itertools.islice(heapq.merge(*sources, key=lambda todo: sort_key(todo, sort)), page_size + 1))
+
+
+def keyset_page(queryset, cursor, page_size, archived=None, sort=DEFAULT_SORT, virtual=None):
+    """
+    依 SORTS 中的排序做 keyset 分頁 不使用 OFFSET
+    每一頁都只從索引上的游標位置往後讀 page_size + 1 筆 因此延遲與資料總量無關
+    archived 為封存資料的 queryset 時兩邊各讀 page_size + 1 筆再合併 游標對兩邊同樣有效
+    virtual(cursor, limit) 回傳游標之後依相同排序的未儲存待辦 (見 ToDos.recurrence) 同樣合併
+    回傳 (該頁資料, 下一頁游標或 None)
+    """
+    sources = [list(_after_cursor(queryset, cursor, sort)[:page_size + 1])]
+    if archived is not None:
+        sources.append(list(_after_cursor(archived, cursor, sort)[:page_size + 1]))
+    if virtual is not None:
+        sources.append(virtual(cursor, page_size + 1))
+    rows = _merge(sources, page_size, sort) if len(sources) > 1 else sources[0]
+    return _split_page(rows, page_size, sort)
+
+
+async def akeyset_page(queryset, cursor, page_size, archived=None, sort=DEFAULT_SORT, virtual=None):
+    # keyset_page 的非同步版本 virtual 為同步函式 (會查詢規則) 透過 sync_to_async 呼叫
+    sources = [[todo async for todo in _after_cursor(queryset, cursor, sort)[:page_size + 1].aiterator()]]
+    if archived is not None:
+        sources.append([todo async for todo in _after_cursor(archived, cursor, sort)[:page_size + 1].aiterator()])
+    if virtual is not None:
+        sources.append(await sync_to_async(virtual)(cursor, page_size + 1))
+    rows = _merge(sources, page_size, sort) if len(sources) > 1 else sources[0]
+    return _split_page(rows, page_size, sort)
+
+
+def estimate_row_count(model):
+    """
+    不掃描整張表的估計筆數 取不到時回傳 None
+    PostgreSQL / MySQL 讀統計資訊 SQLite 以最大與最小 id 相減 (刪除過的列也算在內 只會高估)
+    """
+    table = model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql, params = 'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table]
+    elif connection.vendor == 'mysql':
+        sql, params = (
+            'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s',
+            [table],
+        )
+    elif connection.vendor == 'sqlite':
+        # MAX / MIN 要分開查才會直接讀主鍵的兩端 寫成 MAX(id) - MIN(id) 會掃過整個索引
+        pk, table = connection.ops.quote_name(model._meta.pk.column), connection.ops.quote_name(table)
+        sql, params = f'SELECT (SELECT MAX({pk}) FROM {table}) - (SELECT MIN({pk}) FROM {table}) + 1', []
+    else:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    # PostgreSQL 從未 ANALYZE 過的表為 -1
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    admin 用的分頁 不做完整的 COUNT(*)
+    未篩選時用 estimate_row_count 的估計值 有篩選時最多只數到 COUNT_LIMIT 筆
+    頁數也限制在 COUNT_LIMIT 筆以內 OFFSET 不會超過 COUNT_LIMIT 更後面的資料請用篩選縮小範圍
+    """
+    COUNT_LIMIT = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.has_filters():
+            with sharding.use(queryset.db):     #admin 以 using() 指定的分片
+                estimate = estimate_row_count(queryset.model)
+            if estimate is not None:
+                return estimate
+        return queryset.order_by()[:self.COUNT_LIMIT].count()
+
+    @cached_property
+    def num_pages(self):
+        return min(super().num_pages, max(1, -(-self.COUNT_LIMIT // self.per_page)))
@@ -0,0 +1,122 @@
+"""
+刪除使用者與其所有待辦
+
+直接 user.delete() 時 CASCADE 的 collector 會把每一筆相關的待辦讀成 model (還要送 post_delete)
+數十萬筆時記憶體隨筆數成長 且全部在同一個寫入交易中 期間其他使用者的寫入都被擋住
+
+這裡改為先停用帳號 (既有的 session 立即失效 不會再新增待辦) 再依表分批以
+DELETE ... WHERE id IN (SELECT id ... LIMIT n) 刪除 每批一個短交易 記憶體與鎖的持有時間只和批次大小有關
+所有相關資料刪完後才刪除 User 本身 中途中斷時帳號維持停用 重新執行即可從剩下的資料繼續
+admin 不在請求中刪除 只停用帳號並排入 UserPurgeRequest 由 manage.py purge_users --queued 執行
+統計 (ToDoStats / ToDoDueCount) 不逐批增減 最後整批刪除
+
+超過保留期限的 ToDoTombstone 同樣分批清除 (prune_tombstones 見 ToDos.changes)
+"""
+import time
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from ToDos import search, sharding
+from ToDos.cache import invalidate_user_lists
+from ToDos.models import (
+    ArchivedToDo, ToDo, ToDoDueCount, ToDoImportProgress, ToDoOccurrence, ToDoRecurrence, ToDoReminder, ToDoStats,
+    ToDoTombstone, UserPurgeRequest,
+)
+from ToDos.operations import retry_on_locked
+from ToDos.sharding import connection
+
+DEFAULT_BATCH_SIZE = 1000
+# 依序分批清空的表 (都在使用者的分片上) 其他關聯 (admin 紀錄等) 每位使用者只有少量資料 隨 User 一起刪除
+# ToDoOccurrence 有指向 ToDoRecurrence 的外鍵 需先刪除
+PURGE_MODELS = [
+    ToDo, ArchivedToDo, ToDoTombstone, ToDoDueCount, ToDoReminder, ToDoOccurrence, ToDoRecurrence, ToDoStats,
+    ToDoImportProgress,
+]
+
+
+@retry_on_locked
+def purge_batch(model, user_id, batch_size=DEFAULT_BATCH_SIZE):
+    # 刪除 model 中該使用者 (在目前分片上) 的一批資料 回傳刪除的筆數 0 表示已清空
+    quote = connection.ops.quote_name
+    table, pk = quote(model._meta.db_table), quote(model._meta.pk.column)
+    with sharding.atomic():
+        with connection.cursor() as cursor:
+            if connection.features.can_return_columns_from_insert:
+                cursor.execute(
+                    f'DELETE FROM {table} WHERE {pk} IN (SELECT {pk} FROM {table} WHERE user_id = %s LIMIT %s) '
+                    f'RETURNING {pk}',
+                    [user_id, batch_size],
+                )
+                ids = [row[0] for row in cursor.fetchall()]
+            else:
+                ids = list(model.objects.filter(user_id=user_id).values_list('pk', flat=True)[:batch_size])
+                if ids:
+                    placeholders = ', '.join(['%s'] * len(ids))
+                    cursor.execute(f'DELETE FROM {table} WHERE {pk} IN ({placeholders})', ids)
+        if model is ToDo:
+            search.unindex_todos(ids)
+    return len(ids)
+
+
+@retry_on_locked
+def delete_user(user_id):
+    # 相關的大表已清空 collector 只需查詢幾個空的關聯
+    with transaction.atomic():
+        User.objects.filter(pk=user_id).delete()
+
+
+def purge_user(user_id, batch_size=DEFAULT_BATCH_SIZE, sleep=0.0, progress=None):
+    """
+    分批刪除使用者的所有資料 最後刪除 User
+    progress(model, 已刪除筆數) 在每批之後呼叫
+    回傳 (各 model 刪除的筆數, 最長的單一交易秒數)
+    """
+    User.objects.filter(pk=user_id).update(is_active=False)
+    with sharding.for_user(user_id):
+        deleted, longest = purge_shard(user_id, batch_size, sleep, progress)
+    started = time.perf_counter()
+    delete_user(user_id)
+    longest = max(longest, time.perf_counter() - started)
+    invalidate_user_lists(user_id)
+    return deleted, longest
+
+
+def queue_users(user_ids):
+    # 停用帳號 (既有的 session 立即失效) 並排入刪除佇列 回傳新排入的人數
+    user_ids = list(user_ids)
+    with transaction.atomic():
+        User.objects.filter(pk__in=user_ids).update(is_active=False)
+        queued = set(UserPurgeRequest.objects.filter(user_id__in=user_ids).values_list('user_id', flat=True))
+        UserPurgeRequest.objects.bulk_create([UserPurgeRequest(user_id=user_id) for user_id in user_ids if user_id not in queued])
+    return len(set(user_ids) - queued)
+
+
+def purge_shard(user_id, batch_size=DEFAULT_BATCH_SIZE, sleep=0.0, progress=None):
+    # 分批清空使用者在目前分片上的資料 回傳值與 purge_user 相同 rebalance_shards 搬移後也用它清除來源分片
+    deleted = {}
+    longest = 0.0
+    for model in PURGE_MODELS:
+        deleted[model] = 0
+        while True:
+            started = time.perf_counter()
+            count = purge_batch(model, user_id, batch_size)
+            longest = max(longest, time.perf_counter() - started)
+            if not count:
+                break
+            deleted[model] += count
+            if progress:
+                progress(model, deleted[model])
+            if sleep:
+                time.sleep(sleep)
+    return deleted, longest
+
+
+@retry_on_locked
+def prune_tombstones_batch(cutoff, batch_size=DEFAULT_BATCH_SIZE):
+    # 刪除目前分片上一批 deleted_at 早於 cutoff 的 tombstone 回傳刪除的筆數 0 表示已清完
+    with sharding.atomic():
+        ids = list(ToDoTombstone.objects.filter(deleted_at__lt=cutoff).values_list('pk', flat=True)[:batch_size])
+        if ids:
+            ToDoTombstone.objects.filter(pk__in=ids).delete()
+    return len(ids)
@@ -0,0 +1,233 @@
+"""
+把使用者的待辦資料搬到另一個分片 由 manage.py rebalance_shards 執行
+
+1. UserShard.moving = True 等待 TODO_SHARD_PLACEMENT_TIMEOUT 秒 所有行程都拒絕這位使用者的寫入 (讀取不受影響)
+2. 清除目標分片上的殘留 (先前中斷的搬移) 依 id 分批複製 ToDo / 提醒 / 封存 / 重複規則 / tombstone / 匯入進度 再於目標上重建統計
+3. UserShard 改為目標分片並解除 moving 再等待一次 之後沒有行程會讀取來源分片
+4. 分批清除來源分片上的資料 (purge.purge_shard)
+
+各分片的 ToDo 自動編號各自遞增 搬移的待辦在目標分片上取得新的 id
+舊的 id 寫入 tombstone 新的 id 的 updated_at 為搬移的時間 /todos/changes 的客戶端會收到一次刪除與新增
+封存的待辦同樣從目標的 ToDo 自動編號取得 id 兩張表的 id 仍然不會重複
+重複規則也取得新的 id ToDoOccurrence 依新舊 id 的對照改寫 (規則 / 待辦)
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from ToDos import purge, search, sharding, stats
+from ToDos.archive import COLUMNS, _move
+from ToDos.cache import invalidate_user_lists
+from ToDos.changes import write_tombstones
+from ToDos.models import (
+    ArchivedToDo, ToDo, ToDoImportProgress, ToDoOccurrence, ToDoRecurrence, ToDoReminder, ToDoTombstone, UserShard,
+)
+from ToDos.sharding import connection
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def _wait():
+    # 等待其他行程的 placement 快取過期
+    if settings.TODO_SHARD_PLACEMENT_TIMEOUT:
+        time.sleep(settings.TODO_SHARD_PLACEMENT_TIMEOUT)
+
+
+def _set_placement(user_id, **fields):
+    UserShard.objects.filter(user_id=user_id).update(**fields)
+    sharding.forget_placement(user_id)
+
+
+def _read_batch(model, user_id, columns, after, batch_size):
+    # 以 raw SQL 讀取 日期 / 時間維持資料庫中的原始值 原樣寫入目標分片
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT {", ".join(quote(column) for column in columns)} FROM {quote(model._meta.db_table)} '
+            f'WHERE user_id = %s AND id > %s ORDER BY id LIMIT %s',
+            [user_id, after, batch_size],
+        )
+        return cursor.fetchall()
+
+
+def _insert_todo(cursor, values):
+    # 逐筆新增以取得每一筆的新 id (多列 INSERT ... RETURNING 的順序不保證與 VALUES 相同)
+    quote = connection.ops.quote_name
+    columns = [*COLUMNS[1:], 'updated_at']
+    cursor.execute(
+        f'INSERT INTO {quote(ToDo._meta.db_table)} ({", ".join(quote(column) for column in columns)}) '
+        f'VALUES ({", ".join(["%s"] * len(columns))}) RETURNING id',
+        values,
+    )
+    return cursor.fetchone()[0]
+
+
+def _copy_todos(user_id, source, target, batch_size, id_map):
+    # id_map 記下舊 id 對應的新 id (ToDoOccurrence 使用)
+    copied = 0
+    last_id = 0
+    while True:
+        with sharding.use(source):
+            rows = _read_batch(ToDo, user_id, COLUMNS, last_id, batch_size)
+            old_ids = [row[0] for row in rows]
+            reminders = list(ToDoReminder.objects.filter(user_id=user_id, todo_id__in=old_ids))
+        if not rows:
+            return copied
+        with sharding.atomic(using=target):
+            now = connection.ops.adapt_datetimefield_value(timezone.now())
+            with connection.cursor() as cursor:
+                new_ids = {row[0]: _insert_todo(cursor, [*row[1:], now]) for row in rows}
+            id_map.update(new_ids)
+            search.index_todos(ToDo.objects.filter(id__in=new_ids.values()))
+            write_tombstones([(user_id, old_id) for old_id in old_ids])
+            # created_at 為 auto_now_add 在目標上變為搬移的時間
+            ToDoReminder.objects.bulk_create([
+                ToDoReminder(
+                    user_id=user_id, todo_id=new_ids[reminder.todo_id], due_date=reminder.due_date,
+                    claimed_at=reminder.claimed_at, sent_at=reminder.sent_at,
+                )
+                for reminder in reminders
+            ])
+        copied += len(rows)
+        last_id = old_ids[-1]
+
+
+def _copy_archived(user_id, source, target, batch_size, id_map):
+    copied = 0
+    last_id = 0
+    while True:
+        with sharding.use(source):
+            rows = _read_batch(ArchivedToDo, user_id, [*COLUMNS, 'archived_at'], last_id, batch_size)
+        if not rows:
+            return copied
+        with sharding.atomic(using=target):
+            with connection.cursor() as cursor:
+                for row in rows:
+                    # 先新增到 ToDo 取得 id 再以與封存相同的方式搬到 ArchivedToDo
+                    new_id = _insert_todo(cursor, [*row[1:-1], row[-1]])
+                    _move(ToDo, ArchivedToDo, [new_id], {'archived_at': row[-1]})
+                    id_map[row[0]] = new_id
+        copied += len(rows)
+        last_id = rows[-1][0]
+
+
+def _copy_tombstones(user_id, source, target, batch_size):
+    copied = 0
+    last_id = 0
+    while True:
+        with sharding.use(source):
+            tombstones = list(ToDoTombstone.objects.filter(user_id=user_id, id__gt=last_id).order_by('id')[:batch_size])
+        if not tombstones:
+            return copied
+        with sharding.atomic(using=target):
+            ToDoTombstone.objects.bulk_create([
+                ToDoTombstone(user_id=user_id, todo_id=tombstone.todo_id, deleted_at=tombstone.deleted_at)
+                for tombstone in tombstones
+            ])
+        copied += len(tombstones)
+        last_id = tombstones[-1].id
+
+
+def _copy_recurrences(user_id, source, target, batch_size, id_map):
+    # 每位使用者的規則不多 一次複製 已寫入的那幾次 (ToDoOccurrence) 依 id 分批
+    with sharding.use(source):
+        rules = list(ToDoRecurrence.objects.filter(user_id=user_id).order_by('id'))
+    rule_map = {}
+    with sharding.atomic(using=target):
+        for rule in rules:
+            old_id, rule.pk = rule.pk, None
+            rule.save(force_insert=True, using=target)  # created_at 為 auto_now_add 在目標上變為搬移的時間
+            rule_map[old_id] = rule.pk
+    last_id = 0
+    while True:
+        with sharding.use(source):
+            occurrences = list(ToDoOccurrence.objects.filter(user_id=user_id, id__gt=last_id).order_by('id')[:batch_size])
+        if not occurrences:
+            return len(rules)
+        with sharding.atomic(using=target):
+            ToDoOccurrence.objects.bulk_create([
+                ToDoOccurrence(
+                    user_id=user_id, recurrence_id=rule_map[occurrence.recurrence_id],
+                    occurrence_date=occurrence.occurrence_date, todo_id=id_map.get(occurrence.todo_id),
+                )
+                for occurrence in occurrences
+            ])
+        last_id = occurrences[-1].id
+
+
+def _copy_imports(user_id, source, target):
+    # 中斷的匯入的進度 筆數很少 一次複製
+    with sharding.use(source):
+        imports = list(ToDoImportProgress.objects.filter(user_id=user_id))
+    with sharding.atomic(using=target):
+        ToDoImportProgress.objects.bulk_create([
+            ToDoImportProgress(user_id=user_id, source=state.source, rows=state.rows) for state in imports
+        ])
+    return len(imports)
+
+
+def cleanup(user_id, progress=None):
+    # 清除使用者在其他分片上的殘留 (搬移在最後一步中斷時) 回傳清除的筆數
+    alias = sharding.shard_for(user_id)
+    removed = 0
+    for other in sharding.aliases():
+        if other == alias:
+            continue
+        with sharding.use(other):
+            deleted, _ = purge.purge_shard(user_id, progress=progress)
+        removed += sum(deleted.values())
+    return removed
+
+
+def move_user(user_id, target, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    把使用者搬到 target 分片 回傳各類資料複製的筆數 已在 target 上時只清除殘留
+    progress(訊息) 在每個步驟開始時呼叫
+    """
+    progress = progress or (lambda message: None)
+    if target not in sharding.aliases():
+        raise ValueError(f'未知的分片 {target}')
+    source = sharding.shard_for(user_id)
+    if source == target:
+        # 先前的搬移在複製途中中斷時 moving 仍為 True 這裡一併解除
+        _set_placement(user_id, moving=False)
+        cleanup(user_id)
+        return {}
+
+    progress(f'暫停寫入 等待 {settings.TODO_SHARD_PLACEMENT_TIMEOUT} 秒')
+    _set_placement(user_id, moving=True)
+    _wait()
+
+    progress(f'複製 {source} → {target}')
+    with sharding.use(target):
+        purge.purge_shard(user_id, batch_size)
+    id_map = {}
+    copied = {
+        'todos': _copy_todos(user_id, source, target, batch_size, id_map),
+        'archived': _copy_archived(user_id, source, target, batch_size, id_map),
+        'recurrences': _copy_recurrences(user_id, source, target, batch_size, id_map),
+        'tombstones': _copy_tombstones(user_id, source, target, batch_size),
+        'imports': _copy_imports(user_id, source, target),
+    }
+    stats.rebuild_stats(User(pk=user_id), using=target)
+
+    progress('切換分片')
+    _set_placement(user_id, alias=target, moving=False)
+    invalidate_user_lists(user_id)
+    _wait()
+
+    progress(f'清除 {source}')
+    with sharding.use(source):
+        purge.purge_shard(user_id, batch_size)
+    return copied
+
+
+def misplaced_users():
+    # 目前所在分片與雜湊結果不同的使用者 (增加分片之後) 依 user_id 排序
+    return [
+        (user_id, alias, target)
+        for user_id, alias in UserShard.objects.order_by('user_id').values_list('user_id', 'alias')
+        if alias != (target := sharding.hashed_shard(user_id))
+    ]
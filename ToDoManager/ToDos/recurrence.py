@@ -0,0 +1,206 @@
+"""
+重複待辦 預先產生好幾年的每一次會讓 ToDo 表無限制地成長 因此只存規則 (ToDoRecurrence)
+
+清單每一頁只依規則展開游標之後 / 今天 + HORIZON_DAYS 之前的日期 每個規則以產生器依序產生 再與 ToDo 的列合併
+產生時直接跳到游標所在的日期 不逐日掃描 每頁的成本只和頁面大小與規則數有關 與規則延伸多遠無關
+展開出來的是未儲存的 ToDo (is_virtual) 未完成 早於今天即為逾期 篩選與逾期標示與已儲存的待辦相同
+
+完成或編輯某一次時才寫入 ToDo 並在 ToDoOccurrence 記下 (規則, 日期) 刪除某一次時只寫入 ToDoOccurrence
+展開前以一個查詢讀出各規則起點之後已有 ToDoOccurrence 的日期 再略過這些日期
+已完成的那幾次再多 每一頁的查詢數也固定 (規則 + ToDoOccurrence 各一個)
+
+虛擬的待辦以負數作為 id -(日期序數 * 10^9 + 規則 id) 讓 SORTS 中的排序與游標不需修改
+同一天內排在已儲存的待辦之前 sort=created 時排在所有已儲存的待辦之後 依日期排列
+"""
+import datetime
+import heapq
+import itertools
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import Q
+from django.utils import timezone
+
+from ToDos import operations, sharding
+from ToDos.cache import invalidate_user_lists
+from ToDos.models import PRIORITY_RANKS, ToDo, ToDoOccurrence, ToDoRecurrence
+from ToDos.operations import retry_on_locked
+from ToDos.pagination import decode_cursor, position_key, sort_key
+
+FREQUENCY_DAYS = {'daily': 1, 'weekly': 7}
+ID_FACTOR = 10 ** 9
+
+
+def get_setting(name):
+    return settings.TODO_RECURRENCE[name]
+
+
+def horizon(today):
+    return today + datetime.timedelta(days=get_setting('HORIZON_DAYS'))
+
+
+def step(rule):
+    return datetime.timedelta(days=FREQUENCY_DAYS[rule.frequency] * rule.interval)
+
+
+def occurs_on(rule, date):
+    return (
+        rule.start_date <= date
+        and (rule.until is None or date <= rule.until)
+        and (date - rule.start_date).days % step(rule).days == 0
+    )
+
+
+def occurrence_dates(rule, start, end):
+    # rule 在 [start, end] 之間的日期 第一個日期直接計算 不從 start_date 逐一往後找
+    first = rule.start_date
+    interval = step(rule)
+    if start > first:
+        first += interval * -(-(start - first).days // interval.days)
+    last = min(end, rule.until) if rule.until else end
+    date = first
+    while date <= last:
+        yield date
+        date += interval
+
+
+def virtual_id(rule_id, date):
+    return -(date.toordinal() * ID_FACTOR + rule_id)
+
+
+def virtual_todo(rule, date, today):
+    todo = ToDo(
+        id=virtual_id(rule.id, date), user_id=rule.user_id, title=rule.title, description=rule.description,
+        due_date=date, priority=rule.priority, completed=False,
+    )
+    todo.priority_rank = PRIORITY_RANKS.get(rule.priority, len(PRIORITY_RANKS))
+    todo.overdue = date < today     #與 ToDoQuerySet.with_overdue 相同 未完成且早於今天
+    todo.is_virtual = True
+    todo.recurrence_id = rule.id
+    return todo
+
+
+def _first_date(rule, sort, position):
+    # 依游標算出這個規則需要從哪一天開始展開 整個規則都在游標之前時回傳 None
+    if position is None:
+        return rule.start_date
+    if sort == 'due':
+        return position[0]
+    if sort == 'priority':
+        rank = PRIORITY_RANKS.get(rule.priority, len(PRIORITY_RANKS))
+        if rank < position[0]:
+            return None
+        return position[1] if rank == position[0] else rule.start_date
+    # sort=created 游標為已儲存的待辦時 所有虛擬的待辦都在它之後
+    return datetime.date.fromordinal(-position[0] // ID_FACTOR) if position[0] < 0 else rule.start_date
+
+
+def _handled(starts, end):
+    # starts 為 {規則 id: 第一個候選日期} 以一個查詢讀出 [起點, end] 之間已寫入或已刪除的 (規則 id, 日期)
+    condition = Q()
+    for rule_id, start in starts.items():
+        condition |= Q(recurrence_id=rule_id, occurrence_date__gte=start)
+    return set(
+        ToDoOccurrence.objects.filter(condition, occurrence_date__lte=end).values_list('recurrence_id', 'occurrence_date')
+    )
+
+
+def _virtual_todos(rule, start, end, today, handled):
+    for date in occurrence_dates(rule, start, end):
+        if (rule.id, date) not in handled:
+            yield virtual_todo(rule, date, today)
+
+
+def _expand(rules, sort, position, today):
+    # 依排序合併所有規則展開的待辦 只產生游標之後 尚未寫入或刪除的部分
+    end = horizon(today)
+    starts = {}
+    for rule in rules:
+        start = _first_date(rule, sort, position)
+        if start is not None and start <= end:
+            starts[rule.id] = start
+    if not starts:
+        return iter(())
+    handled = _handled(starts, end)
+    streams = [_virtual_todos(rule, starts[rule.id], end, today, handled) for rule in rules if rule.id in starts]
+    merged = heapq.merge(*streams, key=lambda todo: sort_key(todo, sort))
+    if position is not None:
+        after = position_key(position, sort)
+        merged = itertools.dropwhile(lambda todo: sort_key(todo, sort) <= after, merged)
+    return merged
+
+
+def virtual_rows(user_id, filter_option, sort, cursor, limit, today=None):
+    """
+    回傳游標之後最多 limit 筆虛擬的待辦 已依 sort 排序 供 pagination.keyset_page 與 ToDo 的列合併
+    虛擬的待辦都未完成 filter=completed 時沒有
+    """
+    if filter_option == 'completed':
+        return []
+    today = today or timezone.localdate()
+    rules = list(ToDoRecurrence.objects.filter(user_id=user_id, start_date__lte=horizon(today)))
+    if not rules:
+        return []
+    return list(itertools.islice(_expand(rules, sort, decode_cursor(cursor, sort), today), limit))
+
+
+@retry_on_locked
+def create_rule(rule):
+    with sharding.atomic(rule.user_id):
+        rule.save()
+    invalidate_user_lists(rule.user_id)
+    return rule
+
+
+def get_rule(user_id, rule_id, date):
+    # date 不是這個規則的其中一次時回傳 None
+    rule = ToDoRecurrence.objects.filter(user_id=user_id, id=rule_id).first()
+    return rule if rule is not None and occurs_on(rule, date) else None
+
+
+@retry_on_locked
+def materialize(user_id, rule_id, date, **fields):
+    """
+    把規則的某一次寫入 ToDo fields 為與規則不同的欄位 (completed / 編輯後的內容)
+    回傳寫入的 ToDo 這一次先前已寫入時回傳既有的 ToDo (不套用 fields) 已刪除或不存在時回傳 None
+    """
+    try:
+        with sharding.atomic(user_id):
+            rule = get_rule(user_id, rule_id, date)
+            if rule is None:
+                return None
+            todo = ToDo(
+                user_id=user_id, title=rule.title, description=rule.description, due_date=date, priority=rule.priority,
+            )
+            for name, value in fields.items():
+                setattr(todo, name, value)
+            operations.create_todo(todo)
+            # 已有這一次的紀錄時違反唯一約束 整個交易 (含剛寫入的 ToDo) 一起還原
+            ToDoOccurrence.objects.create(user_id=user_id, recurrence=rule, occurrence_date=date, todo_id=todo.id)
+    except IntegrityError:
+        occurrence = ToDoOccurrence.objects.filter(recurrence_id=rule_id, occurrence_date=date).first()
+        if occurrence is None or occurrence.todo_id is None:
+            return None
+        return ToDo.objects.filter(id=occurrence.todo_id, user_id=user_id).first()
+    return todo
+
+
+@retry_on_locked
+def skip(user_id, rule_id, date, following=False):
+    """
+    刪除規則的某一次 following 為 True 時一併結束之後的每一次 (until 改為前一天)
+    回傳是否找到這一次
+    """
+    with sharding.atomic(user_id):
+        rule = get_rule(user_id, rule_id, date)
+        if rule is None:
+            return False
+        if following:
+            if date == rule.start_date:
+                rule.delete()
+            else:
+                ToDoRecurrence.objects.filter(id=rule.id).update(until=date - datetime.timedelta(days=1))
+        else:
+            ToDoOccurrence.objects.get_or_create(recurrence=rule, occurrence_date=date, defaults={'user_id': user_id})
+    invalidate_user_lists(user_id)
+    return True
@@ -0,0 +1,132 @@
+"""
+到期提醒 由 manage.py remind_todos 以常駐 worker 執行
+
+掃描: 每一輪只讀 due_date 落在 [今天, 今天 + DAYS_AHEAD] 的未完成待辦 依 (due_date, id) 分批
+      走部分索引 todo_open_due_idx (只含未完成的列) 讀取量只和窗口內的筆數有關 與總資料量無關
+      窗口內已有提醒的待辦以 NOT EXISTS 排除 新的提醒整批寫入 outbox (ToDoReminder)
+寄送: 從 outbox 認領一批尚未寄出的提醒 (claimed_at) 寄出後記下 sent_at
+
+冪等: ToDoReminder 對 (todo_id, due_date) 唯一 重複掃描 / 多個 worker 同時掃描都不會重複建立
+      每一輪都重新掃描整個窗口 worker 中斷期間新增或修改的待辦在下一輪補上
+      寄送途中中斷時 認領超過 LEASE 秒仍未寄出的提醒會被重新認領 不會遺漏
+      寄出與記錄 sent_at 之間中斷才會重寄 Message-ID 由提醒 id 決定 收件端可據此去除重複
+"""
+import datetime
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import EmailMessage, get_connection
+from django.core.mail.utils import DNS_NAME
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from ToDos import sharding
+from ToDos.models import ToDo, ToDoReminder
+from ToDos.operations import retry_on_locked
+
+
+def get_setting(name):
+    return settings.TODO_REMINDERS[name]
+
+
+def window(today, days_ahead=None):
+    days_ahead = get_setting('DAYS_AHEAD') if days_ahead is None else days_ahead
+    return today, today + datetime.timedelta(days=days_ahead)
+
+
+def _due_in_window(start, end):
+    # completed=False 與部分索引的條件相同 SQLite 才會選用 todo_open_due_idx
+    reminded = ToDoReminder.objects.filter(todo_id=OuterRef('id'), due_date=OuterRef('due_date'))
+    return (
+        ToDo.objects.filter(completed=False, due_date__gte=start, due_date__lte=end)
+        .exclude(Exists(reminded))
+        .order_by('due_date', 'id')
+    )
+
+
+@retry_on_locked
+def _enqueue(rows):
+    with sharding.atomic():
+        ToDoReminder.objects.bulk_create(
+            [ToDoReminder(user_id=user_id, todo_id=todo_id, due_date=due_date) for todo_id, user_id, due_date in rows],
+            ignore_conflicts=True,
+        )
+
+
+def scan(today, days_ahead=None, batch_size=None):
+    """
+    把窗口內尚未建立提醒的待辦寫入 outbox 回傳寫入的筆數
+    以 (due_date, id) keyset 分批 每批一個短交易
+    """
+    start, end = window(today, days_ahead)
+    batch_size = batch_size or get_setting('BATCH_SIZE')
+    enqueued = 0
+    position = None
+    while True:
+        queryset = _due_in_window(start, end)
+        if position is not None:
+            due_date, todo_id = position
+            queryset = queryset.filter(due_date__gte=due_date).exclude(due_date=due_date, id__lte=todo_id)
+        rows = list(queryset.values_list('id', 'user_id', 'due_date')[:batch_size])
+        if not rows:
+            return enqueued
+        _enqueue(rows)
+        enqueued += len(rows)
+        position = rows[-1][2], rows[-1][0]
+
+
+@retry_on_locked
+def _claim(batch_size, lease):
+    # 認領一批尚未寄出的提醒 回傳這些提醒
+    now = timezone.now()
+    with sharding.atomic():
+        pending = ToDoReminder.objects.filter(sent_at__isnull=True).filter(
+            Q(claimed_at__isnull=True) | Q(claimed_at__lt=now - datetime.timedelta(seconds=lease))
+        )
+        reminders = list(pending.select_for_update().order_by('id')[:batch_size])
+        ToDoReminder.objects.filter(id__in=[reminder.id for reminder in reminders]).update(claimed_at=now)
+    return reminders
+
+
+def build_message(reminder, todo, user):
+    return EmailMessage(
+        subject=f'待辦即將到期: {todo.title}',
+        body=f'{user.username} 您好\n\n「{todo.title}」將於 {todo.due_date:%Y-%m-%d} 到期',
+        from_email=get_setting('FROM_EMAIL'),
+        to=[user.email],
+        headers={'Message-ID': f'<todo-reminder-{reminder.id}@{DNS_NAME}>'},
+    )
+
+
+def send_batch(batch_size=None, lease=None, connection=None):
+    """
+    寄出一批提醒 回傳 (處理的提醒數, 實際寄出的數量) 處理數為 0 表示 outbox 已清空
+    待辦已完成 / 已刪除 / 截止日期已改 或使用者沒有 email 時不寄送 直接標記為已處理
+    寄送失敗時例外直接拋出 這批提醒維持認領狀態 租約到期後重新寄送
+    """
+    reminders = _claim(batch_size or get_setting('BATCH_SIZE'), get_setting('LEASE') if lease is None else lease)
+    if not reminders:
+        return 0, 0
+    todos = ToDo.objects.in_bulk([reminder.todo_id for reminder in reminders])
+    # 使用者在 default 上 待辦可能在其他分片 不以 select_related 合併查詢
+    users = User.objects.in_bulk({reminder.user_id for reminder in reminders})
+    messages = []
+    for reminder in reminders:
+        todo, user = todos.get(reminder.todo_id), users.get(reminder.user_id)
+        if todo is not None and not todo.completed and todo.due_date == reminder.due_date and user and user.email:
+            messages.append(build_message(reminder, todo, user))
+    if messages:
+        (connection or get_connection()).send_messages(messages)
+    ToDoReminder.objects.filter(id__in=[reminder.id for reminder in reminders]).update(sent_at=timezone.now())
+    return len(reminders), len(messages)
+
+
+def send_pending(batch_size=None, lease=None):
+    # 寄出 outbox 中所有待寄的提醒 共用同一個郵件連線 回傳寄出的數量
+    sent = 0
+    with get_connection() as connection:
+        while True:
+            processed, count = send_batch(batch_size, lease, connection)
+            if not processed:
+                return sent
+            sent += count
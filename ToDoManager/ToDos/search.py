@@ -0,0 +1,129 @@
+"""
+待辦標題與描述的全文搜尋 使用 SQLite FTS5 虛擬表 todo_fts
+
+FTS5 內建的 unicode61 tokenizer 會把一整段沒有空白的中文當成一個 token 無法搜尋其中的詞
+因此寫入前先在 Python 端把中日韓文字切成重疊的雙字 (bigram) 例如 參加會議 -> 參加 加會 會議 議
+查詢時以同樣方式切分並用 phrase 比對 單字查詢則以 prefix 比對 英數文字維持 unicode61 的斷詞
+
+每筆的 owner 欄位存放 u<user_id> 查詢一律加上 owner 條件 讓使用者隔離也由索引完成
+非 SQLite 或沒有 FTS5 的資料庫退回 icontains
+"""
+import contextlib
+import functools
+import re
+import sqlite3
+
+from django.db.models import F, FloatField, Q, Value
+
+from ToDos.models import ToDoSearchEntry
+from ToDos.sharding import connection
+
+FTS_TABLE = ToDoSearchEntry._meta.db_table
+
+CJK_RUN = re.compile('[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\U00020000-\U0002fa1f]+')
+WORD = re.compile(r'\w+')
+
+
+def _bigrams(run):
+    # 最後補上單字 讓單字查詢也能以 prefix 命中結尾的字
+    return [run[i:i + 2] for i in range(len(run) - 1)] + [run[-1]]
+
+
+def segment(text):
+    if not text:
+        return ''
+    parts = []
+    position = 0
+    for match in CJK_RUN.finditer(text):
+        parts.append(text[position:match.start()])
+        parts.extend(_bigrams(match.group()))
+        position = match.end()
+    parts.append(text[position:])
+    return ' '.join(part for part in parts if part)
+
+
+def _quote(token):
+    return '"' + token.replace('"', '""') + '"'
+
+
+def build_match(user_id, query):
+    # 回傳 FTS5 MATCH 字串 查詢中沒有可搜尋的字時回傳 None
+    terms = []
+    position = 0
+    for match in CJK_RUN.finditer(query):
+        terms.extend(_quote(word) + '*' for word in WORD.findall(query[position:match.start()]))
+        run = match.group()
+        if len(run) == 1:
+            terms.append(_quote(run) + '*')
+        else:
+            terms.append(_quote(' '.join(run[i:i + 2] for i in range(len(run) - 1))))
+        position = match.end()
+    terms.extend(_quote(word) + '*' for word in WORD.findall(query[position:]))
+    if not terms:
+        return None
+    return f'owner:{_quote(f"u{user_id}")} AND {{title description}}: ({" AND ".join(terms)})'
+
+
+def fts5_available(db_connection):
+    # 遷移 (0005 是否建立 todo_fts) 與查詢共用同一個判斷 兩邊不一致時會查詢不存在的表或略過已建立的表
+    return db_connection.vendor == 'sqlite' and _sqlite_has_fts5()
+
+
+def search_available():
+    return fts5_available(connection)
+
+
+@functools.lru_cache(maxsize=None)
+def _sqlite_has_fts5():
+    # 用獨立的記憶體資料庫實際建立一次 FTS5 表 與 Django 的 SQLite 連線使用同一個 sqlite3 模組
+    # 不經過 Django 連線 非同步 views 中也能呼叫
+    with contextlib.closing(sqlite3.connect(':memory:')) as conn:
+        try:
+            conn.execute('CREATE VIRTUAL TABLE fts5_check USING fts5(content)')
+        except sqlite3.OperationalError:
+            return False
+    return True
+
+
+def search(queryset, user_id, query):
+    """
+    在已依使用者與完成狀態篩選過的 queryset 上做全文搜尋 依 bm25 相關度排序
+    回傳的仍是 queryset 標註 search_rank 呼叫端以 keyset_page(..., sort=SEARCH_SORT) 分頁
+    相關度依整個索引計算 翻頁之間索引有異動時順序可能略為改變
+    """
+    if not search_available():
+        # 沒有相關度 search_rank 一律為 0 依 id 排序
+        return (
+            queryset.filter(Q(title__icontains=query) | Q(description__icontains=query))
+            .annotate(search_rank=Value(0.0, output_field=FloatField()))
+            .order_by('search_rank', 'id')
+        )
+    match = build_match(user_id, query)
+    if match is None:
+        return queryset.none()
+    # 經由 ToDoSearchEntry join todo_fts 別名與欄位都由 Django 產生 FTS5 依 MATCH 找出符合的列 每列只計算一次 rank
+    return (
+        queryset.filter(search_entry__document__match=match)
+        .annotate(search_rank=F('search_entry__rank'))
+        .order_by('search_rank', 'id')
+    )
+
+
+def index_todos(todos):
+    # 新增或更新索引 供 signals 與 bulk_create 之後呼叫
+    if not search_available():
+        return
+    todos = list(todos)
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(todo.id,) for todo in todos])
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, owner, title, description) VALUES (%s, %s, %s, %s)',
+            [(todo.id, f'u{todo.user_id}', segment(todo.title), segment(todo.description)) for todo in todos],
+        )
+
+
+def unindex_todos(todo_ids):
+    if not search_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(todo_id,) for todo_id in todo_ids])
@@ -0,0 +1,187 @@
+"""
+依使用者把待辦資料分散到多個資料庫 (分片)
+
+TODO_SHARDS=N 時 settings 設定 shard0 ~ shard{N-1} 並啟用 UserShardRouter
+每位使用者的待辦 / 封存 / tombstone / 統計 / 提醒都放在同一個分片 auth / session 等其他資料留在 default
+使用者第一次存取時依 user_id 的穩定雜湊 (見 hashed_shard) 決定分片 記在 default 的 UserShard 之後不因分片數改變而移動
+只有 manage.py rebalance_shards 會搬移使用者 並更新 UserShard
+
+views 的查詢都限定 request.user ShardMiddleware 依登入的使用者設定目前的分片 (contextvar)
+router 把 ToDos 的查詢導向目前的分片 寫入單一 model 時依 instance.user_id 決定
+raw SQL 與交易透過這裡的 connection / atomic 使用目前的分片
+沒有設定分片時 (預設) 一律使用 default 行為與單一資料庫相同
+"""
+import contextlib
+import contextvars
+import zlib
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.http import HttpResponse
+
+_current = contextvars.ContextVar('todo_shard', default=DEFAULT_DB_ALIAS)
+
+
+def aliases():
+    return settings.TODO_SHARD_ALIASES
+
+
+def enabled():
+    return bool(aliases())
+
+
+def hashed_shard(user_id, shard_aliases=None):
+    # rendezvous hashing 每個分片與 user_id 組合的 crc32 取最大者 crc32 在每個行程 / 每次啟動都相同
+    # 增加一個分片時只有約 1/N 的使用者的雜湊結果改變 rebalance_shards --all 只需搬移這些人
+    shard_aliases = shard_aliases or aliases()
+    return max(shard_aliases, key=lambda alias: zlib.crc32(f'{alias}:{user_id}'.encode()))
+
+
+def _placement_key(user_id):
+    return f'todos:shard:{user_id}'
+
+
+def placement(user_id):
+    """
+    回傳 (分片, 是否搬移中) 查詢結果快取 TODO_SHARD_PLACEMENT_TIMEOUT 秒
+    搬移時 rebalance_shards 會等待這段時間 讓所有行程都讀到新的狀態
+    """
+    if not enabled():
+        return DEFAULT_DB_ALIAS, False
+    key = _placement_key(user_id)
+    cached = cache.get(key)
+    if cached is None:
+        from ToDos.models import UserShard
+
+        shard, _ = UserShard.objects.get_or_create(user_id=user_id, defaults={'alias': hashed_shard(user_id)})
+        cached = (shard.alias, shard.moving)
+        cache.set(key, cached, settings.TODO_SHARD_PLACEMENT_TIMEOUT)
+    return cached
+
+
+def forget_placement(user_id):
+    cache.delete(_placement_key(user_id))
+
+
+def shard_for(user_id):
+    return placement(user_id)[0]
+
+
+def current():
+    return _current.get()
+
+
+@contextlib.contextmanager
+def use(alias):
+    # 在這個區塊中 ToDos 的查詢 / raw SQL / 交易都使用 alias
+    token = _current.set(alias)
+    try:
+        yield alias
+    finally:
+        _current.reset(token)
+
+
+def for_user(user_id):
+    return use(shard_for(user_id))
+
+
+@contextlib.contextmanager
+def atomic(user_id=None, using=None):
+    # 在使用者 (或指定) 的分片上開始交易 區塊內的查詢都在同一個分片
+    alias = using or (shard_for(user_id) if user_id is not None else current())
+    with use(alias), transaction.atomic(using=alias):
+        yield
+
+
+def each_shard():
+    # 跨使用者的工作 (封存 / 提醒 / 統計重建) 依序在每個分片上執行
+    for alias in aliases() or [DEFAULT_DB_ALIAS]:
+        with use(alias):
+            yield alias
+
+
+class _CurrentConnection:
+    # 與 django.db.connection 相同的用法 但指向目前的分片
+    def __getattr__(self, name):
+        return getattr(connections[current()], name)
+
+
+connection = _CurrentConnection()
+
+
+class UserShardRouter:
+    # 只在設定了分片時啟用 (TODO_SHARDS) 其餘 app 的資料一律在 default
+    def _is_sharded(self, model):
+        from ToDos.models import SHARDED_MODELS
+
+        return model in SHARDED_MODELS
+
+    def db_for_read(self, model, **hints):
+        if not self._is_sharded(model):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        user_id = getattr(instance, 'user_id', None)
+        if isinstance(instance, get_user_model()):
+            user_id = instance.pk   # 例如 ToDo(user=user) 時 Django 以 user 作為 hint
+        return shard_for(user_id) if user_id is not None else current()
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # 待辦指向 default 上的 User 資料庫層沒有外鍵 (db_constraint=False)
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # ToDos 的資料表在每個資料庫都建立 (default 上的保持空的 讓刪除 User 時的 CASCADE 可以查詢)
+        return app_label == 'ToDos' or db == DEFAULT_DB_ALIAS
+
+
+class ShardMiddleware:
+    """
+    依登入的使用者設定這個請求使用的分片 需放在 AuthenticationMiddleware 之後
+    使用者搬移中時拒絕寫入 (503) 讀取仍由原本的分片提供
+    沒有設定分片時不讀取 request.user 不增加任何查詢
+    同步與非同步皆可 ASGI 下不需經過 sync_to_async 的執行緒切換 (contextvar 在同一個 task 中有效)
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def refuse_write(self, request, moving):
+        if moving and request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            response = HttpResponse('資料搬移中 請稍後再試', status=503)
+            response['Retry-After'] = str(settings.TODO_SHARD_PLACEMENT_TIMEOUT or 1)
+            return response
+        return None
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not enabled() or not request.user.is_authenticated:
+            return self.get_response(request)
+        alias, moving = placement(request.user.id)
+        response = self.refuse_write(request, moving)
+        if response is not None:
+            return response
+        with use(alias):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if not enabled():
+            return await self.get_response(request)
+        user = await request.auser()
+        if not user.is_authenticated:
+            return await self.get_response(request)
+        alias, moving = await sync_to_async(placement)(user.id)
+        response = self.refuse_write(request, moving)
+        if response is not None:
+            return response
+        with use(alias):
+            return await self.get_response(request)
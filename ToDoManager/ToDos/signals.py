@@ -0,0 +1,20 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from ToDos import search
+from ToDos.cache import invalidate_user_lists
+from ToDos.models import ToDo
+
+
+# views 與 admin 的新增 / 編輯 / 切換 / 刪除都經過 save() 或 delete() 在這裡統一讓清單快取失效並同步搜尋索引
+@receiver(post_save, sender=ToDo)
+def todo_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or {'title', 'description'} & set(update_fields):
+        search.index_todos([instance])
+    invalidate_user_lists(instance.user_id)
+
+
+@receiver(post_delete, sender=ToDo)
+def todo_deleted(sender, instance, **kwargs):
+    search.unindex_todos([instance.id])
+    invalidate_user_lists(instance.user_id)
@@ -0,0 +1,144 @@
+"""
+每位使用者的待辦統計 (總數 / 已完成 / 未完成 / 逾期)
+
+ToDoStats 保存總數與已完成數 ToDoDueCount 保存未完成待辦依截止日期的分布
+views 在新增 / 編輯 / 切換 / 刪除的同一個交易中呼叫這裡的 record_* 以 F() 原子增減
+admin 或其他路徑造成的偏差可用 manage.py rebuild_todo_stats 修正
+"""
+import collections
+
+from django.db.models import Count, F, Q, Sum
+
+from ToDos import sharding
+from ToDos.models import ToDo, ToDoDueCount, ToDoStats
+from ToDos.sharding import connection
+
+
+def _apply(user_id, total=0, completed=0):
+    if not total and not completed:
+        return
+    updated = ToDoStats.objects.filter(user_id=user_id).update(
+        total=F('total') + total, completed=F('completed') + completed
+    )
+    if not updated:
+        # 第一次異動時才建立統計列 之後都只做 UPDATE
+        stats, _ = ToDoStats.objects.get_or_create(user_id=user_id)
+        ToDoStats.objects.filter(pk=stats.pk).update(
+            total=F('total') + total, completed=F('completed') + completed
+        )
+
+
+def _bump_due(user_id, due_date, delta):
+    _bump_due_many(user_id, {due_date: delta})
+
+
+def _bump_due_many(user_id, due_deltas):
+    # 支援 ON CONFLICT 的資料庫以一個 upsert 同時增減多個日期 查詢數不隨日期數增加
+    due_deltas = {due_date: delta for due_date, delta in due_deltas.items() if delta}
+    if not due_deltas:
+        return
+    if connection.features.supports_update_conflicts_with_target:
+        table = connection.ops.quote_name(ToDoDueCount._meta.db_table)
+        values = ', '.join(['(%s, %s, %s)'] * len(due_deltas))
+        params = [
+            value for due_date, delta in due_deltas.items()
+            for value in (user_id, connection.ops.adapt_datefield_value(due_date), delta)
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, due_date, count) VALUES {values} '
+                f'ON CONFLICT (user_id, due_date) DO UPDATE SET count = {table}.count + excluded.count',
+                params,
+            )
+        return
+    for due_date, delta in due_deltas.items():
+        updated = ToDoDueCount.objects.filter(user_id=user_id, due_date=due_date).update(count=F('count') + delta)
+        if not updated:
+            due_count, _ = ToDoDueCount.objects.get_or_create(user_id=user_id, due_date=due_date)
+            ToDoDueCount.objects.filter(pk=due_count.pk).update(count=F('count') + delta)
+
+
+def record_created(todo):
+    _apply(todo.user_id, total=1, completed=int(todo.completed))
+    if not todo.completed:
+        _bump_due(todo.user_id, todo.due_date, 1)
+
+
+def record_deleted(todo):
+    _apply(todo.user_id, total=-1, completed=-int(todo.completed))
+    if not todo.completed:
+        _bump_due(todo.user_id, todo.due_date, -1)
+
+
+def record_changed(todo, was_completed, old_due_date):
+    # 編輯與切換共用 依舊值與新值計算差異
+    _apply(todo.user_id, completed=int(todo.completed) - int(was_completed))
+    due_deltas = collections.Counter()
+    if not was_completed:
+        due_deltas[old_due_date] -= 1
+    if not todo.completed:
+        due_deltas[todo.due_date] += 1
+    _bump_due_many(todo.user_id, due_deltas)
+
+
+def record_bulk(user_id, total=0, completed=0, due_deltas=None):
+    # 批次操作 due_deltas 為 {due_date: 未完成數的增減}
+    _apply(user_id, total=total, completed=completed)
+    _bump_due_many(user_id, due_deltas or {})
+
+
+def get_stats(user, today):
+    stats = ToDoStats.objects.filter(user=user).first() or ToDoStats(user=user)
+    overdue = ToDoDueCount.objects.filter(user=user, due_date__lt=today).aggregate(total=Sum('count'))['total']
+    return {
+        'total': stats.total,
+        'completed': stats.completed,
+        'incomplete': stats.incomplete,
+        'overdue': overdue or 0,
+    }
+
+
+async def aget_stats(user, today):
+    # get_stats 的非同步版本
+    stats = await ToDoStats.objects.filter(user=user).afirst() or ToDoStats(user=user)
+    overdue = (await ToDoDueCount.objects.filter(user=user, due_date__lt=today).aaggregate(total=Sum('count')))['total']
+    return {
+        'total': stats.total,
+        'completed': stats.completed,
+        'incomplete': stats.incomplete,
+        'overdue': overdue or 0,
+    }
+
+
+def compute_stats(user):
+    # 從 ToDo 重新計算正確值 只在修正偏差時使用
+    counts = ToDo.objects.filter(user=user).aggregate(
+        total=Count('id'), completed=Count('id', filter=Q(completed=True))
+    )
+    due_counts = dict(
+        ToDo.objects.filter(user=user, completed=False)
+        .values_list('due_date')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    return counts, due_counts
+
+
+def stored_stats(user):
+    stats = ToDoStats.objects.filter(user=user).first() or ToDoStats(user=user)
+    due_counts = dict(
+        ToDoDueCount.objects.filter(user=user).exclude(count=0).values_list('due_date', 'count')
+    )
+    return {'total': stats.total, 'completed': stats.completed}, due_counts
+
+
+def rebuild_stats(user, using=None):
+    # using 指定分片 (rebalance 在搬移目標上重建) 預設為使用者目前的分片
+    with sharding.atomic(user.id, using):
+        counts, due_counts = compute_stats(user)
+        ToDoStats.objects.update_or_create(user=user, defaults=counts)
+        ToDoDueCount.objects.filter(user=user).delete()
+        ToDoDueCount.objects.bulk_create(
+            ToDoDueCount(user=user, due_date=due_date, count=count) for due_date, count in due_counts.items()
+        )
+    return counts, due_counts
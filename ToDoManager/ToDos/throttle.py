@@ -0,0 +1,58 @@
+"""
+登入嘗試次數限制 以快取計數 同一帳號或同一 IP 在時間窗內失敗太多次就直接拒絕
+
+檢查只讀快取 不碰資料庫也不計算密碼雜湊 大量猜密碼的請求不會佔用 CPU
+只有失敗才計數 登入成功時清除該帳號的計數 (IP 的計數保留 避免以自己的帳號登入來重置)
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+DEFAULT_LOGIN_THROTTLE = {
+    'USERNAME_LIMIT': 5,
+    'IP_LIMIT': 50,
+    'WINDOW': 300,
+}
+
+
+def _config():
+    return {**DEFAULT_LOGIN_THROTTLE, **getattr(settings, 'TODO_LOGIN_THROTTLE', {})}
+
+
+def client_ip(request):
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _username_key(username):
+    # 帳號不分大小寫計數 雜湊後再放進快取鍵 避免特殊字元
+    digest = hashlib.md5(username.strip().lower().encode()).hexdigest()
+    return f'login:fail:user:{digest}'
+
+
+def _ip_key(ip):
+    return f'login:fail:ip:{ip}'
+
+
+def is_limited(username, ip):
+    config = _config()
+    counts = cache.get_many([_username_key(username), _ip_key(ip)])
+    return (
+        counts.get(_username_key(username), 0) >= config['USERNAME_LIMIT']
+        or counts.get(_ip_key(ip), 0) >= config['IP_LIMIT']
+    )
+
+
+def record_failure(username, ip):
+    window = _config()['WINDOW']
+    for key in (_username_key(username), _ip_key(ip)):
+        # 固定時間窗 第一次失敗時建立計數 之後只加一不延長逾時
+        if not cache.add(key, 1, timeout=window):
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, 1, timeout=window)
+
+
+def reset(username):
+    cache.delete(_username_key(username))
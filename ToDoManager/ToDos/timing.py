@@ -0,0 +1,69 @@
+"""
+請求層級的耗時紀錄 由 ToDos.middleware.RequestTimingMiddleware 建立
+SQL 透過 connection.execute_wrapper 範本透過 TimedDjangoTemplates 記錄到目前請求的 recorder
+"""
+import contextvars
+import heapq
+import time
+
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+current_recorder = contextvars.ContextVar('todo_timing_recorder', default=None)
+
+
+class TimingRecorder:
+    def __init__(self, slowest_queries):
+        self.query_count = 0
+        self.db_ms = 0.0
+        self.template_ms = 0.0
+        self.slowest = []   # (ms, sql) 的 min-heap 只保留最慢的 slowest_queries 筆
+        self.slowest_limit = slowest_queries
+        self._rendering = False
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper 介面
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.query_count += 1
+            self.db_ms += elapsed
+            if len(self.slowest) < self.slowest_limit:
+                heapq.heappush(self.slowest, (elapsed, sql))
+            elif self.slowest_limit:
+                heapq.heappushpop(self.slowest, (elapsed, sql))
+
+    def slowest_queries(self):
+        return [
+            {'ms': round(ms, 3), 'sql': sql}
+            for ms, sql in sorted(self.slowest, reverse=True)
+        ]
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        recorder = current_recorder.get()
+        # render 過程中又 render 其他範本時只計算最外層 避免重複累計
+        if recorder is None or recorder._rendering:
+            return super().render(context, request)
+        recorder._rendering = True
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            recorder.template_ms += (time.perf_counter() - start) * 1000
+            recorder._rendering = False
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    # 與 DjangoTemplates 相同 只是回傳會記錄 render 時間的 Template
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
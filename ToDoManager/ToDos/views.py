@@ -1,26 +1,44 @@
+import csv
+import datetime
+import json
 from django.shortcuts import render , redirect , get_object_or_404
+from django.http import Http404 , HttpResponseBadRequest , JsonResponse , StreamingHttpResponse
+from django.views.decorators.http import condition , require_POST
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.forms import UserCreationForm , AuthenticationForm
 from django.contrib import messages
-from django.contrib.auth import authenticate , login , logout
+from django.contrib.auth import login , logout
 from django.contrib.auth.decorators import login_required
-from ToDos.models import ToDo
-from .form import TodoForm
+from ToDos.models import ArchivedToDo , ToDo
+from ToDos import calendar_counts , changes , fragments , operations , recurrence , search , stats , throttle
+from ToDos.changes import get_limit
+from .form import AddTodoForm , TodoForm
+from .pagination import SEARCH_SORT , get_page_size , get_sort , keyset_page
 from django.utils import timezone
+from django.utils.safestring import mark_safe
+from django.template.loader import render_to_string
+from django.core.cache import cache
+from .cache import get_list_cache_timeout , list_cache_key
 
 
 def login_view(request):  #若取名為login會與django內建方法撞名
     form = AuthenticationForm() 
     if request.method == 'POST' :
-        form = AuthenticationForm(data = request.POST)
+        username = request.POST.get('username' , '')
+        ip = throttle.client_ip(request)
+        # 先檢查失敗次數 超過上限直接拒絕 不查資料庫也不計算密碼雜湊
+        if throttle.is_limited(username , ip):
+            messages.error(request , '登入失敗次數過多 請稍後再試')
+            return render (request , 'login.html' , {'form':form} , status = 429)
+        form = AuthenticationForm(request , data = request.POST)
+        # is_valid() 內部已經 authenticate 過一次 直接取用驗證好的使用者 不再重算雜湊
         if form.is_valid():
-            username = form.cleaned_data.get('username')
-            password = form.cleaned_data.get('password')
-            user = authenticate(request, username=username, password=password)
-            if user is not None :
-                login(request , user)   #使用django內建方法
-                messages.success(request , '登入成功')
-                return redirect(todos)
+            login(request , form.get_user())   #使用django內建方法
+            throttle.reset(username)
+            messages.success(request , '登入成功')
+            return redirect(todos)
         else :
+            throttle.record_failure(username , ip)
             messages.error(request , '登入失敗')
     return render (request , 'login.html' , {'form':form})
 
@@ -40,18 +58,135 @@ def register(request):
 def todos(request): 
 
     filter_option = request.GET.get('filter', 'all')    # 取得篩選條件，預設為 'all'
-  
+    page_size = get_page_size(request.GET.get('page_size'))
+    cursor = request.GET.get('after', '')
+    query = request.GET.get('q', '').strip()
+    include_archived = request.GET.get('include_archived') == '1'   # 封存的待辦只在要求時才讀
+    sort = get_sort(request.GET.get('sort'))    # due (預設) / priority / created
+    today = timezone.now()
+
+    # 列表片段依使用者版本號快取 重複瀏覽時不需再查詢資料庫
+    cache_key = list_cache_key(
+        request.user.id, filter_option, page_size, cursor, query, include_archived, sort, timezone.localdate(today)
+    )
+    cached = cache.get(cache_key)
+    if cached is None:
+        todos_list = get_filtered_todos(request.user, filter_option).with_overdue(timezone.localdate(today))
+        if query:   # 搜尋結果依相關度排序 同樣以 keyset 分頁 (只搜尋未封存的待辦)
+            page, next_cursor = keyset_page(search.search(todos_list, request.user.id, query), cursor, page_size, sort = SEARCH_SORT)
+        else:
+            archived = get_archived_todos(request.user, filter_option) if include_archived else None
+            virtual = get_virtual_todos(request.user, filter_option, sort, timezone.localdate(today))
+            page, next_cursor = keyset_page(todos_list, cursor, page_size, archived, sort, virtual)
+        rows = render_to_string('todo_rows.html', {'todos': page})
+        cached = (str(rows), next_cursor, stats.get_stats(request.user, timezone.localdate(today)))
+        cache.set(cache_key, cached, get_list_cache_timeout())
+    rows, next_cursor, todo_stats = cached
+
+    return render (request , 'todo_list.html' ,  {
+        'rows': mark_safe(rows),
+        'stats': todo_stats,
+        'filter': filter_option ,
+        'query': query,
+        'today' : today,
+        'page_size': page_size,
+        'next_cursor': next_cursor,
+        'is_first_page': not cursor,
+        'include_archived': include_archived,
+        'sort': sort,
+    })
+
+def get_filtered_todos(user, filter_option):
+    # 依篩選條件取得使用者的待辦事項 其他需要相同篩選語意的地方共用此函式
+    # completed 寫成 __in 讓 SQLite 以 (user, completed, ...) 索引定位 (見 admin.IndexedBooleanFieldListFilter)
     if filter_option == 'completed':
-        todos_list = ToDo.objects.filter(user=request.user, completed=True)
+        return ToDo.objects.filter(user=user, completed__in=[True])
     elif filter_option == 'incomplete':
-        todos_list = ToDo.objects.filter(user=request.user, completed=False)
+        return ToDo.objects.filter(user=user, completed__in=[False])
     else: 
-        todos_list = ToDo.objects.filter(user=request.user)
-    
-    today = timezone.now()
-  
+        return ToDo.objects.filter(user=user)
+
+def get_archived_todos(user, filter_option):
+    # 與 get_filtered_todos 相同的篩選語意 封存的都是已完成的待辦 篩選未完成時回傳 None
+    if filter_option == 'incomplete':
+        return None
+    return ArchivedToDo.objects.filter(user=user)
+
+def get_virtual_todos(user, filter_option, sort, today):
+    # 重複規則展開的待辦 回傳 keyset_page 的 virtual(cursor, limit) 只展開該頁需要的部分
+    return lambda cursor, limit: recurrence.virtual_rows(user.id, filter_option, sort, cursor, limit, today)
+
+@login_required(login_url='login_view')
+def todo_calendar(request):
+    # 一個月每一天到期的待辦數 ?month=2025-03 預設為本月 數量依月份快取 見 ToDos.calendar_counts
+    today = timezone.localdate()
+    first = calendar_counts.parse_month(request.GET.get('month') , today)
+    return render(request , 'calendar.html' , {
+        'month': first,
+        'weeks': calendar_counts.month_weeks(request.user.id , first , today),
+        'weekdays': calendar_counts.WEEKDAYS,
+        'previous_month': calendar_counts.shift_month(first , -1),
+        'next_month': calendar_counts.shift_month(first , 1),
+    })
+
+EXPORT_FIELDS = ['id', 'title', 'description', 'due_date', 'priority', 'completed', 'created_at']
+EXPORT_CHUNK_SIZE = 2000
+
+class Echo:
+    # csv.writer 需要一個有 write 的物件 直接回傳寫入的字串交給 StreamingHttpResponse
+    def write(self, value):
+        return value
+
+def _csv_rows(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
 
-    return render (request , 'todo_list.html' ,  {'todos': todos_list, 'filter': filter_option , 'today' : today})
+def _ndjson_rows(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_FIELDS, row)), cls = DjangoJSONEncoder, ensure_ascii = False) + '\n'
+
+@login_required(login_url='login_view')
+def export_todos(request):
+    # 串流匯出 以 values_list + iterator 分批讀取 不建立 model 實例 記憶體用量與筆數無關
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return HttpResponseBadRequest('format 必須是 csv 或 ndjson')
+    filter_option = request.GET.get('filter', 'all')
+    rows = (
+        get_filtered_todos(request.user, filter_option)
+        .order_by('due_date', 'id')
+        .values_list(*EXPORT_FIELDS)
+        .iterator(chunk_size = EXPORT_CHUNK_SIZE)
+    )
+    if export_format == 'csv':
+        response = StreamingHttpResponse(_csv_rows(rows), content_type = 'text/csv; charset=utf-8')
+    else:
+        response = StreamingHttpResponse(_ndjson_rows(rows), content_type = 'application/x-ndjson; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="todos.{export_format}"'
+    return response
+
+def _changes_etag(request):
+    # 清單版本號在每次異動時都會加一 用它組成 ETag 客戶端閒置輪詢時不查資料庫也不序列化 直接回 304
+    since = request.GET.get('since', '')
+    if changes.is_expired(since):    #過期的游標不回 304 讓客戶端收到 410
+        return None
+    return list_cache_key(request.user.id , 'changes' , since , get_limit(request.GET.get('limit')))
+
+@login_required(login_url='login_view')
+@condition(etag_func = _changes_etag)
+def todo_changes(request):
+    # 差異同步 只回傳游標之後新增 / 修改 / 刪除的待辦 客戶端以 next_cursor 繼續 has_more 為 False 時已同步到最新
+    try:
+        todo_changes_list , next_cursor , has_more = changes.get_changes(
+            request.user.id , request.GET.get('since', '') , get_limit(request.GET.get('limit'))
+        )
+    except changes.CursorExpired:      #游標之後的刪除紀錄可能已被清除 要求客戶端以空游標完整同步
+        return JsonResponse({'error': '游標已過期 請重新完整同步' , 'full_resync': True} , status = 410 ,
+                            json_dumps_params = {'ensure_ascii': False})
+    return JsonResponse({'changes': todo_changes_list , 'next_cursor': next_cursor , 'has_more': has_more} ,
+                        json_dumps_params = {'ensure_ascii': False})
 
 def logout_view(request):
     logout(request)
@@ -59,15 +194,25 @@ def logout_view(request):
 
 @login_required  
 def add_todo(request):
-    form = TodoForm(request.POST)
-    if form.is_valid():
+    form = AddTodoForm(request.POST)
+    if form.is_valid() and form.cleaned_data['repeat']:    #重複的待辦只建立規則 清單中依規則展開
+        rule = recurrence.create_rule(form.build_rule(request.user))
+        if fragments.wants_fragment(request):
+            return fragments.row_response(recurrence.virtual_todo(rule , rule.start_date , timezone.localdate()) , status = 201)
+        messages.success(request , '新增成功')
+        return redirect('todos')
+    elif form.is_valid():
         todo = form.save(commit = False)    #新增的欄位沒有user 但在models.py user欄位為必填 若直接保存會報錯
         todo.user = request.user            #將user欄位指定為當前使用者
-        todo.save()
+        operations.create_todo(todo)        #統計與資料在同一個交易中更新
+        if fragments.wants_fragment(request):   #只回傳新增的那一列 不重新載入清單
+            return fragments.row_response(fragments.get_row(request.user.id , todo.id) , status = 201)
         messages.success(request , '新增成功')
         return redirect('todos')
+    elif fragments.wants_fragment(request) and request.method == 'POST':
+        return fragments.errors_response(form)
     else:
-        form = TodoForm()
+        form = AddTodoForm()
 
     return render (request , 'add_todo.html' , {'form':form})
 
@@ -76,9 +221,10 @@ def edit_todo(request, id):
     todo = get_object_or_404(ToDo, user=request.user, id=id)
     
     if request.method == 'POST':
+        was_completed , old_due_date = todo.completed , todo.due_date   #is_valid 會直接改寫 instance 需先記下舊值
         form = TodoForm(request.POST, instance=todo) #用於將現有的資料庫實例與表單關聯起來 且更新而非創建
         if form.is_valid():
-            form.save()
+            operations.update_todo(form.save(commit = False), was_completed, old_due_date)
             messages.success(request , '編輯完成')
             return redirect('todos')
     else:
@@ -87,23 +233,99 @@ def edit_todo(request, id):
 
 @login_required
 def to_confirm_page(request , id):
-    todo = get_object_or_404(ToDo , id = id)
+    todo = get_object_or_404(ToDo , id = id , user = request.user)
     return render(request , 'confirm_delete.html' , {'todo':todo})
 
 @login_required
 def confirm_delete(request , id):
-    todo = get_object_or_404(ToDo , id = id)
-    todo.delete()
+    todo = get_object_or_404(ToDo , id = id , user = request.user)
+    operations.delete_todo(todo)
+    if fragments.wants_fragment(request):
+        return fragments.deleted_response()
     messages.success(request , '成功刪除')
     return redirect('todos')
 
 @login_required
 def toggle_todo(request , id):
-    todo = get_object_or_404(ToDo , id = id , user = request.user)
-    if request.method == 'POST' and todo.completed == False:
-        todo.completed = True
-        todo.save()
-    else :
-        todo.completed = False
-        todo.save()
-    return redirect('todos')
\ No newline at end of file
+    # 不先讀出資料 以條件式 UPDATE 只更新 completed 欄位 POST 切換狀態 其他方法標記為未完成
+    completed = operations.set_completed(request.user.id , id , None if request.method == 'POST' else False)
+    if completed is None:
+        raise Http404('No ToDo matches the given query.')
+    if fragments.wants_fragment(request):   #重新讀出這一列 (主鍵查詢) 取代重新載入整個清單
+        return fragments.row_response(fragments.get_row(request.user.id , id))
+    return redirect('todos')
+
+def _occurrence_date(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise Http404('No ToDo matches the given query.')
+
+def _get_virtual_or_404(user , recurrence_id , date):
+    rule = recurrence.get_rule(user.id , recurrence_id , _occurrence_date(date))
+    if rule is None:
+        raise Http404('No ToDo matches the given query.')
+    return recurrence.virtual_todo(rule , _occurrence_date(date) , timezone.localdate())
+
+@login_required
+def toggle_occurrence(request , recurrence_id , date):
+    # 重複規則的某一次標記完成時才寫入 ToDo 之後的切換與一般待辦相同 (toggle_todo)
+    if request.method != 'POST':    #虛擬的待辦本來就是未完成
+        return redirect('todos')
+    todo = recurrence.materialize(request.user.id , recurrence_id , _occurrence_date(date) , completed = True)
+    if todo is None:
+        raise Http404('No ToDo matches the given query.')
+    if not todo.completed:  #同時送出時另一個請求已先寫入
+        operations.set_completed(request.user.id , todo.id , True)
+    if fragments.wants_fragment(request):
+        return fragments.row_response(fragments.get_row(request.user.id , todo.id))
+    return redirect('todos')
+
+@login_required
+def edit_occurrence(request , recurrence_id , date):
+    # 開啟編輯頁不寫入 送出後才以編輯的內容寫入 ToDo
+    todo = _get_virtual_or_404(request.user , recurrence_id , date)
+    if request.method == 'POST':
+        form = TodoForm(request.POST)
+        if form.is_valid():
+            if recurrence.materialize(request.user.id , recurrence_id , todo.due_date , **form.cleaned_data) is None:
+                raise Http404('No ToDo matches the given query.')
+            messages.success(request , '編輯完成')
+            return redirect('todos')
+    else:
+        form = TodoForm(initial = {name: getattr(todo , name) for name in TodoForm.Meta.fields})
+    return render(request, 'edit_todo.html', {'forms': form})
+
+@login_required
+def skip_occurrence(request , recurrence_id , date):
+    # GET 顯示確認頁 POST 刪除這一次 following=1 時一併結束之後的每一次
+    if request.method != 'POST':
+        return render(request , 'confirm_delete.html' , {'todo': _get_virtual_or_404(request.user , recurrence_id , date)})
+    following = request.POST.get('following') == '1'
+    if not recurrence.skip(request.user.id , recurrence_id , _occurrence_date(date) , following):
+        raise Http404('No ToDo matches the given query.')
+    if fragments.wants_fragment(request):
+        return fragments.deleted_response()
+    messages.success(request , '成功刪除')
+    return redirect('todos')
+
+BULK_ACTIONS = {'complete', 'uncomplete', 'delete'}
+
+@login_required
+@require_POST
+def bulk_action(request):
+    # 勾選多筆後一次完成 / 取消完成 / 刪除 每個動作只有一個 UPDATE 或 DELETE 且限定目前使用者
+    action = request.POST.get('action')
+    try:
+        ids = [int(todo_id) for todo_id in request.POST.getlist('ids')]
+    except ValueError:
+        return HttpResponseBadRequest('ids 格式錯誤')
+    if action not in BULK_ACTIONS:
+        return HttpResponseBadRequest('不支援的操作')
+    if action == 'delete':
+        count = operations.bulk_delete(request.user.id , ids)
+        messages.success(request , f'已刪除 {count} 筆')
+    else:
+        count = operations.bulk_set_completed(request.user.id , ids , action == 'complete')
+        messages.success(request , f'已更新 {count} 筆')
+    return redirect('todos')
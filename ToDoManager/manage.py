@@ -6,7 +6,9 @@ import sys
 
 def main():
     """Run administrative tasks."""
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ToDoManager.settings')
+    # 測試使用 ToDoManager.test_settings 已設定 DJANGO_SETTINGS_MODULE 時以環境變數為準
+    default_settings = 'ToDoManager.test_settings' if sys.argv[1:2] == ['test'] else 'ToDoManager.settings'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', default_settings)
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
@@ -1,13 +1,42 @@
+import asyncio
+import contextlib
 import datetime
-from django.test import TestCase, Client
+import io
+import json
+import os
+import random
+import re
+import tempfile
+import time
+import tracemalloc
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.test import TestCase, SimpleTestCase, Client, AsyncClient, override_settings
 from django.urls import reverse
 from django.contrib.auth.models import User
-from ToDos.models import ToDo
+from ToDos.models import ArchivedToDo, ToDo, ToDoImportProgress, ToDoOccurrence, ToDoRecurrence, ToDoReminder, ToDoStats, ToDoTombstone, UserPurgeRequest, UserShard
+from ToDos import archive, changes, operations, purge, recurrence, reminders, search, sharding
+from ToDos.search import FTS_TABLE
+from ToDos.cache import calendar_cache_key
+from ToDos.pagination import sort_key
+from ToDos.stats import compute_stats, stored_stats
+from ToDos.bench import QUERY_BUDGETS, SCENARIOS, admin_changelist_params, run_scenario, seed_todos, use_todo_views
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, transaction
+from django.utils import timezone
+from ToDos.operations import retry_on_locked
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.test.utils import CaptureQueriesContext
+from django.core.handlers.asgi import ASGIHandler
 from django.contrib import messages
+from django.core.cache import cache
+from django.core import mail
 
 class TodoTests(TestCase):
     def setUp(self):
         # 初始化測試環境
+        cache.clear()
         self.client = Client()
         self.user1 = User.objects.create_user(username='user1', password='testpass123')
         self.user2 = User.objects.create_user(username='user2', password='testpass123')
@@ -136,6 +165,13 @@ class TodoTests(TestCase):
         response = self.client.post(reverse('toggle_todo', args=[self.todo1.id]), follow=True)
         self.assertIn(response.status_code, [403, 404])  # 應返回 403 或 404
 
+    def test_unauthorized_delete(self):
+        # user2 不能開啟或送出 user1 待辦的刪除頁 與非同步 views 相同回傳 404
+        self.client.login(username='user2', password='testpass123')
+        self.assertEqual(self.client.get(reverse('to_confirm_page', args=[self.todo1.id])).status_code, 404)
+        self.assertEqual(self.client.post(reverse('confirm_delete', args=[self.todo1.id])).status_code, 404)
+        self.assertTrue(ToDo.objects.filter(id=self.todo1.id).exists())
+
     def test_data_isolation_filter(self):
         # 測試過濾時的資料隔離
         ToDo.objects.create(
@@ -155,4 +191,1507 @@ class TodoTests(TestCase):
     def test_password_security(self):
         # 測試密碼是否加密儲存
         self.assertNotEqual(self.user1.password, 'testpass123')  # 密碼不應是明文
-        self.assertTrue(self.user1.password.startswith('pbkdf2_sha256$'))  # 應使用 Django 的密碼哈希
\ No newline at end of file
+        self.assertTrue(self.user1.password.startswith('pbkdf2_sha256$'))  # 應使用 Django 的密碼哈希
+
+class TodoPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='pager', password='testpass123')
+        for i in range(25):
+            ToDo.objects.create(
+                user=self.user,
+                title=f'分頁{i:02d}',
+                due_date=datetime.date(2025, 3, 1) + datetime.timedelta(days=i % 5),
+                priority='low',
+            )
+        self.client.login(username='pager', password='testpass123')
+
+    def test_pages_cover_all_todos_in_order(self):
+        # 依游標翻完所有頁面 每筆只出現一次且依 (due_date, id) 排序
+        seen = []
+        params = {'page_size': 10}
+        while True:
+            response = self.client.get(reverse('todos'), params)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(response.context['todos'])
+            cursor = response.context['next_cursor']
+            if cursor is None:
+                break
+            params['after'] = cursor
+        self.assertEqual(len(seen), 25)
+        self.assertEqual(seen, sorted(seen, key=lambda todo: (todo.due_date, todo.id)))
+
+    def test_page_size_is_clamped(self):
+        response = self.client.get(reverse('todos'), {'page_size': 100000})
+        self.assertEqual(response.context['page_size'], 100)
+        response = self.client.get(reverse('todos'), {'page_size': 'abc'})
+        self.assertEqual(response.context['page_size'], 20)
+
+    def test_invalid_cursor_shows_first_page(self):
+        response = self.client.get(reverse('todos'), {'after': 'not-a-cursor', 'page_size': 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '分頁00')
+
+    def test_query_count_independent_of_total(self):
+        # 清單查詢數量固定 不因資料量而增加
+        with self.assertNumQueries(6):  # session + user + 該頁資料 + 重複規則 + 統計 + 逾期分布
+            self.client.get(reverse('todos'), {'page_size': 10})
+
+
+class TodoSortTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='sorter', password='testpass123')
+        seed_todos(self.user, 60)
+        self.client.login(username='sorter', password='testpass123')
+
+    def walk(self, params):
+        seen = []
+        params = {'page_size': 7, **params}
+        while True:
+            response = self.client.get(reverse('todos'), params)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(response.context['todos'])
+            if response.context['next_cursor'] is None:
+                return seen
+            params['after'] = response.context['next_cursor']
+
+    def test_each_sort_walks_all_pages_in_order(self):
+        ranks = {'high': 0, 'medium': 1, 'low': 2}
+        keys = {
+            'due': lambda todo: (todo.due_date, todo.id),
+            'priority': lambda todo: (ranks[todo.priority], todo.due_date, todo.id),
+            'created': lambda todo: -todo.id,
+        }
+        for sort, key in keys.items():
+            for filter_option in ('all', 'completed', 'incomplete'):
+                with self.subTest(sort=sort, filter=filter_option):
+                    seen = self.walk({'sort': sort, 'filter': filter_option})
+                    expected = ToDo.objects.filter(user=self.user)
+                    if filter_option != 'all':
+                        expected = expected.filter(completed=filter_option == 'completed')
+                    self.assertEqual([todo.id for todo in seen], [todo.id for todo in sorted(expected, key=key)])
+
+    def test_cursor_from_other_sort_shows_first_page(self):
+        cursor = self.client.get(reverse('todos'), {'page_size': 7}).context['next_cursor']
+        response = self.client.get(reverse('todos'), {'page_size': 7, 'sort': 'priority', 'after': cursor})
+        first = self.client.get(reverse('todos'), {'page_size': 7, 'sort': 'priority'})
+        self.assertEqual(response.context['todos'], first.context['todos'])
+        self.assertEqual(self.client.get(reverse('todos'), {'sort': 'title'}).context['sort'], 'due')
+
+    def test_priority_rank_and_overdue_are_computed_by_database(self):
+        # bulk_create 與 raw UPDATE 寫入的資料也有正確的 priority_rank
+        ToDo.objects.filter(user=self.user).update(priority='low')
+        ToDo.objects.bulk_create([ToDo(user=self.user, title='批次', due_date=datetime.date(2020, 1, 1), priority='high')])
+        self.assertEqual(set(ToDo.objects.filter(priority='low').values_list('priority_rank', flat=True)), {2})
+        self.assertEqual(ToDo.objects.get(title='批次').priority_rank, 0)
+        today = datetime.date(2025, 6, 1)
+        for todo in ToDo.objects.filter(user=self.user).with_overdue(today):
+            self.assertEqual(todo.overdue, not todo.completed and todo.due_date < today)
+
+    def test_sorted_pages_read_from_indexes(self):
+        for sort in ('due', 'priority', 'created'):
+            cursor = self.client.get(reverse('todos'), {'page_size': 7, 'sort': sort}).context['next_cursor']
+            cache.clear()
+            with self.subTest(sort=sort), CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse('todos'), {'page_size': 7, 'sort': sort, 'filter': 'incomplete', 'after': cursor})
+            sql = next(query['sql'] for query in queries.captured_queries if 'FROM "ToDos_todo"' in query['sql'])
+            with connection.cursor() as db_cursor:
+                db_cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = [row[-1] for row in db_cursor.fetchall()]
+            self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan, sql)
+            self.assertTrue(all('USING INDEX' in step for step in plan), plan)
+
+
+@override_settings(TODO_RECURRENCE={'HORIZON_DAYS': 20})
+class RecurringTodoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='chores', password='testpass123')
+        self.today = timezone.localdate()
+        self.daily = recurrence.create_rule(ToDoRecurrence(
+            user=self.user, title='倒垃圾', priority='medium', frequency='daily',
+            start_date=self.today - datetime.timedelta(days=2),
+        ))
+        self.weekly = recurrence.create_rule(ToDoRecurrence(
+            user=self.user, title='打掃', priority='high', frequency='weekly', start_date=self.today,
+        ))
+        self.client.login(username='chores', password='testpass123')
+
+    def day(self, offset):
+        return (self.today + datetime.timedelta(days=offset)).isoformat()
+
+    def walk(self, params):
+        seen = []
+        params = {'page_size': 6, **params}
+        while True:
+            response = self.client.get(reverse('todos'), params)
+            seen.extend(response.context['todos'])
+            if response.context['next_cursor'] is None:
+                return seen
+            params['after'] = response.context['next_cursor']
+
+    def test_list_expands_occurrences_without_writing_rows(self):
+        response = self.client.get(reverse('todos'), {'page_size': 5})
+        self.assertEqual(
+            [(todo.title, todo.due_date.isoformat()) for todo in response.context['todos']],
+            [('倒垃圾', self.day(-2)), ('倒垃圾', self.day(-1)), ('打掃', self.day(0)), ('倒垃圾', self.day(0)), ('倒垃圾', self.day(1))],
+        )
+        # 逾期的判斷與已儲存的待辦相同 早於今天且未完成
+        self.assertContains(response, 'table-danger', count=2)
+        self.assertContains(response, reverse('toggle_occurrence', args=[self.daily.id, self.day(-2)]))
+        self.assertFalse(ToDo.objects.exists())
+        self.assertEqual(self.client.get(reverse('todos'), {'filter': 'completed'}).context['todos'], [])
+        self.assertEqual(len(self.client.get(reverse('todos'), {'filter': 'incomplete', 'page_size': 5}).context['todos']), 5)
+
+    def test_completing_an_occurrence_writes_a_single_row(self):
+        url = reverse('toggle_occurrence', args=[self.daily.id, self.day(-1)])
+        self.assertRedirects(self.client.post(url), reverse('todos'))
+        self.client.post(url)
+        todo = ToDo.objects.get()
+        self.assertEqual((todo.title, todo.due_date.isoformat(), todo.completed), ('倒垃圾', self.day(-1), True))
+        self.assertEqual(ToDoOccurrence.objects.get().todo_id, todo.id)
+        incomplete = self.client.get(reverse('todos'), {'filter': 'incomplete', 'page_size': 2}).context['todos']
+        self.assertEqual([todo.due_date.isoformat() for todo in incomplete], [self.day(-2), self.day(0)])
+        self.assertEqual(self.client.get(reverse('todos'), {'filter': 'completed'}).context['todos'], [todo])
+        self.assertEqual(self.client.get(reverse('todos')).context['stats']['completed'], 1)
+        # 不是規則中的日期
+        self.assertEqual(self.client.post(reverse('toggle_occurrence', args=[self.weekly.id, self.day(1)])).status_code, 404)
+
+    def test_edit_writes_only_on_submit(self):
+        url = reverse('edit_occurrence', args=[self.weekly.id, self.day(7)])
+        self.assertContains(self.client.get(url), '打掃')
+        self.assertFalse(ToDo.objects.exists())
+        self.client.post(url, {'title': '大掃除', 'due_date': self.day(8), 'priority': 'low'})
+        todo = ToDo.objects.get()
+        self.assertEqual((todo.title, todo.due_date.isoformat(), todo.completed), ('大掃除', self.day(8), False))
+        titles = [(todo.title, todo.due_date.isoformat()) for todo in self.walk({'sort': 'due'})]
+        self.assertIn(('大掃除', self.day(8)), titles)
+        self.assertNotIn(('打掃', self.day(7)), titles)
+
+    def test_delete_one_occurrence_or_the_rest_of_the_series(self):
+        self.assertContains(self.client.get(reverse('skip_occurrence', args=[self.daily.id, self.day(0)])), '只刪除這一次')
+        self.client.post(reverse('skip_occurrence', args=[self.daily.id, self.day(0)]))
+        self.client.post(reverse('skip_occurrence', args=[self.daily.id, self.day(3)]), {'following': '1'})
+        dates = [todo.due_date.isoformat() for todo in self.walk({}) if todo.title == '倒垃圾']
+        self.assertEqual(dates, [self.day(-2), self.day(-1), self.day(1), self.day(2)])
+        self.assertFalse(ToDo.objects.exists())
+
+    def test_add_form_creates_a_rule(self):
+        self.client.post(reverse('add_todo'), {
+            'title': '澆花', 'due_date': self.day(1), 'priority': 'low', 'repeat': 'weekly', 'repeat_until': self.day(15),
+        })
+        rule = ToDoRecurrence.objects.get(title='澆花')
+        self.assertEqual((rule.frequency, rule.start_date.isoformat(), rule.until.isoformat()), ('weekly', self.day(1), self.day(15)))
+        self.assertFalse(ToDo.objects.exists())
+        self.assertEqual([todo.due_date.isoformat() for todo in self.walk({}) if todo.title == '澆花'], [self.day(1), self.day(8), self.day(15)])
+
+    def test_every_sort_merges_stored_and_virtual_rows(self):
+        seed_todos(self.user, 15)
+        self.client.post(reverse('toggle_occurrence', args=[self.daily.id, self.day(0)]))
+        stored = list(ToDo.objects.filter(user=self.user))
+        for sort in ('due', 'priority', 'created'):
+            for filter_option in ('all', 'incomplete'):
+                with self.subTest(sort=sort, filter=filter_option):
+                    seen = self.walk({'sort': sort, 'filter': filter_option})
+                    keys = [sort_key(todo, sort) for todo in seen]
+                    self.assertEqual(keys, sorted(keys))
+                    self.assertEqual(len(set(todo.id for todo in seen)), len(seen))
+                    expected = [todo for todo in stored if filter_option == 'all' or not todo.completed]
+                    self.assertEqual({todo.id for todo in seen if not todo.is_virtual}, {todo.id for todo in expected})
+                    # 每日規則 23 次扣掉已完成的 1 次 每週規則 3 次 (今天起 20 天內)
+                    self.assertEqual(sum(todo.is_virtual for todo in seen), 22 + 3)
+
+    def test_handled_occurrences_do_not_add_queries(self):
+        # 每日規則從 600 天前開始 之前的每一次都已刪除 第一頁仍只有固定的查詢數
+        rule = recurrence.create_rule(ToDoRecurrence(
+            user=self.user, title='寫日記', priority='low', frequency='daily',
+            start_date=self.today - datetime.timedelta(days=600),
+        ))
+        ToDoOccurrence.objects.bulk_create([
+            ToDoOccurrence(user=self.user, recurrence=rule, occurrence_date=self.today - datetime.timedelta(days=days))
+            for days in range(1, 601)
+        ])
+        for filter_option in ('all', 'incomplete'):
+            cache.clear()
+            with self.assertNumQueries(QUERY_BUDGETS['todos'] + 1):    # + 已處理的那幾次 (ToDoOccurrence)
+                response = self.client.get(reverse('todos'), {'filter': filter_option, 'page_size': 5})
+            page = [(todo.title, todo.due_date.isoformat()) for todo in response.context['todos']]
+            self.assertEqual(page[:2], [('倒垃圾', self.day(-2)), ('倒垃圾', self.day(-1))])
+            self.assertIn(('寫日記', self.day(0)), page)
+
+    def test_page_cost_does_not_depend_on_how_far_rules_run(self):
+        def page_cost(until):
+            ToDoRecurrence.objects.filter(user=self.user).update(until=until)
+            cache.clear()
+            with mock.patch.object(recurrence, 'virtual_todo', wraps=recurrence.virtual_todo) as expanded:
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get(reverse('todos'), {'page_size': 10, 'after': f'{self.day(15)}_0'})
+            return expanded.call_count, len(queries)
+
+        with override_settings(TODO_RECURRENCE={'HORIZON_DAYS': 36500}):
+            costs = {page_cost(until) for until in (self.today + datetime.timedelta(days=30), datetime.date(2999, 1, 1), None)}
+        self.assertEqual(len(costs), 1, costs)
+        expanded, _ = costs.pop()
+        self.assertLessEqual(expanded, 11 + 2)
+
+
+class TodoCalendarTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='planner', password='testpass123')
+        other = User.objects.create_user(username='other', password='testpass123')
+        self.todo = self.create(datetime.date(2030, 3, 5), 'high')
+        self.create(datetime.date(2030, 3, 5), 'high')
+        self.create(datetime.date(2030, 3, 5), 'low', completed=True)
+        self.create(datetime.date(2030, 3, 20), 'medium')
+        self.april = self.create(datetime.date(2030, 4, 1), 'low')
+        operations.create_todo(ToDo(user=other, title='別人的', due_date=datetime.date(2030, 3, 5), priority='high'))
+        self.client.login(username='planner', password='testpass123')
+
+    def create(self, due_date, priority, completed=False):
+        return operations.create_todo(ToDo(
+            user=self.user, title='月曆', due_date=due_date, priority=priority, completed=completed,
+        ))
+
+    def get_days(self, month):
+        response = self.client.get(reverse('todo_calendar'), {'month': month})
+        return {day['date']: day for week in response.context['weeks'] for day in week}
+
+    def count_queries(self):
+        return [query['sql'] for query in self.captured if 'GROUP BY' in query['sql']]
+
+    def is_cached(self, year, month):
+        return cache.get(calendar_cache_key(self.user.id, year, month)) is not None
+
+    def test_counts_by_day_priority_and_completion(self):
+        self.create(datetime.date(2030, 2, 25), 'low')
+        with CaptureQueriesContext(connection) as self.captured:
+            days = self.get_days('2030-03')
+        self.assertEqual(len(self.count_queries()), 1)
+        march_5 = days[datetime.date(2030, 3, 5)]
+        self.assertEqual((march_5['total'], march_5['completed']), (3, 1))
+        self.assertEqual(march_5['open'], [('high', '高', 2)])
+        self.assertFalse(march_5['overdue'])
+        self.assertEqual(days[datetime.date(2030, 3, 20)]['open'], [('medium', '中', 1)])
+        # 前後月份的日期只顯示在格子中 不計算
+        self.assertEqual(days[datetime.date(2030, 2, 25)]['total'], 0)
+        self.assertFalse(days[datetime.date(2030, 2, 25)]['in_month'])
+
+    def test_cached_per_month_and_only_touched_months_invalidated(self):
+        for month in ('2030-03', '2030-04', '2030-05'):
+            self.get_days(month)
+        with CaptureQueriesContext(connection) as self.captured:
+            self.get_days('2030-03')
+        self.assertEqual(self.count_queries(), [])
+
+        # 從三月改到五月 三月與五月失效 四月的快取保留
+        self.client.post(reverse('edit_todo', args=[self.todo.id]), {
+            'title': '月曆', 'description': '', 'due_date': '2030-05-02', 'priority': 'high',
+        })
+        self.assertEqual([self.is_cached(2030, month) for month in (3, 4, 5)], [False, True, False])
+        self.assertEqual(self.get_days('2030-05')[datetime.date(2030, 5, 2)]['total'], 1)
+
+        self.client.post(reverse('toggle_todo', args=[self.april.id]))
+        self.assertEqual([self.is_cached(2030, month) for month in (3, 4, 5)], [False, False, True])
+        self.assertEqual(self.get_days('2030-04')[datetime.date(2030, 4, 1)]['completed'], 1)
+
+        self.client.post(reverse('confirm_delete', args=[self.april.id]))
+        self.assertFalse(self.is_cached(2030, 4))
+        self.assertEqual(self.get_days('2030-04')[datetime.date(2030, 4, 1)]['total'], 0)
+        self.client.post(reverse('add_todo'), {
+            'title': '新增', 'description': '', 'due_date': '2030-04-09', 'priority': 'low',
+        })
+        self.assertEqual([self.is_cached(2030, month) for month in (4, 5)], [False, True])
+
+    def test_recurring_occurrences_are_counted(self):
+        today = timezone.localdate()
+        month = today.strftime('%Y-%m')
+        rule = recurrence.create_rule(ToDoRecurrence(
+            user=self.user, title='倒垃圾', priority='medium', frequency='daily', start_date=today,
+        ))
+        self.assertEqual(self.get_days(month)[today]['open'], [('medium', '中', 1)])
+        recurrence.materialize(self.user.id, rule.id, today, completed=True)
+        self.assertEqual((self.get_days(month)[today]['total'], self.get_days(month)[today]['completed']), (1, 1))
+        recurrence.skip(self.user.id, rule.id, today, following=True)
+        self.assertEqual(self.get_days(month)[today]['total'], 1)
+
+    def test_invalid_month_shows_current_month(self):
+        for month in ('abc', '2030-13', '9999-12'):
+            response = self.client.get(reverse('todo_calendar'), {'month': month})
+            self.assertEqual(response.context['month'], timezone.localdate().replace(day=1))
+
+
+class TodoListCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='cacher', password='testpass123')
+        self.todo = ToDo.objects.create(
+            user=self.user, title='快取', due_date=datetime.date(2030, 1, 1), priority='high'
+        )
+        self.client.login(username='cacher', password='testpass123')
+
+    def test_repeat_view_skips_todo_queries(self):
+        self.client.get(reverse('todos'))
+        with self.assertNumQueries(2):  # 只剩 session + user
+            response = self.client.get(reverse('todos'))
+        self.assertContains(response, '快取')
+
+    def test_filters_are_cached_separately(self):
+        self.client.get(reverse('todos'))
+        response = self.client.get(reverse('todos') + '?filter=completed')
+        self.assertNotContains(response, '快取')
+
+    def test_toggle_invalidates_cache(self):
+        self.client.get(reverse('todos'))
+        response = self.client.post(reverse('toggle_todo', args=[self.todo.id]), follow=True)
+        self.assertContains(response, '已完成')
+
+    def test_direct_model_change_invalidates_cache(self):
+        # 例如從 admin 修改 透過 post_save / post_delete 讓快取失效
+        self.client.get(reverse('todos'))
+        self.todo.title = '已改名'
+        self.todo.save()
+        self.assertContains(self.client.get(reverse('todos')), '已改名')
+        self.todo.delete()
+        self.assertContains(self.client.get(reverse('todos')), '尚無待辦事項')
+
+    def test_other_users_do_not_share_cache(self):
+        self.client.get(reverse('todos'))
+        User.objects.create_user(username='other', password='testpass123')
+        self.client.login(username='other', password='testpass123')
+        self.assertNotContains(self.client.get(reverse('todos')), '快取')
+
+
+class TodoStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='counter', password='testpass123')
+        self.client.login(username='counter', password='testpass123')
+
+    def add(self, title, due_date, completed=False):
+        data = {'title': title, 'due_date': due_date.isoformat(), 'priority': 'low'}
+        if completed:
+            data['completed'] = 'on'
+        self.client.post(reverse('add_todo'), data)
+        return ToDo.objects.get(user=self.user, title=title)
+
+    def assertStatsConsistent(self):
+        self.assertEqual(compute_stats(self.user), stored_stats(self.user))
+
+    def test_views_keep_stats_in_sync(self):
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        first = self.add('一', yesterday)
+        second = self.add('二', tomorrow, completed=True)
+        self.add('三', yesterday)
+        self.assertStatsConsistent()
+        self.client.post(reverse('toggle_todo', args=[first.id]))
+        self.assertStatsConsistent()
+        self.client.post(reverse('edit_todo', args=[second.id]), {
+            'title': '二', 'due_date': yesterday.isoformat(), 'priority': 'high'
+        })
+        self.assertStatsConsistent()
+        self.client.post(reverse('confirm_delete', args=[first.id]))
+        self.assertStatsConsistent()
+
+        response = self.client.get(reverse('todos'))
+        self.assertEqual(response.context['stats'], {'total': 2, 'completed': 0, 'incomplete': 2, 'overdue': 2})
+
+    def test_rebuild_command_fixes_drift(self):
+        self.add('一', datetime.date.today())
+        # 繞過 views 直接寫入 統計不會更新
+        ToDo.objects.create(user=self.user, title='二', due_date=datetime.date.today(), priority='low')
+        with self.assertRaises(CommandError):
+            call_command('rebuild_todo_stats', '--check', stdout=io.StringIO())
+        call_command('rebuild_todo_stats', stdout=io.StringIO())
+        self.assertStatsConsistent()
+        call_command('rebuild_todo_stats', '--check', stdout=io.StringIO())
+
+    def test_drifted_stats_do_not_block_writes(self):
+        # 統計偏差 (例如 admin 或直接寫入) 時計數可能暫時為負 不能讓使用者的刪除失敗
+        todo = self.add('一', datetime.date.today(), completed=True)
+        ToDoStats.objects.filter(user=self.user).update(total=0, completed=0)
+        response = self.client.post(reverse('confirm_delete', args=[todo.id]))
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(ToDo.objects.filter(id=todo.id).exists())
+        self.assertEqual(stored_stats(self.user)[0], {'total': -1, 'completed': -1})
+        call_command('rebuild_todo_stats', stdout=io.StringIO())
+        self.assertStatsConsistent()
+
+
+class AsyncTodoViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='async', password='testpass123')
+        self.other = User.objects.create_user(username='other', password='testpass123')
+        # 經由 operations 建立 統計與資料一致 刪除時計數不會變為負數
+        self.todo = operations.create_todo(ToDo(
+            user=self.user, title='非同步', due_date=datetime.date(2030, 1, 1), priority='low'
+        ))
+        views_context = use_todo_views(True)
+        views_context.__enter__()
+        self.addCleanup(views_context.__exit__, None, None, None)
+
+    async def test_requires_login(self):
+        response = await AsyncClient().get(reverse('todos'))
+        self.assertEqual(response.status_code, 302)
+
+    async def test_list_toggle_add_delete(self):
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        response = await client.get(reverse('todos'))
+        self.assertContains(response, '非同步')
+        self.assertContains(response, 'async')  # 範本中的 user.username
+
+        await client.post(reverse('toggle_todo', args=[self.todo.id]))
+        await self.todo.arefresh_from_db()
+        self.assertTrue(self.todo.completed)
+
+        response = await client.post(reverse('add_todo'), {
+            'title': '新的', 'due_date': '2030-01-02', 'priority': 'high'
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(await ToDo.objects.filter(user=self.user, title='新的').aexists())
+
+        response = await client.post(reverse('confirm_delete', args=[self.todo.id]), follow=True)
+        self.assertContains(response, '成功刪除')
+        self.assertFalse(await ToDo.objects.filter(id=self.todo.id).aexists())
+
+    async def test_fragment_mode(self):
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        response = await client.post(reverse('toggle_todo', args=[self.todo.id]), headers={'HX-Request': 'true'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, f'<tr id="todo-{self.todo.id}"')
+        response = await client.post(reverse('confirm_delete', args=[self.todo.id]), headers={'HX-Request': 'true'})
+        self.assertEqual(response.content, b'')
+
+    async def test_other_user_gets_404(self):
+        client = AsyncClient()
+        await client.aforce_login(self.other)
+        response = await client.post(reverse('toggle_todo', args=[self.todo.id]))
+        self.assertEqual(response.status_code, 404)
+        response = await client.post(reverse('confirm_delete', args=[self.todo.id]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_recurring_rule_is_expanded(self):
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        start = timezone.localdate() + datetime.timedelta(days=1)
+        response = await client.post(reverse('add_todo'), {
+            'title': '每週重複', 'due_date': start.isoformat(), 'priority': 'low', 'repeat': 'weekly',
+        }, headers={'HX-Request': 'true'})
+        self.assertContains(response, '每週重複', status_code=201)
+        response = await client.get(reverse('todos'), {'page_size': 2})
+        self.assertEqual(
+            [(todo.title, todo.due_date) for todo in response.context['todos']],
+            [('每週重複', start), ('每週重複', start + datetime.timedelta(days=7))],
+        )
+        self.assertEqual(await ToDo.objects.acount(), 1)
+
+    async def test_search_is_paginated(self):
+        for title in ('報告一', '報告二'):
+            await sync_to_async(operations.create_todo)(ToDo(user=self.user, title=title, due_date=datetime.date(2030, 1, 3), priority='low'))
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        first = await client.get(reverse('todos'), {'q': '報告', 'page_size': 1})
+        second = await client.get(reverse('todos'), {'q': '報告', 'page_size': 1, 'after': first.context['next_cursor']})
+        self.assertEqual(
+            {todo.title for page in (first, second) for todo in page.context['todos']}, {'報告一', '報告二'}
+        )
+        self.assertIsNone(second.context['next_cursor'])
+
+    async def test_list_cache_io_runs_off_the_event_loop(self):
+        # file 快取後端的讀寫是磁碟 I/O 不能在 event loop 上執行
+        on_loop = []
+
+        def recording(method):
+            def wrapper(*args, **kwargs):
+                with contextlib.suppress(RuntimeError):
+                    asyncio.get_running_loop()
+                    on_loop.append(method.__name__)
+                return method(*args, **kwargs)
+            return wrapper
+
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        with contextlib.ExitStack() as stack:
+            for name in ('get', 'set', 'add'):
+                stack.enter_context(mock.patch.object(cache, name, recording(getattr(cache, name))))
+            for _ in range(2):
+                self.assertContains(await client.get(reverse('todos')), '非同步')
+        self.assertEqual(on_loop, [])
+
+    def adapted_middleware(self):
+        # 以 ASGI 載入 middleware 時需要 sync_to_async / async_to_sync 轉換 (每個請求多一次執行緒切換) 的 middleware
+        with mock.patch('django.core.handlers.base.logger') as logger:
+            ASGIHandler()
+        return [call.args[1] for call in logger.debug.call_args_list if 'adapted for' in call.args[0]]
+
+    def test_middleware_runs_natively_under_asgi(self):
+        self.assertEqual(self.adapted_middleware(), [])
+
+
+class TodoExportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='exporter', password='testpass123')
+        self.other = User.objects.create_user(username='other', password='testpass123')
+        ToDo.objects.create(user=self.user, title='完成的', due_date=datetime.date(2030, 1, 1), priority='low', completed=True)
+        ToDo.objects.create(user=self.user, title='未完成, 含逗號', due_date=datetime.date(2030, 1, 2), priority='high')
+        ToDo.objects.create(user=self.other, title='別人的', due_date=datetime.date(2030, 1, 1), priority='low')
+        self.client.login(username='exporter', password='testpass123')
+
+    def export(self, **params):
+        response = self.client.get(reverse('export_todos'), params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_export(self):
+        content = self.export(format='csv')
+        self.assertTrue(content.startswith('id,title,description,due_date,priority,completed,created_at'))
+        self.assertIn('"未完成, 含逗號"', content)
+        self.assertNotIn('別人的', content)
+
+    def test_ndjson_export_uses_list_filters(self):
+        lines = self.export(format='ndjson', filter='incomplete').splitlines()
+        self.assertEqual(len(lines), 1)
+        row = json.loads(lines[0])
+        self.assertEqual(row['title'], '未完成, 含逗號')
+        self.assertEqual(row['due_date'], '2030-01-02')
+
+    def test_invalid_format(self):
+        response = self.client.get(reverse('export_todos'), {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+    def peak_export_memory(self, count):
+        ToDo.objects.filter(user=self.user).delete()
+        ToDo.objects.bulk_create(
+            ToDo(user=self.user, title=f'匯出{i}', description='x' * 200, due_date=datetime.date(2030, 1, 1), priority='low')
+            for i in range(count)
+        )
+        response = self.client.get(reverse('export_todos'), {'format': 'csv'})
+        tracemalloc.start()
+        for _ in response.streaming_content:
+            pass
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return peak
+
+    @mock.patch('ToDos.views.EXPORT_CHUNK_SIZE', 100)
+    def test_memory_does_not_grow_with_rows(self):
+        small = self.peak_export_memory(300)
+        large = self.peak_export_memory(3000)
+        self.assertLess(large, small * 2)
+
+
+class ImportTodosTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='importer', password='testpass123')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'todos.csv')
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write('title,description,due_date,priority,completed\n')
+            for i in range(10):
+                f.write(f'匯入{i},描述,2030-01-{i + 1:02d},high,{"True" if i % 2 else "False"}\n')
+            f.write('壞日期,,2030-13-01,high,False\n')
+            f.write('壞優先級,,2030-01-01,urgent,False\n')
+
+    def run_import(self, *args):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_todos', self.path, '--user', 'importer', *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_import_validates_and_batches(self):
+        stdout, stderr = self.run_import('--batch-size', '3')
+        self.assertEqual(ToDo.objects.filter(user=self.user).count(), 10)
+        self.assertEqual(ToDo.objects.filter(user=self.user, completed=True).count(), 5)
+        self.assertIn('匯入 10 筆 略過 2 筆', stdout)
+        self.assertIn('第 11 列', stderr)
+        self.assertIn('第 12 列', stderr)
+        self.assertEqual(compute_stats(self.user), stored_stats(self.user))
+        self.assertFalse(ToDoImportProgress.objects.exists())
+
+    def test_dry_run_writes_nothing(self):
+        stdout, _ = self.run_import('--dry-run')
+        self.assertIn('可匯入 10 筆', stdout)
+        self.assertFalse(ToDo.objects.exists())
+
+    def test_resume_after_failed_batch(self):
+        original = ToDo.objects.bulk_create
+        calls = []
+
+        def failing_bulk_create(objs, *args, **kwargs):
+            calls.append(len(objs))
+            if len(calls) == 2:
+                raise RuntimeError('disk full')
+            return original(objs, *args, **kwargs)
+
+        with mock.patch.object(ToDo.objects, 'bulk_create', failing_bulk_create):
+            with self.assertRaises(CommandError):
+                self.run_import('--batch-size', '4')
+        self.assertEqual(ToDo.objects.count(), 4)
+        self.run_import('--batch-size', '4', '--resume')
+        self.assertEqual(ToDo.objects.count(), 10)
+        self.assertEqual(ToDo.objects.values('title').distinct().count(), 10)
+
+    def test_progress_is_written_with_the_batch(self):
+        # 記錄進度失敗 (例如寫入後中斷) 時這批待辦一起 rollback --resume 不會重複匯入
+        original = ToDoImportProgress.objects.update_or_create
+        calls = []
+
+        def failing_update_or_create(*args, **kwargs):
+            calls.append(kwargs['defaults']['rows'])
+            if len(calls) == 2:
+                raise RuntimeError('killed')
+            return original(*args, **kwargs)
+
+        with mock.patch.object(ToDoImportProgress.objects, 'update_or_create', failing_update_or_create):
+            with self.assertRaises(CommandError):
+                self.run_import('--batch-size', '4')
+        self.assertEqual(ToDo.objects.count(), 4)
+        self.assertEqual(ToDoImportProgress.objects.get(user=self.user).rows, 4)
+        stdout, _ = self.run_import('--batch-size', '4', '--resume')
+        self.assertIn('從第 5 列繼續匯入', stdout)
+        self.assertEqual(ToDo.objects.count(), 10)
+        self.assertEqual(ToDo.objects.values('title').distinct().count(), 10)
+        self.assertFalse(ToDoImportProgress.objects.exists())
+
+
+class TodoSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='searcher', password='testpass123')
+        self.other = User.objects.create_user(username='other', password='testpass123')
+        self.meeting = ToDo.objects.create(
+            user=self.user, title='參加週會', description='準備季度報告', due_date=datetime.date(2030, 1, 1), priority='high'
+        )
+        self.done = ToDo.objects.create(
+            user=self.user, title='繳交報告', description='Weekly report', due_date=datetime.date(2030, 1, 2),
+            priority='low', completed=True,
+        )
+        ToDo.objects.create(user=self.other, title='別人的報告', due_date=datetime.date(2030, 1, 1), priority='low')
+        self.client.login(username='searcher', password='testpass123')
+
+    def search(self, q, filter_option='all'):
+        response = self.client.get(reverse('todos'), {'q': q, 'filter': filter_option})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_chinese_words_inside_sentences(self):
+        response = self.search('週會')
+        self.assertContains(response, '參加週會')
+        self.assertNotContains(response, '繳交報告')
+
+    def test_single_character_and_english_prefix(self):
+        self.assertContains(self.search('週'), '參加週會')
+        self.assertContains(self.search('week'), '繳交報告')
+
+    def test_combines_with_filter_and_user_isolation(self):
+        response = self.search('報告', 'incomplete')
+        self.assertContains(response, '參加週會')
+        self.assertNotContains(response, '繳交報告')
+        self.assertNotContains(response, '別人的報告')
+
+    def test_index_follows_edits_and_deletes(self):
+        self.meeting.title = '年度旅遊'
+        self.meeting.save()
+        self.assertNotContains(self.search('週會'), '年度旅遊')
+        self.assertContains(self.search('旅遊'), '年度旅遊')
+        self.meeting.delete()
+        self.assertContains(self.search('旅遊'), '尚無待辦事項')
+
+    def test_results_are_paginated_by_rank(self):
+        for i in range(4):
+            ToDo.objects.create(user=self.user, title=f'報告{i}', due_date=datetime.date(2030, 2, 1), priority='low')
+        titles, cursor = [], ''
+        while True:
+            response = self.client.get(reverse('todos'), {'q': '報告', 'page_size': 2, 'after': cursor})
+            titles.extend(todo.title for todo in response.context['todos'])
+            cursor = response.context['next_cursor']
+            if not cursor:
+                break
+            self.assertContains(response, '&q=%E5%A0%B1%E5%91%8A')
+        self.assertEqual(len(titles), 6)
+        self.assertEqual(set(titles), {'參加週會', '繳交報告', '報告0', '報告1', '報告2', '報告3'})
+        # sort=search 只用於搜尋 不能從清單選擇
+        self.assertEqual(self.client.get(reverse('todos'), {'sort': 'search'}).context['sort'], 'due')
+
+    def test_search_composes_with_other_querysets(self):
+        # 比對經由 ORM 的 join 產生 用在子查詢時資料表別名仍然正確
+        matches = search.search(ToDo.objects.filter(user=self.user), self.user.id, '報告')
+        self.assertEqual(
+            set(ToDo.objects.filter(id__in=matches.values('id')).values_list('title', flat=True)), {'參加週會', '繳交報告'}
+        )
+        self.assertEqual(list(User.objects.filter(id__in=matches.values('user_id'))), [self.user])
+
+    def test_migration_and_queries_agree_on_fts5(self):
+        # 遷移與查詢使用同一個 FTS5 判斷 有索引表時才查詢 沒有 FTS5 時退回 icontains
+        self.assertEqual(search.search_available(), FTS_TABLE in connection.introspection.table_names())
+        with mock.patch('ToDos.search._sqlite_has_fts5', return_value=False):
+            self.assertFalse(search.search_available())
+            self.assertContains(self.search('週會'), '參加週會')
+            pages = [self.client.get(reverse('todos'), {'q': '報告', 'page_size': 1})]
+            pages.append(self.client.get(reverse('todos'), {'q': '報告', 'page_size': 1, 'after': pages[0].context['next_cursor']}))
+            self.assertEqual([todo.title for page in pages for todo in page.context['todos']], ['參加週會', '繳交報告'])
+
+
+class BulkActionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='bulker', password='testpass123')
+        self.other = User.objects.create_user(username='other', password='testpass123')
+        self.todos = [
+            ToDo.objects.create(user=self.user, title=f'批次{i}', due_date=datetime.date(2030, 1, 1 + i % 3), priority='low')
+            for i in range(5)
+        ]
+        self.foreign = ToDo.objects.create(user=self.other, title='別人的', due_date=datetime.date(2030, 1, 1), priority='low')
+        call_command('rebuild_todo_stats', stdout=io.StringIO())
+        self.client.login(username='bulker', password='testpass123')
+
+    def post(self, action, todos):
+        return self.client.post(reverse('bulk_action'), {'action': action, 'ids': [todo.id for todo in todos]})
+
+    def test_bulk_complete_and_uncomplete(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.post('complete', self.todos[:3] + [self.foreign])
+        writes = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "ToDos_todo"')]
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(ToDo.objects.filter(user=self.user, completed=True).count(), 3)
+        self.foreign.refresh_from_db()
+        self.assertFalse(self.foreign.completed)
+        self.assertEqual(compute_stats(self.user), stored_stats(self.user))
+
+        self.post('uncomplete', self.todos[:2])
+        self.assertEqual(ToDo.objects.filter(user=self.user, completed=True).count(), 1)
+        self.assertEqual(compute_stats(self.user), stored_stats(self.user))
+
+    def test_bulk_delete_is_scoped_to_user(self):
+        response = self.post('delete', self.todos[:2] + [self.foreign])
+        self.assertRedirects(response, reverse('todos'), fetch_redirect_response=False)
+        self.assertEqual(ToDo.objects.filter(user=self.user).count(), 3)
+        self.assertTrue(ToDo.objects.filter(id=self.foreign.id).exists())
+        self.assertEqual(compute_stats(self.user), stored_stats(self.user))
+        self.assertNotContains(self.client.get(reverse('todos')), '批次0')
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.post(reverse('bulk_action'), {'action': 'explode'}).status_code, 400)
+        self.assertEqual(self.client.post(reverse('bulk_action'), {'action': 'delete', 'ids': ['x']}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('bulk_action')).status_code, 405)
+
+    def test_toggle_updates_only_completed_without_reading(self):
+        todo = self.todos[0]
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('toggle_todo', args=[todo.id]))
+        todo_queries = [q['sql'] for q in queries if '"ToDos_todo"' in q['sql']]
+        self.assertEqual(len(todo_queries), 1)
+        self.assertIn('SET completed = NOT completed', todo_queries[0])
+        todo.refresh_from_db()
+        self.assertTrue(todo.completed)
+        self.assertEqual(compute_stats(self.user), stored_stats(self.user))
+
+
+class QueryBudgetTests(TestCase):
+    # 每個 view 的查詢數不可超過 ToDos.bench.QUERY_BUDGETS 完整的延遲量測請用 manage.py bench_views
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_superuser(username='budget', password='benchpass123')
+        seed_todos(self.user, 50)
+        User.objects.create_user(username='neighbour', password='testpass123')
+        self.context = {
+            'user': self.user,
+            'rng': random.Random(0),
+            'todo_ids': list(ToDo.objects.filter(user=self.user).values_list('id', flat=True)),
+        }
+
+    def test_every_url_has_a_scenario(self):
+        from ToDoManager.urls import urlpatterns
+        names = {getattr(pattern, 'name', None) for pattern in urlpatterns} - {None}
+        self.assertLessEqual(names, set(SCENARIOS))
+
+    def test_views_stay_within_query_budgets(self):
+        client = Client()
+        for name in SCENARIOS:
+            with self.subTest(view=name):
+                _, num_queries, status = run_scenario(client, name, self.context)
+                self.assertLess(status, 400)
+                self.assertLessEqual(num_queries, QUERY_BUDGETS[name])
+
+
+class LoginThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='guard', password='testpass123')
+        self.url = reverse('login_view')
+
+    def fail(self, username='guard'):
+        return self.client.post(self.url, {'username': username, 'password': 'wrong'})
+
+    def test_login_hashes_password_once(self):
+        # 測試用的 FastPBKDF2PasswordHasher 也繼承這個 verify
+        verify = PBKDF2PasswordHasher.verify
+        with mock.patch.object(PBKDF2PasswordHasher, 'verify', autospec=True, side_effect=verify) as spy:
+            response = self.client.post(self.url, {'username': 'guard', 'password': 'testpass123'})
+        self.assertRedirects(response, reverse('todos'))
+        self.assertEqual(spy.call_count, 1)
+
+    def test_limited_attempts_skip_hashing(self):
+        for _ in range(5):
+            self.assertEqual(self.fail().status_code, 200)
+        with mock.patch('django.contrib.auth.forms.authenticate') as authenticate:
+            response = self.client.post(self.url, {'username': 'GUARD', 'password': 'testpass123'})
+        self.assertEqual(response.status_code, 429)
+        authenticate.assert_not_called()
+
+    def test_successful_login_resets_username_counter(self):
+        for _ in range(4):
+            self.fail()
+        self.client.post(self.url, {'username': 'guard', 'password': 'testpass123'})
+        self.client.logout()
+        for _ in range(4):
+            self.assertEqual(self.fail().status_code, 200)
+
+    @override_settings(TODO_LOGIN_THROTTLE={'IP_LIMIT': 3})
+    def test_ip_limit_spans_usernames(self):
+        for i in range(3):
+            self.fail(f'user{i}')
+        self.assertEqual(self.fail('someone').status_code, 429)
+
+
+class ToDoAdminTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(username='boss', password='testpass123')
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        seed_todos(self.owner, 300)
+        seed_todos(self.admin, 50, seed=1)
+        self.client = Client()
+        self.client.force_login(self.admin)
+        self.url = reverse('admin:ToDos_todo_changelist')
+
+    def test_changelist_plans_do_not_depend_on_table_size(self):
+        # 無法在測試中建立千萬筆 改為檢查查詢計畫 沒有整張表的 COUNT / 排序 每頁成本就與總筆數無關
+        for label, params in admin_changelist_params(datetime.date.today()).items():
+            if 'p' in params:
+                params = {**params, 'p': '3'}    #測試資料只有幾頁
+            with self.subTest(params=label), CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.url, params)
+                self.assertEqual(response.status_code, 200)
+            todo_queries = [query['sql'] for query in queries.captured_queries if 'ToDos_todo' in query['sql']]
+            self.assertLessEqual(len(todo_queries), 2)
+            for sql in todo_queries:
+                if 'COUNT(' in sql:
+                    self.assertIn('LIMIT', sql)
+                with connection.cursor() as cursor:
+                    cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                    plan = [row[-1] for row in cursor.fetchall()]
+                self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan, sql)
+                self.assertFalse([step for step in plan if step.startswith('SCAN ToDos_todo') and 'INDEX' not in step], plan)
+
+    def test_pages_are_capped(self):
+        response = self.client.get(self.url, {'p': '101'})
+        self.assertRedirects(response, self.url + '?e=1', fetch_redirect_response=False)
+
+    def test_actions_run_one_update_and_keep_stats(self):
+        ids = list(ToDo.objects.filter(user=self.owner, completed=False).values_list('id', flat=True)[:20])
+        ids.append(ToDo.objects.filter(user=self.admin, completed=False).values_list('id', flat=True)[0])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(self.url, {'action': 'mark_completed', '_selected_action': ids})
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE "ToDos_todo"')]
+        self.assertEqual(len(updates), 1)
+        self.assertFalse(ToDo.objects.filter(id__in=ids, completed=False).exists())
+        for user in (self.owner, self.admin):
+            self.assertEqual(stored_stats(user), compute_stats(user))
+
+    def test_select_across_delete_uses_single_delete(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(self.url + '?priority__exact=high', {
+                'action': 'delete_selected', 'select_across': '1', 'index': '0',
+                '_selected_action': [ToDo.objects.first().id], 'post': 'yes',
+            })
+        deletes = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('DELETE FROM "ToDos_todo"')]
+        self.assertEqual(len(deletes), 1)
+        self.assertFalse(ToDo.objects.filter(priority='high').exists())
+        for user in (self.owner, self.admin):
+            self.assertEqual(stored_stats(user), compute_stats(user))
+
+
+class ArchiveTodosTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='keeper', password='testpass123')
+        self.other = User.objects.create_user(username='other', password='testpass123')
+        long_ago = datetime.date.today() - datetime.timedelta(days=90)
+        self.old_done = [self.create(self.user, f'舊的完成{i}', long_ago + datetime.timedelta(days=i), True) for i in range(3)]
+        self.old_open = self.create(self.user, '舊的未完成', long_ago, False)
+        self.recent_done = self.create(self.user, '最近完成', datetime.date.today(), True)
+        self.other_done = self.create(self.other, '別人的舊完成', long_ago, True)
+        self.client.login(username='keeper', password='testpass123')
+
+    def create(self, user, title, due_date, completed):
+        return operations.create_todo(ToDo(user=user, title=title, due_date=due_date, priority='low', completed=completed))
+
+    def archive(self, *args):
+        out = io.StringIO()
+        call_command('archive_todos', *args, stdout=out)
+        return out.getvalue()
+
+    def test_moves_old_completed_rows_in_batches(self):
+        output = self.archive('--older-than', '30', '--batch-size', '2')
+        self.assertIn('共 4 筆 2 批', output)
+        archived_ids = {todo.id for todo in self.old_done} | {self.other_done.id}
+        self.assertEqual(set(ArchivedToDo.objects.values_list('id', flat=True)), archived_ids)
+        self.assertFalse(ToDo.objects.filter(id__in=archived_ids).exists())
+        self.assertTrue(ToDo.objects.filter(id__in=[self.old_open.id, self.recent_done.id]).count() == 2)
+        for user in (self.user, self.other):
+            self.assertEqual(stored_stats(user), compute_stats(user))
+
+    def test_list_reads_archive_only_when_asked(self):
+        self.archive('--older-than', '30')
+        self.assertNotContains(self.client.get(reverse('todos')), '舊的完成0')
+        response = self.client.get(reverse('todos'), {'include_archived': '1', 'filter': 'completed'})
+        self.assertContains(response, '舊的完成0')
+        self.assertContains(response, '已封存')
+        self.assertNotContains(response, '別人的舊完成')
+        response = self.client.get(reverse('todos'), {'include_archived': '1', 'filter': 'incomplete'})
+        self.assertNotContains(response, '舊的完成0')
+
+    def test_pages_merge_archive_and_active_rows_in_order(self):
+        self.archive('--older-than', '30')
+        rows = [*ToDo.objects.filter(user=self.user), *ArchivedToDo.objects.filter(user=self.user)]
+        expected = [todo.title for todo in sorted(rows, key=lambda todo: (todo.due_date, todo.id))]
+        seen, cursor = [], ''
+        while True:
+            response = self.client.get(reverse('todos'), {'include_archived': '1', 'page_size': 2, 'after': cursor})
+            content = response.content.decode()
+            seen += [title for _, title in sorted(
+                (content.index(f'<td>{title}</td>'), title) for title in expected if f'<td>{title}</td>' in content
+            )]
+            cursor = response.context['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, expected)
+
+    def test_restore_keeps_ids_and_user_scope(self):
+        self.archive('--older-than', '30')
+        output = self.archive('--restore', '--user', 'keeper')
+        self.assertIn('共 3 筆', output)
+        self.assertEqual(
+            set(ToDo.objects.filter(user=self.user, completed=True).values_list('id', flat=True)),
+            {todo.id for todo in self.old_done} | {self.recent_done.id},
+        )
+        self.assertEqual(list(ArchivedToDo.objects.values_list('id', flat=True)), [self.other_done.id])
+        self.assertEqual(stored_stats(self.user), compute_stats(self.user))
+        self.assertContains(self.client.get(reverse('todos'), {'q': '舊的完成'}), '舊的完成1')
+
+    def test_requires_exactly_one_mode(self):
+        with self.assertRaises(CommandError):
+            self.archive()
+        with self.assertRaises(CommandError):
+            self.archive('--older-than', '30', '--restore')
+
+
+class PurgeUsersTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(username='boss', password='testpass123')
+        self.keeper = User.objects.create_user(username='keeper', password='testpass123')
+        seed_todos(self.keeper, 20)
+
+    def seed_user(self, username, count):
+        user = User.objects.create_user(username=username, password='testpass123')
+        seed_todos(user, count, seed=1)
+        operations.bulk_delete(user.id, ToDo.objects.filter(user=user).values_list('id', flat=True)[:5])
+        ArchivedToDo.objects.create(
+            id=10 ** 6 + user.id, user=user, title='封存', due_date=datetime.date(2020, 1, 1),
+            priority='low', created_at=timezone.now(), archived_at=timezone.now(),
+        )
+        return user
+
+    def assertPurged(self, user):
+        self.assertFalse(User.objects.filter(pk=user.pk).exists())
+        for model in purge.PURGE_MODELS:
+            self.assertFalse(model.objects.filter(user_id=user.pk).exists(), model)
+        self.assertEqual(ToDo.objects.filter(user=self.keeper).count(), 20)
+
+    def test_command_deletes_in_batches_and_reports_progress(self):
+        user = self.seed_user('leaver', 250)
+        out = io.StringIO()
+        call_command('purge_users', 'leaver', '--batch-size', '100', '--noinput', stdout=out)
+        self.assertIn('leaver: 已刪除 ToDo 200 筆', out.getvalue())
+        self.assertIn('leaver: 已刪除 ToDo 245 筆', out.getvalue())
+        self.assertIn('最長交易', out.getvalue())
+        self.assertPurged(user)
+        with self.assertRaises(CommandError):
+            call_command('purge_users', 'nobody', '--noinput', stdout=io.StringIO())
+
+    def measure(self, count):
+        # 回傳 (記憶體峰值, 最長的單一交易秒數)
+        user = self.seed_user(f'user{count}', count)
+        tracemalloc.start()
+        _, longest = purge.purge_user(user.id, batch_size=100)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.assertPurged(user)
+        return peak, longest
+
+    def test_peak_memory_and_lock_hold_do_not_grow_with_rows(self):
+        small_peak, _ = self.measure(300)
+        large_peak, large_longest = self.measure(3000)
+        self.assertLess(large_peak, small_peak * 2)
+        # 對照: CASCADE 在一個交易中刪除相同筆數
+        user = self.seed_user('cascade', 3000)
+        started = time.perf_counter()
+        with transaction.atomic():
+            user.delete()
+        self.assertLess(large_longest, time.perf_counter() - started)
+
+    def test_admin_action_replaces_delete(self):
+        user = self.seed_user('leaver', 50)
+        client = Client()
+        client.force_login(self.admin)
+        url = reverse('admin:auth_user_changelist')
+        actions = [name for name, _ in client.get(url).context['action_form'].fields['action'].choices]
+        self.assertNotIn('delete_selected', actions)
+        self.assertIn('purge_users', actions)
+        self.assertEqual(client.get(reverse('admin:auth_user_delete', args=[user.pk])).status_code, 403)
+        client.post(url, {'action': 'purge_users', '_selected_action': [user.pk, self.admin.pk]})
+        # 不在請求中刪除 只停用並排入佇列
+        user.refresh_from_db()
+        self.assertFalse(user.is_active)
+        self.assertEqual(ToDo.objects.filter(user=user).count(), 45)
+        self.assertEqual(list(UserPurgeRequest.objects.values_list('user_id', flat=True)), [user.pk])
+        # 再次排入不會重複
+        client.post(url, {'action': 'purge_users', '_selected_action': [user.pk]})
+        self.assertEqual(UserPurgeRequest.objects.count(), 1)
+
+        call_command('purge_users', '--queued', '--batch-size', '100', stdout=io.StringIO())
+        self.assertPurged(user)
+        self.assertFalse(UserPurgeRequest.objects.exists())
+        self.assertTrue(User.objects.filter(pk=self.admin.pk, is_active=True).exists())
+        out = io.StringIO()
+        call_command('purge_users', '--queued', stdout=out)
+        self.assertIn('刪除佇列中沒有使用者', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('purge_users', stdout=io.StringIO())
+
+
+class TodoRemindersTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reminded', password='testpass123', email='reminded@example.com')
+        self.today = datetime.date(2030, 1, 10)
+        self.due = [self.create(f'即將到期{i}', self.today + datetime.timedelta(days=i % 2)) for i in range(5)]
+        self.create('已完成', self.today, completed=True)
+        self.create('太遠', self.today + datetime.timedelta(days=5))
+        self.create('已逾期', self.today - datetime.timedelta(days=1))
+
+    def create(self, title, due_date, completed=False):
+        return operations.create_todo(
+            ToDo(user=self.user, title=title, due_date=due_date, priority='low', completed=completed)
+        )
+
+    def run_worker(self):
+        out = io.StringIO()
+        with mock.patch('ToDos.management.commands.remind_todos.timezone.localdate', return_value=self.today):
+            call_command('remind_todos', '--once', '--batch-size', '2', stdout=out)
+        return out.getvalue()
+
+    def test_reruns_neither_duplicate_nor_miss(self):
+        self.assertIn('新增提醒 5 筆 寄出 5 封', self.run_worker())
+        self.assertEqual(sorted(message.subject for message in mail.outbox), sorted(f'待辦即將到期: {todo.title}' for todo in self.due))
+        self.assertIn('新增提醒 0 筆 寄出 0 封', self.run_worker())
+        # 兩輪之間新增的待辦在下一輪補上 改了截止日期的待辦在新的日期再提醒一次
+        self.create('之後新增', self.today)
+        ToDo.objects.filter(id=self.due[0].id).update(due_date=self.today + datetime.timedelta(days=1))
+        self.assertIn('新增提醒 2 筆 寄出 2 封', self.run_worker())
+        self.assertEqual(len(mail.outbox), 7)
+        self.assertEqual(len({message.extra_headers['Message-ID'] for message in mail.outbox}), 7)
+
+    def test_crash_after_claim_is_resent_after_lease(self):
+        reminders.scan(self.today)
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError):
+            with self.assertRaises(OSError):
+                reminders.send_batch(batch_size=2)
+        self.assertEqual(reminders.send_pending(), 3)      # 認領中的兩筆尚未到期 不會被其他 worker 重寄
+        self.assertEqual(reminders.send_pending(lease=0), 2)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertFalse(ToDoReminder.objects.filter(sent_at__isnull=True).exists())
+
+    def test_skips_todos_completed_before_sending(self):
+        reminders.scan(self.today)
+        operations.set_completed(self.user.id, self.due[0].id, True)
+        self.assertEqual(reminders.send_pending(), 4)
+
+    def test_scan_reads_only_the_window_from_the_partial_index(self):
+        plan = reminders._due_in_window(*reminders.window(self.today)).explain()
+        self.assertIn('SEARCH ToDos_todo USING INDEX todo_open_due_idx (due_date>? AND due_date<?)', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class TodoChangesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='syncer', password='testpass123')
+        self.other = User.objects.create_user(username='other', password='testpass123')
+        self.todos = [
+            operations.create_todo(ToDo(user=self.user, title=f'同步{i}', due_date=datetime.date(2030, 1, i + 1), priority='low'))
+            for i in range(3)
+        ]
+        operations.create_todo(ToDo(user=self.other, title='別人的', due_date=datetime.date(2030, 1, 1), priority='low'))
+        self.client.login(username='syncer', password='testpass123')
+        self.url = reverse('todo_changes')
+
+    def sync(self, since='', **extra):
+        changes, cursor = [], since
+        while True:
+            data = self.client.get(self.url, {'since': cursor, 'limit': 1}, **extra).json()
+            changes += data['changes']
+            cursor = data['next_cursor']
+            if not data['has_more']:
+                return changes, cursor
+
+    def test_full_sync_pages_through_own_todos(self):
+        changes, _ = self.sync()
+        self.assertEqual([change['id'] for change in changes], [todo.id for todo in self.todos])
+        self.assertEqual(changes[0]['title'], '同步0')
+        self.assertFalse(any(change['deleted'] for change in changes))
+
+    def test_returns_only_later_changes_including_deletes(self):
+        _, cursor = self.sync()
+        self.client.post(reverse('toggle_todo', args=[self.todos[0].id]))
+        self.client.post(reverse('confirm_delete', args=[self.todos[1].id]))
+        self.client.post(reverse('bulk_action'), {'action': 'complete', 'ids': [self.todos[2].id]})
+        changes, cursor = self.sync(cursor)
+        self.assertEqual([(change['id'], change['deleted']) for change in changes], [
+            (self.todos[0].id, False), (self.todos[1].id, True), (self.todos[2].id, False),
+        ])
+        self.assertTrue(changes[0]['completed'])
+        self.assertEqual(self.sync(cursor), ([], cursor))
+
+    def test_idle_poll_is_not_modified_without_reading_todos(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([query for query in queries.captured_queries if 'ToDos_' in query['sql']])
+        operations.set_completed(self.user.id, self.todos[0].id, True)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_cursor_older_than_retention_asks_for_full_resync(self):
+        stale = changes.encode_cursor(timezone.now() - datetime.timedelta(days=31), self.todos[0].id)
+        with self.settings(TODO_TOMBSTONE_RETENTION_DAYS=30):
+            response = self.client.get(self.url, {'since': stale})
+            self.assertEqual(response.status_code, 410)
+            self.assertTrue(response.json()['full_resync'])
+            self.assertEqual(self.client.get(self.url, {'since': stale}, HTTP_IF_NONE_MATCH='*').status_code, 410)
+            _, cursor = self.sync()
+            self.assertEqual(self.sync(cursor), ([], cursor))
+
+    def test_prune_removes_only_expired_tombstones(self):
+        self.client.post(reverse('confirm_delete', args=[self.todos[0].id]))
+        self.client.post(reverse('confirm_delete', args=[self.todos[1].id]))
+        ToDoTombstone.objects.filter(todo_id=self.todos[0].id).update(deleted_at=timezone.now() - datetime.timedelta(days=40))
+        out = io.StringIO()
+        call_command('prune_tombstones', '--days', '30', '--batch-size', '1', stdout=out)
+        self.assertIn('共 1 筆', out.getvalue())
+        self.assertEqual(list(ToDoTombstone.objects.values_list('todo_id', flat=True)), [self.todos[1].id])
+
+
+class FragmentResponseTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='fragment', password='testpass123')
+        self.todo = operations.create_todo(
+            ToDo(user=self.user, title='片段', due_date=datetime.date(2030, 1, 1), priority='low')
+        )
+        self.client.login(username='fragment', password='testpass123')
+
+    def test_toggle_returns_only_the_row(self):
+        response = self.client.post(reverse('toggle_todo', args=[self.todo.id]), HTTP_HX_REQUEST='true')
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertTrue(content.lstrip().startswith(f'<tr id="todo-{self.todo.id}"'))
+        self.assertIn('已完成', content)
+        self.assertNotIn('<html', content)
+        self.assertIn('HX-Request', response['Vary'])
+
+    def test_add_returns_new_row_or_errors(self):
+        response = self.client.post(reverse('add_todo'), {
+            'title': '新的一列', 'due_date': '2030-01-02', 'priority': 'high'
+        }, HTTP_ACCEPT='text/html-fragment')
+        self.assertEqual(response.status_code, 201)
+        self.assertContains(response, '新的一列', status_code=201)
+        response = self.client.post(reverse('add_todo'), {'title': ''}, HTTP_ACCEPT='text/html-fragment')
+        self.assertEqual(response.status_code, 422)
+
+    def test_delete_returns_empty_fragment(self):
+        response = self.client.post(reverse('confirm_delete', args=[self.todo.id]), HTTP_HX_REQUEST='true')
+        self.assertEqual((response.status_code, response.content), (200, b''))
+        self.assertFalse(ToDo.objects.filter(id=self.todo.id).exists())
+
+    def test_without_header_keeps_redirect(self):
+        response = self.client.post(reverse('toggle_todo', args=[self.todo.id]))
+        self.assertRedirects(response, reverse('todos'))
+
+    def test_list_and_fragment_render_the_same_row(self):
+        row = self.client.post(reverse('toggle_todo', args=[self.todo.id]), HTTP_HX_REQUEST='true').content.decode()
+        self.assertIn(row.strip(), self.client.get(reverse('todos')).content.decode())
+
+
+@override_settings(
+    DATABASE_ROUTERS=['ToDos.sharding.UserShardRouter'],
+    TODO_SHARD_ALIASES=['shard0', 'shard1'],
+    TODO_SHARD_PLACEMENT_TIMEOUT=0,
+)
+class ShardingTests(TestCase):
+    databases = {'default', 'shard0', 'shard1'}
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        # 找出雜湊到不同分片的兩位使用者
+        self.users = {}
+        index = 0
+        while len(self.users) < 2:
+            user = User.objects.create_user(username=f'sharded{index}', password='testpass123')
+            self.users.setdefault(sharding.hashed_shard(user.id), user)
+            index += 1
+        self.user = self.users['shard0']
+
+    def add(self, user, title):
+        self.client.login(username=user.username, password='testpass123')
+        return self.client.post(reverse('add_todo'), {'title': title, 'due_date': '2030-01-02', 'priority': 'low'})
+
+    def test_todos_are_stored_on_the_users_shard(self):
+        for alias, user in self.users.items():
+            self.add(user, f'{alias} 的待辦')
+            self.assertEqual(ToDo.objects.using(alias).get(user=user).title, f'{alias} 的待辦')
+            self.assertEqual(self.client.get(reverse('todos')).context['stats']['total'], 1)
+            self.assertContains(self.client.get(reverse('todos')), f'{alias} 的待辦')
+        self.assertFalse(ToDo.objects.using('default').exists())
+        self.assertEqual(ToDo.objects.using('shard0').count(), 1)
+        self.assertEqual(UserShard.objects.get(user=self.user).alias, 'shard0')
+
+    def test_writes_are_refused_while_moving(self):
+        self.add(self.user, '搬移前')
+        UserShard.objects.filter(user=self.user).update(moving=True)
+        response = self.add(self.user, '搬移中')
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+        self.assertContains(self.client.get(reverse('todos')), '搬移前')
+
+    async def test_async_views_use_the_users_shard(self):
+        client = AsyncClient()
+        with use_todo_views(True):
+            for alias, user in self.users.items():
+                await client.aforce_login(user)
+                await client.post(reverse('add_todo'), {'title': f'{alias} 的待辦', 'due_date': '2030-01-02', 'priority': 'low'})
+                self.assertEqual(await ToDo.objects.using(alias).filter(user=user).acount(), 1)
+                self.assertContains(await client.get(reverse('todos')), f'{alias} 的待辦')
+                response = await client.post(reverse('add_todo'), {
+                    'title': f'{alias} 的重複待辦', 'due_date': '2030-01-02', 'priority': 'low', 'repeat': 'weekly',
+                })
+                self.assertEqual(await ToDoRecurrence.objects.using(alias).filter(user=user).acount(), 1)
+            await UserShard.objects.filter(user=self.user).aupdate(moving=True)
+            await client.aforce_login(self.user)
+            response = await client.post(reverse('add_todo'), {'title': '搬移中', 'due_date': '2030-01-02', 'priority': 'low'})
+            self.assertEqual(response.status_code, 503)
+            self.assertContains(await client.get(reverse('todos')), 'shard0 的待辦')
+
+    def test_rebalance_moves_everything_and_keeps_sync_consistent(self):
+        self.add(self.user, '搬移的待辦')
+        with sharding.for_user(self.user.id):
+            seed_todos(self.user, 30)
+            todo = ToDo.objects.get(title='搬移的待辦')
+            ToDoReminder.objects.create(user=self.user, todo_id=todo.id, due_date=todo.due_date)
+        archived = archive.archive_batch(datetime.date(2100, 1, 1), user_id=self.user.id)
+        self.assertGreater(archived, 0)
+        old_ids = set(ToDo.objects.using('shard0').values_list('id', flat=True))
+        changes = self.client.get(reverse('todo_changes'), {'limit': 1000}).json()
+
+        out = io.StringIO()
+        call_command('rebalance_shards', '--user', self.user.username, '--to', 'shard1', '--batch-size', '7', stdout=out)
+        self.assertIn(f'shard0 → shard1 todos {31 - archived} archived {archived}', out.getvalue())
+
+        for model in purge.PURGE_MODELS:
+            self.assertFalse(model.objects.using('shard0').filter(user=self.user).exists(), model)
+        moved = ToDo.objects.using('shard1').filter(user=self.user)
+        self.assertEqual(moved.count(), 31 - archived)
+        archived_ids = set(ArchivedToDo.objects.using('shard1').filter(user=self.user).values_list('id', flat=True))
+        self.assertEqual(len(archived_ids), archived)
+        self.assertFalse(archived_ids & set(moved.values_list('id', flat=True)))
+        self.assertEqual(ToDoReminder.objects.using('shard1').get(user=self.user).todo_id, moved.get(title='搬移的待辦').id)
+        with sharding.use('shard1'):
+            self.assertEqual(stored_stats(self.user), compute_stats(self.user))
+        self.assertEqual(UserShard.objects.get(user=self.user).alias, 'shard1')
+        self.assertEqual(self.client.get(reverse('todos')).context['stats']['total'], 31 - archived)
+
+        # 從搬移前的游標同步 舊的 id 被刪除 新的 id 出現
+        later = self.client.get(reverse('todo_changes'), {'since': changes['next_cursor'], 'limit': 1000}).json()
+        self.assertEqual({change['id'] for change in later['changes'] if change['deleted']}, old_ids)
+        self.assertEqual({change['id'] for change in later['changes'] if not change['deleted']}, set(moved.values_list('id', flat=True)))
+        self.assertEqual(self.add(self.user, '搬移後').status_code, 302)
+        self.assertTrue(ToDo.objects.using('shard1').filter(title='搬移後').exists())
+
+    def test_rebalance_all_moves_only_misplaced_users(self):
+        other = self.users['shard1']
+        self.add(other, '放錯分片')
+        UserShard.objects.filter(user=other).update(alias='shard0')
+        ToDo.objects.using('shard1').filter(user=other).delete()
+        with sharding.use('shard0'):
+            operations.create_todo(ToDo(user=other, title='放錯分片', due_date=datetime.date(2030, 1, 1), priority='low'))
+        self.add(self.user, '不需要搬移')
+
+        out = io.StringIO()
+        call_command('rebalance_shards', '--all', '--dry-run', stdout=out)
+        self.assertEqual(out.getvalue().strip(), f'{other.username}: shard0 → shard1')
+        self.assertEqual(UserShard.objects.get(user=other).alias, 'shard0')
+        call_command('rebalance_shards', '--all', stdout=io.StringIO())
+        self.assertEqual(UserShard.objects.get(user=other).alias, 'shard1')
+        self.assertEqual(list(ToDo.objects.using('shard1').filter(user=other).values_list('title', flat=True)), ['放錯分片'])
+        self.assertEqual(ToDo.objects.using('shard0').get().user_id, self.user.id)
+        with self.assertRaises(CommandError):
+            call_command('rebalance_shards', '--user', other.username, '--to', 'shard9', stdout=io.StringIO())
+
+
+    def admin_client(self):
+        admin_user = User.objects.create_superuser(username='boss', password='testpass123')
+        client = Client()
+        client.force_login(admin_user)
+        return client
+
+    def test_admin_lists_one_shard_at_a_time(self):
+        for alias, user in self.users.items():
+            self.add(user, f'{alias} 的待辦')
+        client = self.admin_client()
+        url = reverse('admin:ToDos_todo_changelist')
+        # 預設為第一個分片 與登入者所在的分片無關
+        for params, alias in (({}, 'shard0'), ({'shard': 'shard1'}, 'shard1')):
+            response = client.get(url, params)
+            self.assertContains(response, f'{alias} 的待辦')
+            other = 'shard1' if alias == 'shard0' else 'shard0'
+            self.assertNotContains(response, f'{other} 的待辦')
+
+        todo = ToDo.objects.using('shard1').get()
+        change_url = reverse('admin:ToDos_todo_change', args=[todo.id])
+        response = client.get(change_url, {'_changelist_filters': 'shard=shard1'})
+        self.assertContains(response, 'shard1 的待辦')
+        client.post(url + '?shard=shard1', {'action': 'mark_completed', '_selected_action': [todo.id]})
+        self.assertTrue(ToDo.objects.using('shard1').get().completed)
+        self.assertFalse(ToDo.objects.using('shard0').get().completed)
+
+    def test_admin_cannot_move_a_todo_to_another_owner(self):
+        self.add(self.user, '不能換擁有者')
+        todo = ToDo.objects.using('shard0').get()
+        other = self.users['shard1']
+        client = self.admin_client()
+        change_url = reverse('admin:ToDos_todo_change', args=[todo.id])
+        self.assertNotContains(client.get(change_url), 'name="user"')
+        response = client.post(change_url, {
+            'user': other.id, 'title': '改過的標題', 'description': '', 'due_date': '2030-01-02', 'priority': 'low',
+        })
+        self.assertEqual(response.status_code, 302)
+        todo = ToDo.objects.using('shard0').get()
+        self.assertEqual((todo.user_id, todo.title), (self.user.id, '改過的標題'))
+        self.assertFalse(ToDo.objects.using('shard1').exists())
+
+
+class RequestTimingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='timer', password='testpass123')
+        ToDo.objects.create(user=self.user, title='計時', due_date=datetime.date(2030, 1, 1), priority='low')
+
+    def get_list(self):
+        client = Client()
+        client.force_login(self.user)
+        return client.get(reverse('todos'))
+
+    def test_server_timing_header(self):
+        header = self.get_list()['Server-Timing']
+        self.assertRegex(header, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertRegex(header, r'tpl;dur=[\d.]+')
+        self.assertRegex(header, r'total;dur=[\d.]+')
+
+    @override_settings(DEBUG=False, TODO_TIMING={'SLOW_REQUEST_MS': 0, 'SLOWEST_QUERIES': 2})
+    def test_slow_requests_are_logged_with_slowest_queries(self):
+        with self.assertLogs('ToDos.slow_requests', 'WARNING') as logs:
+            self.get_list()
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['path'], reverse('todos'))
+        self.assertEqual(record['user_id'], str(self.user.id))
+        self.assertGreater(record['queries'], 0)
+        self.assertEqual(len(record['slowest_queries']), 2)
+        self.assertGreater(record['template_ms'], 0)
+
+    @override_settings(DEBUG=False, TODO_TIMING={'SLOW_REQUEST_MS': 0})
+    async def test_async_requests_are_timed(self):
+        # 非同步 views 的查詢在 sync_to_async 的執行緒中執行 同樣要記錄
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        with use_todo_views(True), self.assertLogs('ToDos.slow_requests', 'WARNING') as logs:
+            response = await client.get(reverse('todos'))
+        self.assertContains(response, '計時')
+        queries = int(re.search(r'desc="(\d+) queries"', response['Server-Timing']).group(1))
+        self.assertGreater(queries, 0)
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((record['user_id'], record['queries']), (str(self.user.id), queries))
+        self.assertGreater(record['template_ms'], 0)
+
+    @override_settings(TODO_TIMING={'SAMPLE_RATE': 0})
+    def test_unsampled_requests_are_untouched(self):
+        self.assertFalse(self.get_list().has_header('Server-Timing'))
+
+
+class RetryOnLockedTests(SimpleTestCase):
+    def flaky(self, failures, message='database is locked'):
+        calls = []
+
+        @retry_on_locked
+        def write():
+            calls.append(1)
+            if len(calls) <= failures:
+                raise OperationalError(message)
+            return 'ok'
+        return write, calls
+
+    @mock.patch('ToDos.operations.time.sleep')
+    def test_retries_locked_errors_with_backoff(self, sleep):
+        write, calls = self.flaky(2)
+        self.assertEqual(write(), 'ok')
+        self.assertEqual(len(calls), 3)
+        first, second = [call.args[0] for call in sleep.call_args_list]
+        self.assertLessEqual(first, 0.075)  # 0.05 * 抖動上限 1.5
+        self.assertGreaterEqual(second, 0.05)  # 0.1 * 抖動下限 0.5
+
+    @mock.patch('ToDos.operations.time.sleep')
+    @override_settings(TODO_WRITE_RETRIES=2)
+    def test_gives_up_after_retries(self, sleep):
+        write, calls = self.flaky(5)
+        with self.assertRaises(OperationalError):
+            write()
+        self.assertEqual(len(calls), 3)
+
+    @mock.patch('ToDos.operations.time.sleep')
+    def test_other_errors_are_not_retried(self, sleep):
+        write, calls = self.flaky(1, 'no such table')
+        with self.assertRaises(OperationalError):
+            write()
+        self.assertEqual(len(calls), 1)